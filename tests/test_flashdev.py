@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_flashdev
+----------------------------------
+
+Tests for reading the flash in the PIC microcontroller (`picmicro`) and
+the W25X serial flash behind the FPGA's SPI interface (`flashdev` and
+`xsspi`), run against the simulated XuLA board in `xssim`.
+"""
+
+import os
+import sys
+import unittest
+
+# The xstools modules import each other as top-level modules.
+XSTOOLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'xstools')
+sys.path.insert(0, XSTOOLS_DIR)
+
+from xssim import XsSimBoard, XsSimMemory
+from xsusb import XsUsb
+from xsjtag import XsJtag
+from picmicro import Pic18f14k50
+from flashdev import W25X
+
+SPI_ID = 0xf0
+
+
+def flash_byte(addr):
+    """Return the byte stored at an address of a simulated flash."""
+
+    return (addr * 7 + (addr >> 8)) & 0xff
+
+
+class PicSimBoard(XsSimBoard):
+
+    """Simulated board whose microcontroller answers flash reads."""
+
+    def _command_length(self):
+        if self._cmds[0] == XsUsb.READ_FLASH_CMD:
+            return 5
+        return XsSimBoard._command_length(self)
+
+    def _do_command(self, cmd):
+        if cmd[0] == XsUsb.READ_FLASH_CMD:
+            addr = cmd[2] | cmd[3] << 8 | cmd[4] << 16
+            self._respond(cmd + bytearray(flash_byte(addr + i) for i in range(cmd[1])))
+        else:
+            XsSimBoard._do_command(self, cmd)
+
+
+class SpiFlash:
+
+    """Serial flash on the SPI interface, standing in for the words of an XsSimMemory.
+
+    Writing address 0 de-selects the flash, and the other addresses move bytes to and
+    from it. A transfer through address 1 de-selects the flash when it's done.
+    """
+
+    _JEDEC_ID = (0xef, 0x30, 0x11)  # W25X10.
+
+    def __init__(self):
+        self.cmd = []  # Bytes sent since the flash was selected.
+        self.num_out = 0  # Bytes received since the flash was selected.
+
+    def _deselect(self):
+        self.cmd = []
+        self.num_out = 0
+
+    def __setitem__(self, addr, value):
+        if addr == 0:
+            self._deselect()
+            return
+        self.cmd.append(value)
+        if addr == 1:
+            self._deselect()
+
+    def get(self, addr, default):
+        if self.cmd[:1] == [W25X._JEDEC_ID_CMD]:
+            value = self._JEDEC_ID[self.num_out]
+        elif self.cmd[:1] == [W25X._FAST_READ_CMD] and len(self.cmd) == 5:
+            value = flash_byte((self.cmd[1] << 16 | self.cmd[2] << 8 | self.cmd[3]) + self.num_out)
+        else:
+            value = default
+        self.num_out += 1
+        if addr == 1:
+            self._deselect()
+        return value
+
+
+class TestPic(unittest.TestCase):
+
+    def setUp(self):
+        self.pic = Pic18f14k50(xsusb=XsUsb(transport=PicSimBoard()))
+
+    def test_read_blk_into(self):
+        buf = bytearray(40)
+        self.pic.read_blk_into(0x1000, buf, 16, offset=20)
+        self.assertEqual(buf[20:36], bytearray(flash_byte(0x1000 + i) for i in range(16)))
+        self.assertEqual(buf[20:36], bytearray(self.pic.read_blk(0x1000, 16)))
+        self.assertEqual(buf[:20] + buf[36:], bytearray(24))
+        # The response buffer is reused for reads of the same size.
+        response = self.pic._response
+        self.pic.read_blk_into(0x1010, buf, 16)
+        self.assertTrue(self.pic._response is response)
+
+    def test_read(self):
+        hex_data = self.pic.read(0x0800, 0x0a00)
+        self.assertEqual((hex_data.minaddr(), hex_data.maxaddr()), (0x0800, 0x09ff))
+        self.assertEqual(bytearray(hex_data.tobinstr()), bytearray(flash_byte(a) for a in range(0x0800, 0x0a00)))
+
+
+class TestW25x(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = XsSimBoard(modules={SPI_ID: XsSimMemory(24, 8, contents=SpiFlash())})
+        self.flash = W25X(module_id=SPI_ID, xsjtag=XsJtag(XsUsb(transport=self.sim)))
+
+    def test_chip(self):
+        self.assertEqual(self.flash.device_name, 'W25X10')
+
+    def test_read(self):
+        hex_data = self.flash.read(0x1234, 0x1634)
+        self.assertEqual((hex_data.minaddr(), hex_data.maxaddr()), (0x1234, 0x1633))
+        self.assertEqual(bytearray(hex_data.tobinstr()), bytearray(flash_byte(a) for a in range(0x1234, 0x1634)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_ramdev
+----------------------------------
+
+Tests for reading the SDRAM through `ramdev`, run against the simulated
+XuLA board in `xssim`.
+"""
+
+import os
+import sys
+import array
+import unittest
+
+# The xstools modules import each other as top-level modules.
+XSTOOLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'xstools')
+sys.path.insert(0, XSTOOLS_DIR)
+
+from xserror import XsMinorError
+from xssim import XsSimBoard, XsSimMemory
+from xsusb import XsUsb
+from xsjtag import XsJtag
+from ramdev import Sdram_8MB
+
+MEM_ID = 3
+
+
+class TestSdram(unittest.TestCase):
+
+    def setUp(self):
+        # Each word holds its own address, so the bytes of word i are i >> 8 and i & 0xff.
+        self.mem = XsSimMemory(24, 16, contents=dict((i, i) for i in range(4096)))
+        self.xsusb = XsUsb(transport=XsSimBoard(modules={MEM_ID: self.mem}))
+        self.sdram = Sdram_8MB(module_id=MEM_ID, xsjtag=XsJtag(self.xsusb))
+
+    def _bytes(self, bottom, top):
+        """Return the bytes the SDRAM holds from bottom to top, with the most-significant byte of each word first."""
+
+        return bytearray(b for i in range(bottom // 2, (top + 1) // 2) for b in (i >> 8, i & 0xff))
+
+    def test_read_into(self):
+        buf = bytearray(100)
+        self.assertEqual(self.sdram.read_into(buf, 0x20, 0x5f, offset=10), 64)
+        self.assertEqual(buf[10:74], self._bytes(0x20, 0x5f))
+        self.assertEqual(buf[:10] + buf[74:], bytearray(36))
+        buf = array.array('B', bytearray(64))
+        self.sdram.read_into(buf, 0x100, 0x13f)
+        self.assertEqual(bytearray(buf), self._bytes(0x100, 0x13f))
+
+    def test_chunked(self):
+        self.xsusb.link_profile = {'latency': 0.001, 'throughput': 1.0e6, 'chunk_size': 64}
+        buf = bytearray(2000)
+        self.sdram.read_into(buf, 0, 1999)
+        self.assertEqual(buf, self._bytes(0, 1999))
+
+    def test_read(self):
+        hex_data = self.sdram.read(0x200, 0x3ff)
+        self.assertEqual((hex_data.minaddr(), hex_data.maxaddr()), (0x200, 0x3ff))
+        self.assertEqual(bytearray(hex_data.tobinstr()), self._bytes(0x200, 0x3ff))
+
+    def test_errors(self):
+        self.assertRaises(XsMinorError, self.sdram.read_into, bytearray(63), 0, 63)
+        self.assertRaises(XsMinorError, self.sdram.read_into, bytearray(64), 0, 62)
+        self.assertRaises(XsMinorError, self.sdram.read_into, bytearray(64), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_xsadc
+----------------------------------
+
+Tests for the ADC sampling in `xsusb` and the ring buffer in `xsadc`.
+"""
+
+import os
+import sys
+import math
+import time
+import array
+import unittest
+
+# The xstools modules import each other as top-level modules.
+XSTOOLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'xstools')
+sys.path.insert(0, XSTOOLS_DIR)
+
+import xsadc
+from xserror import XsMajorError
+from xssim import XsSimBoard
+from xsusb import XsUsb
+from xsadc import XsAdcSampler
+
+
+class FakeXsUsb:
+
+    """Stand-in for XsUsb that hands out batches of ADC samples and then fails."""
+
+    def __init__(self, num_batches):
+        self.num_batches = num_batches
+        self.num_calls = 0
+
+    def sample_adc(self, aio=0, num_samples=1, batch_size=1):
+        self.num_calls += 1
+        if self.num_calls > self.num_batches:
+            raise XsMajorError('Lost the board.')
+        t = float(self.num_calls * num_samples)
+        return array.array('d', [t + i for i in range(num_samples)]), array.array('d', [aio] * num_samples)
+
+
+class TestSampleAdc(unittest.TestCase):
+
+    def test_replies_in_separate_packets(self):
+        sim = XsSimBoard()
+        sim.aio = [1.0, 2.0]
+        xsusb = XsUsb(transport=sim)
+        times, volts = xsusb.sample_adc(1, num_samples=100, batch_size=30)
+        self.assertEqual(len(volts), 100)
+        count = round(2.0 / 2.048 * 1023)
+        self.assertTrue(all(v == count * XsUsb._ADC_VOLTS_PER_COUNT for v in volts))
+        self.assertTrue(all(t0 < t1 for t0, t1 in zip(times[:-1], times[1:])))
+        # Each 3-byte reply takes a read of its own.
+        self.assertEqual(sim.num_reads, 100)
+
+
+class SamplerTests:
+
+    """Ring buffer and statistics tests run with and without NumPy."""
+
+    def _sampler(self, capacity):
+        return XsAdcSampler(None, capacity=capacity, batch_size=4)
+
+    def _batch(self, start, n, period=1.0):
+        # Batches come from XsUsb.sample_adc as arrays of doubles (or NumPy arrays, which take them too).
+        return array.array('d', [start + i * period for i in range(n)]), array.array('d', [float(start + i) for i in range(n)])
+
+    def test_no_wrap(self):
+        sampler = self._sampler(10)
+        sampler._store(*self._batch(0, 4))
+        times, volts = sampler.get_samples()
+        self.assertEqual(list(volts), [0.0, 1.0, 2.0, 3.0])
+        self.assertEqual(list(sampler.get_samples(2)[1]), [2.0, 3.0])
+
+    def test_wrap(self):
+        sampler = self._sampler(10)
+        for start in range(0, 24, 4):
+            sampler._store(*self._batch(start, 4))
+        # The last batch went in across the end of the ring buffer.
+        times, volts = sampler.get_samples()
+        self.assertEqual(list(volts), [float(v) for v in range(14, 24)])
+        self.assertEqual(list(times), [float(v) for v in range(14, 24)])
+        self.assertEqual(list(sampler.get_samples(3)[1]), [21.0, 22.0, 23.0])
+        self.assertEqual(list(sampler.get_samples(100)[1]), list(volts))
+
+    def test_wrap_at_end(self):
+        sampler = self._sampler(8)
+        for start in range(0, 8, 4):
+            sampler._store(*self._batch(start, 4))
+        self.assertEqual(list(sampler.get_samples()[1]), [float(v) for v in range(8)])
+        sampler._store(*self._batch(8, 4))
+        self.assertEqual(list(sampler.get_samples()[1]), [float(v) for v in range(4, 12)])
+
+    def test_stats(self):
+        sampler = self._sampler(100)
+        periods = [1.0, 2.0, 4.0, 3.0]
+        start = 0.0
+        for period in periods:
+            sampler._store(*self._batch(start, 5, period))
+            start += 5 * period
+        mean = sum(periods) / len(periods)
+        variance = sum((p - mean) ** 2 for p in periods) / (len(periods) - 1)
+        stats = sampler.get_stats()
+        self.assertEqual(stats['samples'], 20)
+        self.assertAlmostEqual(stats['period'], mean)
+        self.assertAlmostEqual(stats['jitter'], math.sqrt(variance))
+        self.assertAlmostEqual(stats['rate'], 19 / (start - periods[-1]))
+        sampler.clear()
+        self.assertEqual(sampler.get_stats(), {'samples': 0, 'rate': 0.0, 'period': 0.0, 'jitter': 0.0})
+
+    def _wait_for_error(self, sampler):
+        deadline = time.time() + 5.0
+        while sampler.is_running() and time.time() < deadline:
+            time.sleep(0.001)
+        self.assertFalse(sampler.is_running())
+
+    def test_stop_raises_error(self):
+        xsusb = FakeXsUsb(num_batches=3)
+        sampler = XsAdcSampler(xsusb, aio=1, capacity=16, batch_size=4)
+        sampler.start()
+        self._wait_for_error(sampler)
+        self.assertRaises(XsMajorError, sampler.stop)
+        self.assertEqual(sampler.get_stats()['samples'], 12)
+        self.assertEqual(list(sampler.get_samples()[1]), [1.0] * 12)
+        # The sampler can be restarted after an error, and stopping it again is harmless.
+        sampler.stop()
+        xsusb.num_batches = 5  # The failed call counted too.
+        sampler.start()
+        self._wait_for_error(sampler)
+        self.assertRaises(XsMajorError, sampler.stop)
+        self.assertEqual(sampler.get_stats()['samples'], 16)
+
+    def test_sim_board(self):
+        sim = XsSimBoard()
+        sim.aio = [0.5, 1.5]
+        sampler = XsAdcSampler(XsUsb(transport=sim), aio=0, capacity=50, batch_size=16)
+        sampler.start()
+        deadline = time.time() + 5.0
+        while sampler.get_stats()['samples'] < 100 and time.time() < deadline:
+            time.sleep(0.001)
+        sampler.stop()
+        times, volts = sampler.get_samples()
+        self.assertEqual(len(volts), 50)
+        self.assertTrue(all(abs(v - 0.5) < 0.002 for v in volts))
+
+
+class TestSamplerArrays(SamplerTests, unittest.TestCase):
+
+    def setUp(self):
+        self.numpy = xsadc.numpy
+        xsadc.numpy = None
+
+    def tearDown(self):
+        xsadc.numpy = self.numpy
+
+    def test_array_type(self):
+        self.assertTrue(isinstance(self._sampler(4).get_samples()[0], array.array))
+
+
+@unittest.skipIf(xsadc.numpy is None, 'NumPy is not installed')
+class TestSamplerNumpy(SamplerTests, unittest.TestCase):
+    pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_xsbackend
+----------------------------------
+
+Tests for the USB backends in `xsbackend`.
+
+The libusb1 backend is run against a fake python-libusb1 module whose
+device sends back canned USB packets the way a real board does: a read
+URB completes when it's full or when a short packet arrives.
+"""
+
+import os
+import sys
+import array
+import unittest
+from collections import deque
+
+# The xstools modules import each other as top-level modules.
+XSTOOLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'xstools')
+sys.path.insert(0, XSTOOLS_DIR)
+
+import xsbackend
+from xserror import XsMajorError
+
+PACKET_SIZE = 64
+VENDOR_ID, PRODUCT_ID = 0x04d8, 0xff8c
+ENDPOINT_OUT, ENDPOINT_IN = 0x01, 0x81
+
+
+class FakeUSBError(Exception):
+    pass
+
+
+class FakeTransfer:
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.submitted = False
+
+    def setBulk(self, endpoint, buffer_or_len, callback=None, user_data=None, timeout=0):
+        self.endpoint = endpoint
+        self.buffer = bytearray(buffer_or_len)
+        self.callback = callback
+        self.user_data = user_data
+        self.received = bytearray()
+        self.status = None
+
+    def submit(self):
+        assert not self.submitted
+        self.submitted = True
+        self.handle.context.pending.append(self)
+
+    def cancel(self):
+        raise FakeUSBError('Cancel is not expected.')
+
+    def getUserData(self):
+        return self.user_data
+
+    def getStatus(self):
+        return self.status
+
+    def getBuffer(self):
+        return self.buffer
+
+    def getActualLength(self):
+        return len(self.received) if self.endpoint & 0x80 else len(self.buffer)
+
+    def try_complete(self):
+        """Move data for the transfer and return True if it's complete."""
+
+        if not self.endpoint & 0x80:
+            self.handle.written.append(bytearray(self.buffer))
+            self.status = FakeUsb1.TRANSFER_COMPLETED
+            return True
+        packets = self.handle.packets
+        while packets:
+            packet = packets[0]
+            if len(self.received) + len(packet) > len(self.buffer):
+                self.status = FakeUsb1.TRANSFER_OVERFLOW
+                return True
+            packets.popleft()
+            self.received += packet
+            if len(packet) < PACKET_SIZE or len(self.received) == len(self.buffer):
+                # A short packet or a full buffer ends the transfer.
+                self.buffer[:len(self.received)] = self.received
+                self.status = FakeUsb1.TRANSFER_COMPLETED
+                return True
+        return False
+
+
+class FakeHandle:
+
+    def __init__(self, context):
+        self.context = context
+        self.packets = deque()  # USB packets the device sends to the host.
+        self.written = []  # Data of the OUT transfers, in the order they completed.
+
+    def claimInterface(self, interface):
+        pass
+
+    def releaseInterface(self, interface):
+        pass
+
+    def close(self):
+        pass
+
+    def getTransfer(self):
+        return FakeTransfer(self)
+
+    def send(self, data):
+        """Queue a response from the device, sent in packets that end with a short one."""
+
+        for i in range(0, len(data), PACKET_SIZE):
+            self.packets.append(bytearray(data[i:i + PACKET_SIZE]))
+
+
+class FakeDevice:
+
+    def __init__(self, context):
+        self.handle = FakeHandle(context)
+
+    def getBusNumber(self):
+        return 1
+
+    def getDeviceAddress(self):
+        return 5
+
+    def getPortNumberList(self):
+        return [2, 1]
+
+    def getVendorID(self):
+        return VENDOR_ID
+
+    def getProductID(self):
+        return PRODUCT_ID
+
+    def open(self):
+        return self.handle
+
+
+class FakeContext:
+
+    def __init__(self):
+        self.pending = []  # Submitted transfers in the order they were submitted.
+        self.devices = [FakeDevice(self)]
+
+    def getDeviceList(self, skip_on_error=False):
+        return self.devices
+
+    def handleEvents(self):
+        # The device fills the URBs in the order they were submitted.
+        completed = []
+        for transfer in list(self.pending):
+            if not transfer.try_complete():
+                break
+            self.pending.remove(transfer)
+            transfer.submitted = False
+            completed.append(transfer)
+        if not completed:
+            raise AssertionError('handleEvents would wait forever for URBs the device will never fill.')
+        for transfer in completed:
+            transfer.callback(transfer)
+
+
+class FakeUsb1:
+
+    """Stand-in for the parts of the usb1 module the libusb1 backend uses."""
+
+    TRANSFER_COMPLETED = 0
+    TRANSFER_OVERFLOW = 6
+    USBError = FakeUSBError
+    USBContext = FakeContext
+
+
+class TestLibusb1Backend(unittest.TestCase):
+
+    def setUp(self):
+        self.usb1 = xsbackend.usb1
+        xsbackend.usb1 = FakeUsb1
+        self.backend = xsbackend.Libusb1Backend(urb_size=128, num_urbs=4)
+        devs = self.backend.enumerate(VENDOR_ID, PRODUCT_ID)
+        self.assertEqual(len(devs), 1)
+        self.dev = devs[0]
+        self.transport = self.backend.open(self.dev)
+        self.handle = self.dev.device.handle
+
+    def tearDown(self):
+        self.backend.dispose(self.dev)
+        xsbackend.usb1 = self.usb1
+
+    def test_device(self):
+        self.assertEqual((self.dev.bus, self.dev.address, self.dev.port_numbers), (1, 5, (2, 1)))
+        self.assertTrue(self.backend.open(self.dev) is self.transport)
+
+    def test_write_chunks(self):
+        data = bytearray(range(256)) * 3
+        self.assertEqual(self.transport.write(ENDPOINT_OUT, data), len(data))
+        self.assertEqual([len(w) for w in self.handle.written], [128] * 6)
+        self.assertEqual(bytearray().join(self.handle.written), data)
+
+    def test_read_full(self):
+        data = bytearray(range(200)) * 2
+        self.handle.send(data)
+        self.assertEqual(bytearray(self.transport.read(ENDPOINT_IN, len(data))), data)
+        self.assertFalse(self.handle.packets)
+
+    def test_read_short_packet(self):
+        # Several responses, each ending with a short packet, are waiting to be read.
+        first, second = bytearray(range(150)), bytearray(range(3))
+        self.handle.send(first)
+        self.handle.send(second)
+        # The read stops at the short packet that ends the first response...
+        self.assertEqual(bytearray(self.transport.read(ENDPOINT_IN, 400)), first)
+        # ... and the next one gets the second response into a buffer.
+        buf = array.array('B', bytearray(10))
+        self.assertEqual(self.transport.read(ENDPOINT_IN, buf), 3)
+        self.assertEqual(bytearray(buf[:3]), second)
+
+    def test_read_error(self):
+        self.handle.send(bytearray(100))
+        self.assertRaises(XsMajorError, self.transport.read, ENDPOINT_IN, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
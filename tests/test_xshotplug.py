@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_xshotplug
+----------------------------------
+
+Tests for the USB hotplug watcher in `xshotplug`.
+
+The boards come and go on a simulated clock, so the polling backoff and the
+timeouts are checked without waiting for them.
+"""
+
+import os
+import sys
+import unittest
+
+# The xstools modules import each other as top-level modules.
+XSTOOLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'xstools')
+sys.path.insert(0, XSTOOLS_DIR)
+
+import xshotplug
+from xshotplug import XsHotplug
+
+
+class FakeClock:
+
+    """Stand-in for the time module where sleeping just moves the clock forward."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, secs):
+        self.sleeps.append(secs)
+        self.now += secs
+
+
+class FakePorts:
+
+    """Enumerator whose boards are attached during set periods on the fake clock."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.boards = {}  # (attach time, detach time) keyed by board.
+
+    def attach(self, board, start=0.0, end=None):
+        self.boards[board] = (self.clock.now + start, None if end is None else self.clock.now + end)
+
+    def __call__(self):
+        now = self.clock.now
+        return [b for b, (start, end) in self.boards.items() if start <= now and (end is None or now < end)]
+
+
+class TestHotplug(unittest.TestCase):
+
+    def setUp(self):
+        self.time = xshotplug.time
+        self.clock = xshotplug.time = FakeClock()
+        self.ports = FakePorts(self.clock)
+
+    def tearDown(self):
+        xshotplug.time = self.time
+
+    def _hotplug(self):
+        return XsHotplug(enumerator=self.ports, use_udev=False)
+
+    def test_events(self):
+        self.ports.attach('a')
+        with self._hotplug() as hotplug:
+            self.assertEqual(hotplug.get_devices(), ['a'])
+            self.assertEqual(hotplug.get_events(), [])
+            self.ports.attach('b')
+            del self.ports.boards['a']
+            self.assertEqual(hotplug.get_events(), [('disconnect', 'a'), ('connect', 'b')])
+            self.assertEqual(hotplug.get_devices(), ['b'])
+
+    def test_wait_for_connect_backoff(self):
+        self.ports.attach('a')
+        self.ports.attach('b', start=3.0)
+        with self._hotplug() as hotplug:
+            self.assertEqual(hotplug.wait_for_connect(timeout=10.0), ['b'])
+        sleeps = self.clock.sleeps
+        # The polling interval doubles up to its limit while nothing changes.
+        self.assertEqual(sleeps[:6], [0.01, 0.02, 0.04, 0.08, 0.16, 0.32])
+        self.assertTrue(all(s == XsHotplug._MAX_POLL_INTERVAL for s in sleeps[6:]))
+        self.assertTrue(3.0 <= sum(sleeps) < 3.0 + XsHotplug._MAX_POLL_INTERVAL)
+
+    def test_wait_for_connect_known(self):
+        self.ports.attach('a')
+        with self._hotplug() as hotplug:
+            # A board that's already attached counts as new if it isn't known.
+            self.assertEqual(hotplug.wait_for_connect(known=()), ['a'])
+            self.assertEqual(self.clock.sleeps, [])
+
+    def test_wait_for_connect_timeout(self):
+        with self._hotplug() as hotplug:
+            self.assertEqual(hotplug.wait_for_connect(timeout=2.0), [])
+        # The last sleep is cut short so the wait ends right at the timeout.
+        self.assertAlmostEqual(sum(self.clock.sleeps), 2.0)
+        self.assertTrue(max(self.clock.sleeps) <= XsHotplug._MAX_POLL_INTERVAL)
+
+    def test_wait_for_disconnect(self):
+        self.ports.attach('a', end=1.0)
+        self.ports.attach('b', end=2.0)
+        with self._hotplug() as hotplug:
+            self.assertTrue(hotplug.wait_for_disconnect('a', timeout=5.0))
+            self.assertEqual(hotplug.get_devices(), ['b'])
+            # The board that was pulled out sped up the polling again.
+            num_sleeps = len(self.clock.sleeps)
+            self.assertFalse(hotplug.wait_for_disconnect(timeout=0.5))
+            self.assertEqual(self.clock.sleeps[num_sleeps], XsHotplug._MIN_POLL_INTERVAL)
+            self.assertTrue(hotplug.wait_for_disconnect(timeout=5.0))
+            self.assertEqual(hotplug.get_devices(), [])
+
+    def test_wait_for_events(self):
+        self.ports.attach('a', start=0.5, end=0.7)
+        with self._hotplug() as hotplug:
+            self.assertEqual(hotplug.wait_for_events(timeout=1.0), [('connect', 'a')])
+            self.assertEqual(hotplug.wait_for_events(timeout=1.0), [('disconnect', 'a')])
+            self.assertEqual(hotplug.wait_for_events(timeout=1.0), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_xsjtag
+----------------------------------
+
+Tests for the JTAG state tracking in `xsjtag`, run against the simulated
+XuLA board in `xssim`.
+"""
+
+import os
+import sys
+import itertools
+import unittest
+
+# The xstools modules import each other as top-level modules.
+XSTOOLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'xstools')
+sys.path.insert(0, XSTOOLS_DIR)
+
+from xssim import XsSimBoard
+from xsusb import XsUsb
+from xsjtag import XsJtag
+from xilfpga import Xc3s200avq100
+
+IDCODE_INSTR = Xc3s200avq100._IDCODE_INSTR
+BYPASS_INSTR = Xc3s200avq100._BYPASS_INSTR
+
+
+class LinkWithoutCounts:
+
+    """XsUsb wrapper that hides the counters of FPGA reprogramming and TAP resets."""
+
+    def __init__(self, xsusb):
+        self._xsusb = xsusb
+
+    def __getattr__(self, name):
+        if name in ('prog_count', 'tap_reset_count'):
+            raise AttributeError(name)
+        return getattr(self._xsusb, name)
+
+
+class TestIrSkip(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = XsSimBoard()
+        self.xsusb = XsUsb(transport=self.sim)
+        self.xsjtag = XsJtag(self.xsusb)
+        self.idcode = self._load()
+
+    def _load(self, instruction=IDCODE_INSTR):
+        return self.xsjtag.load_ir_then_dr(instruction, num_return_bits=32)
+
+    def _check_rescan(self):
+        """Check that the next IDCODE load shifts the IR again and then skips it."""
+
+        skips = self.xsjtag.num_ir_skips
+        self.assertEqual(self._load(), self.idcode)
+        self.assertEqual(self.xsjtag.num_ir_skips, skips)
+        self.assertEqual(self.xsjtag.get_instruction(), IDCODE_INSTR)
+        self.assertEqual(self._load(), self.idcode)
+        self.assertEqual(self.xsjtag.num_ir_skips, skips + 1)
+
+    def test_skip(self):
+        self.assertEqual(self.xsjtag.get_instruction(), IDCODE_INSTR)
+        for i in range(3):
+            self.assertEqual(self._load(), self.idcode)
+        self.assertEqual(self.xsjtag.num_ir_skips, 3)
+        self._load(BYPASS_INSTR)
+        self.assertEqual(self.xsjtag.num_ir_skips, 3)
+        self.assertEqual(self.xsjtag.get_instruction(), BYPASS_INSTR)
+        self.xsjtag.load_ir_then_dr(BYPASS_INSTR, force=True)
+        self.assertEqual(self.xsjtag.num_ir_skips, 3)
+
+    def test_prog(self):
+        self.xsusb.set_prog(0)
+        self.xsusb.set_prog(1)
+        self.assertEqual(self.xsjtag.get_instruction(), None)
+        self._check_rescan()
+
+    def test_test_logic_reset(self):
+        self.xsjtag.reset_tap()
+        self.assertEqual(self.xsjtag.get_instruction(), None)
+        self._check_rescan()
+        for i in range(5):
+            self.xsjtag.shift_tms(1)
+        self.assertEqual(self.xsjtag.get_instruction(), None)
+        self._check_rescan()
+
+    def test_update_ir(self):
+        # Passing through update-IR loads whatever is in the IR shift register.
+        self.xsjtag.goto_state(XsJtag.UPDATE_IR)
+        self.assertEqual(self.xsjtag.get_instruction(), None)
+        self._check_rescan()
+        self.xsjtag.go_thru_tap_states('Select-DR-Scan', 'Select-IR-Scan', 'Capture-IR', 'Exit1-IR', 'Update-IR')
+        self.assertEqual(self.xsjtag.get_instruction(), None)
+        self._check_rescan()
+
+    def test_tap_reset_count(self):
+        # Calibrating the link clocks the TAP into test-logic-reset behind the XsJtag object's back.
+        self.xsusb.calibrate(sizes=(64,), repeats=1, save=False)
+        self.assertEqual(self.xsjtag.get_tap_state_id(), XsJtag.INVALID)
+        self.assertEqual(self.xsjtag.get_instruction(), None)
+        self._check_rescan()
+
+    def test_link_without_counts(self):
+        xsjtag = XsJtag(LinkWithoutCounts(self.xsusb))
+        for i in range(3):
+            self.assertEqual(xsjtag.load_ir_then_dr(IDCODE_INSTR, num_return_bits=32), self.idcode)
+        self.assertEqual(xsjtag.get_instruction(), None)
+        self.assertEqual(xsjtag.num_ir_skips, 0)
+
+
+class TestNoReturn(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = XsSimBoard()
+        self.xsjtag = XsJtag(XsUsb(transport=self.sim))
+        self.idcode = self.xsjtag.load_ir_then_dr(IDCODE_INSTR, num_return_bits=32)
+
+    def test_runtest(self):
+        reads = self.sim.num_reads
+        with self.xsjtag.no_return():
+            self.xsjtag.runtest(100)
+            self.xsjtag.runtest(200)
+            # Scans still get their TDO bits.
+            self.assertEqual(self.xsjtag.load_ir_then_dr(IDCODE_INSTR, num_return_bits=32, force=True), self.idcode)
+            self.xsjtag.checkpoint()
+        self.assertEqual(self.sim.num_reads - reads, 2)
+        self.assertTrue(self.sim.return_enabled)
+
+    def test_deferred(self):
+        writes, reads, idle = self.sim.num_writes, self.sim.num_reads, self.sim.fpga.idle_clocks
+        with self.xsjtag.deferred():
+            with self.xsjtag.no_return():
+                self.xsjtag.runtest(100)
+                self.xsjtag.runtest(200)
+            # The commands that turn the echoes off and back on are queued with the runtests.
+            self.assertTrue(self.sim.return_enabled)
+            self.assertEqual(self.sim.num_writes, writes)
+        self.assertEqual((self.sim.num_writes - writes, self.sim.num_reads - reads), (1, 0))
+        self.assertEqual(self.sim.fpga.idle_clocks - idle, 300)
+        self.assertTrue(self.sim.return_enabled)
+        self.xsjtag.runtest(1)
+
+
+class TestStats(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = XsSimBoard()
+        self.xsjtag = XsJtag(XsUsb(transport=self.sim))
+        self.xsjtag.reset_tap()
+
+    def test_scan(self):
+        with self.xsjtag.measure() as cost:
+            self.xsjtag.load_ir_then_dr(IDCODE_INSTR, num_return_bits=32)
+        self.assertEqual((cost['num_tdo_bits'], cost['round_trips']), (32, 1))
+        self.assertTrue(cost['num_tdi_bits'] >= 6)
+        self.assertTrue(cost['num_jtag_cmds'] > 0)
+        self.assertEqual(cost['payload_bytes'], (cost['num_tdi_bits'] + 32) / 8.0)
+        self.assertEqual(cost['payload_bytes'] + cost['overhead_bytes'], cost['bytes_out'] + cost['bytes_in'])
+
+    def test_runtest(self):
+        with self.xsjtag.measure() as cost:
+            self.xsjtag.runtest(100)
+            self.xsjtag.runtest(50)
+        self.assertEqual((cost['num_runtests'], cost['num_tcks'], cost['num_jtag_cmds']), (2, 150, 0))
+
+    def test_pending_bits(self):
+        with self.xsjtag.measure() as cost:
+            # The TMS bits are still in the buffer when the block ends, so measuring sends them.
+            self.xsjtag.goto_state(XsJtag.SHIFT_DR)
+        self.assertEqual((cost['num_tms_bits'], cost['num_writes']), (4, 1))
+        self.assertEqual(self.sim.fpga.state, 'Shift-DR')
+
+
+class TestTmsPaths(unittest.TestCase):
+
+    def _walk(self, state, tms):
+        """Return the states the TAP goes through when clocked with the TMS bits, starting from a state."""
+
+        states = []
+        for i in range(tms.len):
+            state = XsJtag._NEXT_TAP_STATE[state][tms.uint >> i & 1]
+            states.append(state)
+        return states
+
+    def _shortest(self, start, target):
+        """Return the length of the shortest TMS sequence between two states by trying them all."""
+
+        for length in itertools.count():
+            for bits in itertools.product((0, 1), repeat=length):
+                state = start
+                for bit in bits:
+                    state = XsJtag._NEXT_TAP_STATE[state][bit]
+                if state == target:
+                    return length
+
+    def test_shortest(self):
+        for start in range(XsJtag.INVALID):
+            for target in range(XsJtag.INVALID):
+                tms, clobbers_ir = XsJtag._TMS_PATHS[start][target]
+                states = self._walk(start, tms)
+                self.assertEqual(states[-1:] or [start], [target])
+                self.assertEqual(tms.len, self._shortest(start, target))
+                self.assertEqual(clobbers_ir, bool(set(states) & set([XsJtag.TEST_LOGIC_RESET, XsJtag.UPDATE_IR])))
+        tms, clobbers_ir = XsJtag._TMS_PATHS[XsJtag.SHIFT_DR][XsJtag.SHIFT_IR]
+        self.assertEqual((tms.len, clobbers_ir), (6, False))
+
+    def test_from_invalid(self):
+        for target in range(XsJtag.INVALID):
+            tms, clobbers_ir = XsJtag._TMS_PATHS[XsJtag.INVALID][target]
+            # Five TMS ones reset the TAP from any state before going on to the target.
+            self.assertEqual(tms.uint & 0x1f, 0x1f)
+            self.assertTrue(clobbers_ir)
+            for start in range(XsJtag.INVALID):
+                self.assertEqual(self._walk(start, tms)[-1], target)
+
+    def test_goto_state(self):
+        sim = XsSimBoard()
+        xsjtag = XsJtag(XsUsb(transport=sim))
+        for start in XsJtag.TAP_STATE_NAMES[:-1]:
+            for target in XsJtag.TAP_STATE_NAMES[:-1]:
+                xsjtag.goto_state(start)
+                xsjtag.goto_state(target)
+                xsjtag.flush()
+                self.assertEqual((start, xsjtag.get_tap_state()), (start, target))
+                self.assertEqual((start, sim.fpga.state), (start, target))
+
+
+if __name__ == '__main__':
+    unittest.main()
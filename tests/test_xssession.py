@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_xssession
+----------------------------------
+
+Tests for the pool of shared board sessions in `xssession`, using the
+simulated boards of the 'sim' USB backend.
+"""
+
+import os
+import sys
+import time
+import unittest
+
+# The xstools modules import each other as top-level modules.
+XSTOOLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'xstools')
+sys.path.insert(0, XSTOOLS_DIR)
+
+from xserror import XsMinorError
+from xsbackend import XsSimBackend
+from xssim import XsSimBoard
+from xsusb import XsUsb
+from xssession import XsSessionPool
+
+
+class TestSessionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.profile_file = XsUsb._PROFILE_FILE
+        XsUsb._PROFILE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'no_such_dir', 'profiles.json')
+        self.boards = [XsSimBoard(), XsSimBoard()]
+        self.backend = XsSimBackend(self.boards)
+        XsUsb.set_backend(self.backend)
+        self.pool = XsSessionPool(idle_time_out=60.0)
+
+    def tearDown(self):
+        XsUsb.set_backend(None)
+        XsUsb._PROFILE_FILE = self.profile_file
+
+    def _age(self, session, secs):
+        """Make it look like the session was handed out and used secs ago."""
+
+        session.last_used = time.time() - secs
+        session.xsusb.last_used = time.time() - secs
+
+    def test_shared(self):
+        session = self.pool.get_session(0)
+        self.assertTrue(self.pool.get_session(0) is session)
+        self.assertFalse(self.pool.get_session(1) is session)
+
+    def test_transfers_keep_session(self):
+        session = self.pool.get_session(0)
+        self._age(session, 100)
+        # The session was handed out long ago, but its board is still doing transfers.
+        session.xsusb.get_info()
+        self.pool.release_idle()
+        self.assertFalse(session.released)
+        self._age(session, 100)
+        self.pool.release_idle()
+        self.assertTrue(session.released)
+
+    def test_release_and_reuse(self):
+        session = self.pool.get_session(0)
+        other = self.pool.get_session(1)
+        session.xsjtag.reset_tap()
+        self._age(session, 100)
+        self.pool.release_idle()
+        self.assertTrue(session.released)
+        self.assertFalse(other.released)
+        # Something else could have used the board while it was released, so its TAP state is forgotten.
+        self.assertTrue(self.pool.get_session(0) is session)
+        self.assertFalse(session.released)
+        self.assertEqual(session.xsjtag.get_tap_state(), 'Invalid')
+
+    def test_unplugged(self):
+        first, second = self.pool.get_session(0), self.pool.get_session(1)
+        self.backend.unplug(self.boards[0])
+        XsUsb.invalidate_ports()
+        self.pool.release_idle()
+        # The remaining board is now on the first port, and it keeps its session.
+        self.assertTrue(self.pool.get_session(0) is second)
+        self.assertRaises(XsMinorError, self.pool.get_session, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_xssim
+----------------------------------
+
+Tests that run the USB/JTAG stack against the simulated XuLA board in `xssim`.
+
+The simulator stands in for the hardware, and the recordings made by
+`xstransport.XsRecorder` show the exact JTAG_CMD bytes sent to the board.
+"""
+
+import os
+import sys
+import random
+import struct
+import tempfile
+import unittest
+
+# The xstools modules import each other as top-level modules.
+XSTOOLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'xstools')
+sys.path.insert(0, XSTOOLS_DIR)
+
+from xserror import XsMinorError, XsMajorError
+from xsbitarray import XsBitArray
+from xssim import XsSimBoard, XsSimMemory
+from xstransport import XsRecorder, XsReplay, read_recording, OUT
+from xsusb import XsUsb
+from xsjtag import XsJtag
+from xsmemio import XsMemIo
+from xilfpga import Xc3s200avq100
+
+BITSTREAM = os.path.join(XSTOOLS_DIR, 'xula', 'ramintfc_jtag_200.bit')
+MEM_ID = 3
+
+
+def decode_jtag_cmds(data):
+    """Return the (num_bits, flags, payload length) of each JTAG_CMD in a USB write and the TMS and TDI bits it clocks."""
+
+    cmds = []
+    tms, tdi = [], []
+    pos = 0
+    while pos < len(data):
+        assert data[pos] == XsUsb.JTAG_CMD
+        num_bits, flags = struct.unpack_from('<IB', buffer(data), pos + 1)
+        pos += 6
+        num_bytes = (num_bits + 7) // 8
+        put_tms, put_tdi = flags & XsUsb.PUT_TMS_MASK, flags & XsUsb.PUT_TDI_MASK
+        if put_tms and put_tdi:
+            tms_bytes, tdi_bytes = data[pos:pos + 2 * num_bytes:2], data[pos + 1:pos + 2 * num_bytes:2]
+            payload_len = 2 * num_bytes
+        else:
+            tms_bytes = data[pos:pos + num_bytes] if put_tms else None
+            tdi_bytes = data[pos:pos + num_bytes] if put_tdi else None
+            payload_len = num_bytes if put_tms or put_tdi else 0
+        for i in range(num_bits):
+            if tms_bytes is None:
+                tms.append(1 if flags & XsUsb.TMS_VAL_MASK else 0)
+            else:
+                tms.append(tms_bytes[i >> 3] >> (i & 7) & 1)
+            if tdi_bytes is None:
+                tdi.append(1 if flags & XsUsb.TDI_VAL_MASK else 0)
+            else:
+                tdi.append(tdi_bytes[i >> 3] >> (i & 7) & 1)
+        cmds.append((num_bits, flags, payload_len))
+        pos += payload_len
+    return cmds, tms, tdi
+
+
+class TestXsBitArray(unittest.TestCase):
+
+    def test_usb_round_trip(self):
+        rng = random.Random(1)
+        for length in (1, 7, 8, 9, 100, 1023):
+            bits = XsBitArray([rng.getrandbits(1) for i in range(length)])
+            self.assertEqual(XsBitArray.from_usb(bits.to_usb(), length), bits)
+
+    def test_concatenation_order(self):
+        bits = XsBitArray('0b101') + XsBitArray('0b0011')
+        self.assertEqual(bits.pop_field(3), XsBitArray('0b101'))
+        self.assertEqual(bits, XsBitArray('0b0011'))
+        self.assertRaises(XsMinorError, bits.pop_field, 5)
+
+    def test_head_tail_clamp(self):
+        bits = XsBitArray('0b101')
+        self.assertEqual(bits.head(8), bits)
+        self.assertEqual(bits.tail(8), bits)
+        self.assertEqual(bits.head(2).len, 2)
+
+
+class TestFlush(unittest.TestCase):
+
+    def setUp(self):
+        self.recording = tempfile.NamedTemporaryFile(suffix='.xsrec', delete=False)
+        self.recording.close()
+        self.recorder = XsRecorder(XsSimBoard(), self.recording.name)
+        self.xsusb = XsUsb(transport=self.recorder)
+        self.xsjtag = XsJtag(self.xsusb)
+
+    def tearDown(self):
+        self.recorder.close()
+        os.remove(self.recording.name)
+
+    def _flush(self, tdi):
+        """Shift TDI bits in the shift-dr state and return the writes that sent them."""
+
+        self.xsjtag.goto_state(XsJtag.SHIFT_DR)
+        self.xsjtag.shift_tdi(tdi, do_exit_shift=True)
+        self.xsjtag.flush()
+        self.recorder.close()
+        return [r[4] for r in read_recording(self.recording.name) if r[0] == OUT]
+
+    def _check(self, writes, tdi):
+        """Decode the writes and compare the last TCK pulses they make with the shift of tdi."""
+
+        cmds, tms_bits, tdi_bits = decode_jtag_cmds(bytearray().join(writes))
+        # Bits in the order they're transmitted.
+        usb = tdi.to_usb()
+        expected = [usb[i >> 3] >> (i & 7) & 1 for i in range(tdi.len)]
+        self.assertEqual(tdi_bits[-tdi.len:], expected)
+        self.assertEqual(tms_bits[-tdi.len:], [0] * (tdi.len - 1) + [1])
+        return cmds
+
+    def test_tms_zero_run(self):
+        rng = random.Random(2)
+        tdi = XsBitArray([rng.getrandbits(1) for i in range(1000)])
+        cmds = self._check(self._flush(tdi), tdi)
+        self.assertTrue(any(flags == XsUsb.PUT_TDI_MASK for num_bits, flags, n in cmds))
+
+    def test_static_tdi_runs(self):
+        rng = random.Random(3)
+        noise = [rng.getrandbits(1) for i in range(64)]
+        tdi = XsBitArray(noise + [0] * 800 + noise + [1] * 800 + noise)
+        writes = self._flush(tdi)
+        cmds = self._check(writes, tdi)
+        self.assertIn(0, [flags for num_bits, flags, n in cmds])
+        self.assertIn(XsUsb.TDI_VAL_MASK, [flags for num_bits, flags, n in cmds])
+        # The constant runs go out with just their bit counts.
+        self.assertLess(sum(len(w) for w in writes), 100)
+
+    def test_chunking(self):
+        self.xsusb.link_profile = {'latency': 0.001, 'throughput': 1.0e6, 'chunk_size': 64}
+        rng = random.Random(4)
+        tdi = XsBitArray([rng.getrandbits(1) for i in range(4000)])
+        writes = self._flush(tdi)
+        cmds = self._check(writes, tdi)
+        self.assertGreater(len(writes), 1)
+        self.assertTrue(all(n <= 64 for num_bits, flags, n in cmds))
+
+
+class FailingSimBoard(XsSimBoard):
+
+    """Simulated board that stops answering after a number of reads."""
+
+    def __init__(self, num_reads):
+        XsSimBoard.__init__(self)
+        self.max_reads = num_reads
+
+    def read(self, endpoint, size_or_buffer, timeout=None):
+        if self.num_reads >= self.max_reads:
+            raise XsMajorError('Simulated board stopped answering.')
+        return XsSimBoard.read(self, endpoint, size_or_buffer, timeout)
+
+
+class TestCalibrate(unittest.TestCase):
+
+    def test_calibrate(self):
+        xsusb = XsUsb(transport=XsSimBoard())
+        profile = xsusb.calibrate(sizes=(64, 128), repeats=2, save=False)
+        self.assertTrue(xsusb.link_profile is profile)
+        self.assertIn(profile['chunk_size'], (64, 128))
+        self.assertEqual(xsusb.tap_reset_count, 1)
+
+    def test_failed_calibration(self):
+        profile = {'latency': 0.001, 'throughput': 1.0e6, 'chunk_size': 64}
+        for num_reads in (1, 4):  # Fail after the INFO read for the profile key.
+            xsusb = XsUsb(transport=FailingSimBoard(num_reads))
+            xsusb.link_profile = profile
+            self.assertRaises(XsMajorError, xsusb.calibrate, sizes=(64, 128), repeats=2, save=False)
+            self.assertTrue(xsusb.link_profile is profile)
+            self.assertEqual(xsusb.tap_reset_count, 1)
+
+
+class TestSimBoard(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = XsSimBoard(modules={MEM_ID: XsSimMemory(16, 16)})
+        self.xsusb = XsUsb(transport=self.sim)
+        self.xsjtag = XsJtag(self.xsusb)
+
+    def test_memory_round_trip(self):
+        ram = XsMemIo(module_id=MEM_ID, xsjtag=self.xsjtag)
+        for data in (range(500), [0] * 500, [0xffff] * 500):
+            ram.write(0, data)
+            self.assertEqual(list(ram.read(0, len(data), return_type=int())), data)
+
+    def test_chunked_read(self):
+        ram = XsMemIo(module_id=MEM_ID, xsjtag=self.xsjtag)
+        data = range(1000)
+        ram.write(0, data)
+        self.xsusb.link_profile = {'latency': 0.001, 'throughput': 1.0e6, 'chunk_size': 64}
+        bytes_in, reads = self.sim.bytes_in, self.sim.num_reads
+        self.assertEqual(list(ram.read(0, len(data), return_type=int())), data)
+        # One request returns the data words after a single junk word, in 64-byte pieces.
+        self.assertEqual(self.sim.bytes_in - bytes_in, 2 * (len(data) + 1))
+        self.assertEqual(self.sim.num_reads - reads, (2 * (len(data) + 1) + 63) // 64)
+        self.assertEqual([w.uint for w in ram.read(10, 100)], data[10:110])
+
+    def test_deferred_execute(self):
+        fpga = Xc3s200avq100(self.xsjtag)
+        idcode = fpga.get_idcode()
+        writes, reads = self.sim.num_writes, self.sim.num_reads
+        with self.xsjtag.deferred():
+            futures = [self.xsjtag.load_ir_then_dr(fpga._IDCODE_INSTR, num_return_bits=32) for i in range(10)]
+            self.xsjtag.runtest(100)
+            self.assertFalse(futures[0].done())
+        self.assertEqual(self.sim.num_writes - writes, 1)
+        # Each reply ends with a short packet, so the ten TDO replies and the RUNTEST echo take a read apiece.
+        self.assertEqual(self.sim.num_reads - reads, 11)
+        self.assertEqual([f.result() for f in futures], [idcode] * 10)
+
+    def test_packet_reads(self):
+        # Each INFO reply is a short packet that ends its transfer, so the reads have to gather them.
+        self.xsusb.write(bytearray([XsUsb.INFO_CMD] * 3))
+        reads = self.sim.num_reads
+        info = self.xsusb.read(64)
+        self.assertEqual(self.sim.num_reads - reads, 2)
+        self.assertEqual(info[0:32], info[32:64])
+        self.assertEqual(info[0], XsUsb.INFO_CMD)
+        buf = bytearray(40)
+        self.assertEqual(self.xsusb.read_into(buf, 32, offset=8), 32)
+        self.assertEqual(list(buf[8:]), list(info[:32]))
+        self.assertRaises(XsMajorError, self.xsusb.read, 1)
+
+    def test_verify(self):
+        fpga = Xc3s200avq100(self.xsjtag)
+        fpga.configure(BITSTREAM, verify=True)
+        self.assertIsNone(fpga.verify(BITSTREAM))
+        self.sim.fpga.cfg.frames[2 * 1000] ^= 0x80
+        self.assertEqual(fpga.verify(BITSTREAM), (1000, 0, 0x8000))
+
+    def test_replay(self):
+        recording = tempfile.NamedTemporaryFile(suffix='.xsrec', delete=False)
+        recording.close()
+        try:
+            recorder = XsRecorder(self.sim, recording.name)
+            xsjtag = XsJtag(XsUsb(transport=recorder))
+            idcode = Xc3s200avq100(xsjtag).get_idcode()
+            recorder.close()
+            replay = XsReplay(recording.name, time_scale=0)
+            xsjtag = XsJtag(XsUsb(transport=replay))
+            self.assertEqual(Xc3s200avq100(xsjtag).get_idcode(), idcode)
+            self.assertTrue(replay.is_finished())
+        finally:
+            os.remove(recording.name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_xssvf
+----------------------------------
+
+Tests that play SVF and XSVF files with `xssvf` through the simulated
+XuLA board in `xssim`.
+
+The simulated FPGA has a 6-bit IR that captures 0x01, and its IDCODE
+instruction (0x09) is loaded by a test-logic-reset.
+"""
+
+import os
+import sys
+import shutil
+import struct
+import tempfile
+import unittest
+
+# The xstools modules import each other as top-level modules.
+XSTOOLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'xstools')
+sys.path.insert(0, XSTOOLS_DIR)
+
+from xserror import XsMinorError
+from xssim import XsSimBoard
+from xsusb import XsUsb
+from xsjtag import XsJtag
+from xssvf import *
+
+IDCODE = 0x02218093
+IDCODE_SVF = 'STATE RESET IDLE;\nSIR 6 TDI (09);\n'
+
+
+def xsvf_uint(value, num_bytes):
+    """Return the bytes of an XSVF value, most-significant byte first."""
+
+    return ''.join(chr(value >> 8 * i & 0xff) for i in reversed(range(num_bytes)))
+
+
+class PlayerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.sim = XsSimBoard()
+        self.xsjtag = XsJtag(XsUsb(transport=self.sim))
+        self.player = XsSvfPlayer(self.xsjtag)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _play(self, contents, ext='.svf', player=None):
+        filename = os.path.join(self.dir, 'test' + ext)
+        with open(filename, 'wb') as f:
+            f.write(contents)
+        return (player or self.player).play(filename)
+
+    def _mismatch(self, contents, ext='.svf'):
+        try:
+            self._play(contents, ext)
+        except XsMinorError as e:
+            self.assertIn('TDO mismatch', str(e))
+        else:
+            self.fail('TDO mismatch was not reported.')
+
+
+class TestSvf(PlayerTest):
+
+    def test_sdr_tdo(self):
+        report = self._play(IDCODE_SVF + 'SDR 32 TDI (0) TDO (02218093) MASK (0fffffff);\n'
+                            # The TDO value applies only to its own scan, but the mask carries over.
+                            'SDR 32 TDI (0);\n'
+                            'SDR 32 TDI (0) TDO (f2218093);\n')
+        self.assertEqual(report['tdo_checks'], 2)
+        self.assertEqual(report['scans'], 4)
+        self.assertEqual(report['scan_bits'], 6 + 3 * 32)
+        self._mismatch(IDCODE_SVF + 'SDR 32 TDI (0) TDO (12218093) MASK (ffffffff);\n')
+
+    def test_sdr_mask(self):
+        # The version bits of the IDCODE are masked off, and SMASK is accepted.
+        self._play(IDCODE_SVF + 'SDR 32 TDI (0) SMASK (ffffffff) TDO (f2218093) MASK (0fffffff);\n')
+        self._mismatch(IDCODE_SVF + 'SDR 32 TDI (0) TDO (f2218093) MASK (1fffffff);\n')
+
+    def test_sir_tdo(self):
+        self._play('SIR 6 TDI (09) TDO (01) MASK (03);\nSIR 6 TDI (09) TDO (3d) MASK (03);\n')
+        self._mismatch('SIR 6 TDI (09) TDO (02) MASK (03);\n')
+
+    def test_header_ir(self):
+        # The header bits go out first, so they come back after the bits captured by the IR.
+        self._play('HIR 4 TDI (f) TDO (1) MASK (f);\nSIR 6 TDI (09) TDO (3c);\n'
+                   'HIR 0;\nSDR 32 TDI (0) TDO (02218093);\n')
+        self._mismatch('HIR 4 TDI (f) TDO (2) MASK (f);\nSIR 6 TDI (09);\n')
+        self._mismatch('HIR 4 TDI (f);\nSIR 6 TDI (09) TDO (01);\n')
+
+    def test_header_dr(self):
+        report = self._play(IDCODE_SVF + 'HDR 4 TDI (0) TDO (3) MASK (f);\n'
+                            'SDR 32 TDI (0) TDO (0221809);\n'
+                            # The header's TDO value carries over to the next scan.
+                            'SDR 32 TDI (0);\n')
+        self.assertEqual(report['tdo_checks'], 2)
+        self.assertEqual(report['scan_bits'], 6 + 2 * 36)
+        self._mismatch(IDCODE_SVF + 'HDR 4 TDI (0) TDO (5) MASK (f);\nSDR 32 TDI (0);\n')
+
+    def test_trailer(self):
+        # The trailer bits go out last, so the first bits of the body come back in them.
+        self._play(IDCODE_SVF + 'TDR 4 TDI (0) TDO (5) MASK (f);\nSDR 32 TDI (5) TDO (02218093);\n'
+                   'TIR 2 TDI (0) TDO (1) MASK (3);\nSIR 6 TDI (09) TDO (01) MASK (3f);\n')
+        self._mismatch(IDCODE_SVF + 'TDR 4 TDI (0) TDO (5) MASK (f);\nSDR 32 TDI (6);\n')
+
+    def test_length_change(self):
+        self.assertRaises(XsMinorError, self._play, 'HIR 4 TDI (f);\nHIR 5;\n')
+        self.assertRaises(XsMinorError, self._play, 'SDR 8 TDI (0);\nSDR 16 TDO (0);\n')
+
+    def test_runtest_tck(self):
+        idle = self.sim.fpga.idle_clocks
+        report = self._play(IDCODE_SVF + 'RUNTEST IDLE 1000 TCK ENDSTATE IDLE;\nRUNTEST 2.5E2 TCK;\n')
+        self.assertEqual(self.sim.fpga.idle_clocks - idle, 1250)
+        self.assertEqual(report['wait_time'], 0.0)
+        self.assertEqual(report['round_trips'], 1)
+        # The TAP ends in the state given by ENDSTATE.
+        self._play('RUNTEST IDLE 10 TCK ENDSTATE DRPAUSE;\n')
+        self.assertEqual(self.sim.fpga.state, 'Pause-DR')
+        self.assertRaises(XsMinorError, self._play, 'RUNTEST 10 TCK ENDSTATE DRSHIFT;\n')
+
+    def test_runtest_sec(self):
+        report = self._play(IDCODE_SVF + 'RUNTEST 0.01 SEC MAXIMUM 1 SEC;\n')
+        self.assertEqual(report['wait_time'], 0.01)
+        # With a TCK rate, the wait is done with TCK pulses instead.
+        idle = self.sim.fpga.idle_clocks
+        report = self._play(IDCODE_SVF + 'RUNTEST 100 TCK 1.0E-3 SEC;\n',
+                            player=XsSvfPlayer(self.xsjtag, tck_hz=1.0e6))
+        self.assertEqual(report['wait_time'], 0.0)
+        self.assertEqual(self.sim.fpga.idle_clocks - idle, 1000)
+
+    def test_enddr_pause(self):
+        self._play(IDCODE_SVF + 'ENDDR DRPAUSE;\nSDR 32 TDI (0) TDO (02218093);\n')
+        self.assertEqual(self.xsjtag.get_tap_state(), 'Pause-DR')
+        self.assertEqual(self.sim.fpga.state, 'Pause-DR')
+        # A scan from a pause state goes through update, so the DR is captured again.
+        self._play('ENDDR DRPAUSE;\nSDR 32 TDI (0) TDO (02218093);\nENDDR IDLE;\nSDR 32 TDI (0) TDO (02218093);\n')
+        self.assertEqual(self.sim.fpga.state, 'Run-Test/Idle')
+        self.assertRaises(XsMinorError, self._play, 'ENDDR DRSHIFT;\n')
+
+    def test_endir_pause(self):
+        self._play('ENDIR IRPAUSE;\nSIR 6 TDI (09);\n')
+        self.assertEqual(self.sim.fpga.state, 'Pause-IR')
+        # The instruction isn't loaded until the IR goes through update.
+        self.assertNotEqual(self.sim.fpga.instruction, 0x3f)
+        self._play('ENDIR IRPAUSE;\nSIR 6 TDI (3f);\nSTATE IDLE;\n')
+        self.assertEqual(self.sim.fpga.instruction, 0x3f)
+
+    def test_state(self):
+        self._play('STATE RESET IDLE DRPAUSE;\n')
+        self.assertEqual(self.sim.fpga.state, 'Pause-DR')
+        self._play('STATE IRPAUSE;\n')
+        self.assertEqual(self.sim.fpga.state, 'Pause-IR')
+        # A reset loads the IDCODE instruction.
+        self._play('SIR 6 TDI (3f);\nSTATE RESET;\nSDR 32 TDI (0) TDO (02218093);\n')
+        self.assertRaises(XsMinorError, self._play, 'STATE NOWHERE;\n')
+
+    def test_syntax(self):
+        self.assertRaises(XsMinorError, self._play, 'SIR 6 TDI (09)\n')
+        self.assertRaises(XsMinorError, self._play, 'SIR 6 TDI 09;\n')
+        self.assertRaises(XsMinorError, self._play, 'PIOMAP (IN A);\n')
+        # Comments, FREQUENCY and TRST are skipped, and statements can span lines.
+        report = self._play('! comment\nFREQUENCY 1E6 HZ; // comment\nTRST OFF;\nSIR 6\n TDI (09); SIR 6 TDI (09);\n')
+        self.assertEqual(report['scans'], 2)
+
+
+class TestXsvf(PlayerTest):
+
+    def _xsvf(self, *cmds):
+        return ''.join(cmds) + chr(XCOMPLETE)
+
+    def _idcode(self, size):
+        return (chr(XSTATE) + chr(0) + chr(XSTATE) + chr(1) + chr(XSIR) + chr(6) + chr(0x09) +
+                chr(XSDRSIZE) + xsvf_uint(size, 4) + chr(XTDOMASK) + xsvf_uint((1 << size) - 1, size // 8))
+
+    def test_sdrtdo(self):
+        report = self._play(self._xsvf(self._idcode(32), chr(XSDRTDO), xsvf_uint(0, 4), xsvf_uint(IDCODE, 4),
+                                       chr(XCOMMENT), 'comment\0',
+                                       # XSDR checks against the expected value of the last XSDRTDO.
+                                       chr(XSDR), xsvf_uint(0, 4)), '.xsvf')
+        self.assertEqual(report['tdo_checks'], 2)
+        self.assertEqual(report['round_trips'], 1)
+        self._mismatch(self._xsvf(self._idcode(32), chr(XSDRTDO), xsvf_uint(0, 4), xsvf_uint(IDCODE + 1, 4)),
+                       '.xsvf')
+
+    def test_sdr_pieces(self):
+        # One DR scan split in four pieces, with no capture in between to restart the IDCODE.
+        pieces = [chr(cmd) + chr(0) + chr(IDCODE >> 8 * i & 0xff)
+                  for i, cmd in enumerate((XSDRTDOB, XSDRTDOC, XSDRTDOC, XSDRTDOE))]
+        report = self._play(self._xsvf(self._idcode(8), *pieces), '.xsvf')
+        self.assertEqual(report['tdo_checks'], 4)
+        self.assertEqual(self.sim.fpga.state, 'Run-Test/Idle')
+        pieces[2] = chr(XSDRTDOC) + chr(0) + chr(0)
+        self._mismatch(self._xsvf(self._idcode(8), *pieces), '.xsvf')
+        # The pieces without TDO checks end in the XENDDR state.
+        report = self._play(self._xsvf(self._idcode(8), chr(XENDDR), chr(1),
+                                       chr(XSDRB), chr(0), chr(XSDRC), chr(0), chr(XSDRE), chr(0)), '.xsvf')
+        self.assertEqual((report['scans'], report['tdo_checks']), (4, 0))
+        self.assertEqual(self.sim.fpga.state, 'Pause-DR')
+
+    def test_retry(self):
+        # The first scan gets the IDCODE back instead of the TDI value. The retry shifts the DR again
+        # without capturing it, so the TDI bits of the first try come back out.
+        value = 0x12345678
+        scan = chr(XSDRTDO) + xsvf_uint(value, 4) + xsvf_uint(value, 4)
+        report = self._play(self._xsvf(chr(XREPEAT), chr(2), self._idcode(32),
+                                       chr(XRUNTEST), xsvf_uint(1000, 4), scan), '.xsvf')
+        self.assertEqual(report['tdo_retries'], 1)
+        self.assertEqual(report['tdo_checks'], 1)
+        # The run-test time grows by 25% for the retry.
+        self.assertAlmostEqual(report['wait_time'], 1.25e-3)
+        self.assertEqual(self.sim.fpga.state, 'Run-Test/Idle')
+        # Without retries, the scan fails.
+        self._mismatch(self._xsvf(self._idcode(32), scan), '.xsvf')
+        # And retries don't help when the scan can never match.
+        self._mismatch(self._xsvf(chr(XREPEAT), chr(3), self._idcode(32),
+                                  chr(XSDRTDO), xsvf_uint(0, 4), xsvf_uint(value, 4)), '.xsvf')
+
+    def test_states(self):
+        self._play(self._xsvf(chr(XENDIR), chr(1), chr(XSIR), chr(6), chr(0x09)), '.xsvf')
+        self.assertEqual(self.sim.fpga.state, 'Pause-IR')
+        self._play(self._xsvf(chr(XWAIT), chr(1), chr(6), xsvf_uint(0, 4)), '.xsvf')
+        self.assertEqual(self.sim.fpga.state, 'Pause-DR')
+        self.assertRaises(XsMinorError, self._play, self._xsvf(chr(XSTATE), chr(16)), '.xsvf')
+        self.assertRaises(XsMinorError, self._play, chr(XSIR) + chr(6), '.xsvf')
+        self.assertRaises(XsMinorError, self._play, chr(0x7f), '.xsvf')
+
+
+if __name__ == '__main__':
+    unittest.main()
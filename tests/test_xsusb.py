@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_xsusb
+----------------------------------
+
+Tests for the ways `xsusb` moves commands to the board and back, run
+against the simulated XuLA board in `xssim`.
+
+The RUNTEST_CMD echoes itself, so RUNTEST commands with different TCK
+counts make replies that show which command they answer.
+"""
+
+import os
+import sys
+import struct
+import unittest
+import threading
+
+# The xstools modules import each other as top-level modules.
+XSTOOLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'xstools')
+sys.path.insert(0, XSTOOLS_DIR)
+
+from xserror import XsMinorError, XsMajorError
+from xsbackend import XsSimBackend, _SimDevice
+from xssim import XsSimBoard
+from xsusb import XsUsb, XsUsbFuture, stats_delta
+
+
+def runtest(num_tcks):
+    """Return the bytes of a RUNTEST_CMD, which are also its echo."""
+
+    return bytearray([XsUsb.RUNTEST_CMD]) + bytearray(struct.pack('<I', num_tcks))
+
+
+def jtag_tdi(num_bytes):
+    """Return a JTAG_CMD of num_bytes bytes that shifts TDI bits and gets nothing back."""
+
+    num_bits = 8 * (num_bytes - 6)
+    return bytearray([XsUsb.JTAG_CMD]) + bytearray(struct.pack('<IB', num_bits, XsUsb.PUT_TDI_MASK)) + bytearray(num_bits // 8)
+
+
+class LoggingSimBoard(XsSimBoard):
+
+    """Simulated board that keeps the length of each USB write."""
+
+    def __init__(self):
+        XsSimBoard.__init__(self)
+        self.write_lens = []
+
+    def write(self, endpoint, data, timeout=None):
+        self.write_lens.append(len(data))
+        return XsSimBoard.write(self, endpoint, data, timeout)
+
+
+class FailingSimBoard(XsSimBoard):
+
+    """Simulated board that stops answering after a number of reads, which wait until it's allowed to answer."""
+
+    def __init__(self, num_reads):
+        XsSimBoard.__init__(self)
+        self.max_reads = num_reads
+        self.answer = threading.Event()
+        self.answer.set()
+
+    def read(self, endpoint, size_or_buffer, timeout=None):
+        self.answer.wait()
+        if self.num_reads >= self.max_reads:
+            raise XsMajorError('Simulated board stopped answering.')
+        return XsSimBoard.read(self, endpoint, size_or_buffer, timeout)
+
+
+class FreshSimBackend(XsSimBackend):
+
+    """Simulated backend that counts the port scans and makes new device handles for each one, like pyusb does."""
+
+    num_scans = 0
+
+    def enumerate(self, vendor_id, product_id):
+        self.num_scans += 1
+        return [_SimDevice(dev.board, dev.address) for dev in XsSimBackend.enumerate(self, vendor_id, product_id)]
+
+    def open(self, dev):
+        return dev.board
+
+
+class TestQueued(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = XsSimBoard()
+        self.xsusb = XsUsb(transport=self.sim)
+
+    def tearDown(self):
+        self.xsusb.stop_queue()
+
+    def test_in_order(self):
+        self.xsusb.start_queue(depth=2)
+        futures = []
+        for i in range(10):
+            self.xsusb.write(runtest(i))
+            futures.append(self.xsusb.submit_read(5))
+        self.assertEqual([bytearray(f.result()) for f in futures], [runtest(i) for i in range(10)])
+        # A plain read waits for its own reply.
+        self.xsusb.write(runtest(10))
+        self.assertEqual(bytearray(self.xsusb.read(5)), runtest(10))
+        self.xsusb.stop_queue()
+        self.assertTrue(self.xsusb._io_thread is None)
+        self.assertEqual((self.sim.num_writes, self.sim.num_reads), (11, 11))
+
+    def test_write_copied(self):
+        bytes = runtest(1)
+        with self.xsusb.queued():
+            self.xsusb.submit_write(bytes)
+            # The caller can reuse its buffer before the write is done.
+            bytes[1] = 2
+            buf = bytearray(5)
+            future = self.xsusb.submit_read_into(buf)
+            self.assertEqual(future.result(), 5)
+            self.assertEqual(buf, runtest(1))
+
+    def test_nested(self):
+        with self.xsusb.queued():
+            with self.xsusb.queued():
+                pass
+            # The outer block is still in queued mode.
+            self.assertFalse(self.xsusb._io_thread is None)
+        self.assertTrue(self.xsusb._io_thread is None)
+
+    def test_unqueued_futures(self):
+        self.xsusb.submit_write(runtest(3))
+        future = self.xsusb.submit_read(5)
+        self.assertTrue(future.done())
+        self.assertEqual(bytearray(future.result()), runtest(3))
+
+    def test_error(self):
+        sim = FailingSimBoard(0)
+        sim.answer.clear()
+        xsusb = XsUsb(transport=sim)
+        xsusb.start_queue()
+        xsusb.write(runtest(1))
+        first, second = xsusb.submit_read(5), xsusb.submit_read(5)
+        sim.answer.set()
+        self.assertTrue(isinstance(first.exception(), XsMajorError))
+        # The transfers after the failed one are skipped with the same error.
+        self.assertTrue(second.exception() is first.exception())
+        self.assertRaises(XsMajorError, second.result)
+        self.assertRaises(XsMajorError, xsusb.write, runtest(1))
+        self.assertRaises(XsMajorError, xsusb.stop_queue)
+        # Leaving queued mode reported the error, so the link can be used again.
+        self.assertTrue(xsusb._io_thread is None)
+        xsusb.stop_queue()
+
+    def test_future_timeout(self):
+        future = XsUsbFuture()
+        self.assertFalse(future.done())
+        self.assertRaises(XsMinorError, future.result, 0.01)
+        future._set(result=3)
+        self.assertTrue(future.done())
+        self.assertEqual(future.result(0.01), 3)
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = LoggingSimBoard()
+        self.xsusb = XsUsb(transport=self.sim)
+
+    def test_coalesce(self):
+        with self.xsusb.batch():
+            for i in range(10):
+                self.xsusb.write(runtest(i))
+            self.assertEqual(self.sim.write_lens, [])
+        self.assertEqual(self.sim.write_lens, [50])
+        self.assertEqual(bytearray(self.xsusb.read(50)), bytearray().join(runtest(i) for i in range(10)))
+
+    def test_read_flushes(self):
+        with self.xsusb.batch():
+            self.xsusb.write(runtest(1))
+            self.xsusb.write(runtest(2))
+            # The board has to get the commands before it can answer them.
+            self.assertEqual(bytearray(self.xsusb.read(10)), runtest(1) + runtest(2))
+            self.xsusb.write(runtest(3))
+        self.assertEqual(self.sim.write_lens, [10, 5])
+
+    def test_size_limit(self):
+        with self.xsusb.batch():
+            for i in range(5):
+                self.xsusb.write(jtag_tdi(1000))
+        # The writes are gathered up to 4096 bytes at a time.
+        self.assertEqual(self.sim.write_lens, [4000, 1000])
+        self.sim.write_lens = []
+        with self.xsusb.batch(max_size=100):
+            self.xsusb.write(jtag_tdi(50))
+            self.xsusb.write(jtag_tdi(200))
+            self.xsusb.write(jtag_tdi(30))
+            self.xsusb.write(jtag_tdi(30))
+        # A write that's too big to gather goes out by itself after the ones gathered before it.
+        self.assertEqual(self.sim.write_lens, [50, 200, 60])
+        self.assertEqual(self.sim.bytes_out, 5000 + 310)
+
+    def test_nested(self):
+        with self.xsusb.batch(max_size=100):
+            self.xsusb.write(runtest(1))
+            with self.xsusb.batch(max_size=1000):
+                self.xsusb.write(runtest(2))
+            # The inner block joined the outer one, so nothing has been sent.
+            self.assertEqual(self.sim.write_lens, [])
+            self.xsusb.write(jtag_tdi(95))
+        self.assertEqual(self.sim.write_lens, [10, 95])
+
+    def test_queued(self):
+        with self.xsusb.queued():
+            with self.xsusb.batch():
+                self.xsusb.write(runtest(1))
+                self.xsusb.write(runtest(2))
+                future = self.xsusb.submit_read(10)
+            self.assertEqual(bytearray(future.result()), runtest(1) + runtest(2))
+        self.assertEqual(self.sim.write_lens, [10])
+
+
+class TestPorts(unittest.TestCase):
+
+    def setUp(self):
+        self.profile_file = XsUsb._PROFILE_FILE
+        XsUsb._PROFILE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'no_such_dir', 'profiles.json')
+        self.boards = [XsSimBoard(), XsSimBoard()]
+        self.backend = FreshSimBackend(self.boards)
+        XsUsb.set_backend(self.backend)
+
+    def tearDown(self):
+        XsUsb.set_backend(None)
+        XsUsb._PROFILE_FILE = self.profile_file
+
+    def test_scan_reused(self):
+        devs = XsUsb.get_xsusb_ports()
+        self.assertEqual(XsUsb.get_num_xsusb(), 2)
+        self.assertTrue(XsUsb.get_xsusb_ports() is devs)
+        self.assertEqual(self.backend.num_scans, 1)
+        # A board plugged in now isn't seen until the scan is too old or is thrown away.
+        self.backend.plug(XsSimBoard())
+        self.assertEqual(XsUsb.get_num_xsusb(), 2)
+        XsUsb._ports_scan_time -= XsUsb._PORTS_TTL
+        self.assertEqual(XsUsb.get_num_xsusb(), 3)
+        self.backend.unplug(self.boards[0])
+        XsUsb.invalidate_ports()
+        self.assertEqual(XsUsb.get_num_xsusb(), 2)
+        self.assertEqual(len(XsUsb.get_xsusb_ports(max_age=0)), 2)
+        self.assertEqual(self.backend.num_scans, 4)
+
+    def test_devices_kept(self):
+        first = XsUsb.get_xsusb_ports(max_age=0)
+        second = XsUsb.get_xsusb_ports(max_age=0)
+        # The devices from the first scan stand in for the new handles to the same boards.
+        self.assertFalse(first is second)
+        self.assertTrue(first[0] is second[0] and first[1] is second[1])
+
+    def test_keys(self):
+        self.assertEqual(XsUsb.get_port_key(0), (0, (1,), 1))
+        self.assertEqual(XsUsb.get_port_key(1), (0, (2,), 2))
+        self.assertEqual(XsUsb.get_port_key(2), None)
+        self.assertTrue(XsUsb.is_registered((0, (2,), 2)))
+        self.assertFalse(XsUsb.is_registered((0, (2,), 1)))
+        xsusb = XsUsb(1)
+        self.assertEqual(xsusb.get_dev_key(), (0, (2,), 2))
+        self.assertEqual(xsusb.get_xsusb_id(), 1)
+        # The board keeps its key when the board before it is unplugged, but it moves to the first port.
+        self.backend.unplug(self.boards[0])
+        XsUsb.invalidate_ports()
+        self.assertEqual(xsusb.get_dev_key(), (0, (2,), 2))
+        self.assertEqual(xsusb.get_xsusb_id(), 0)
+        self.assertFalse(XsUsb.is_registered((0, (1,), 1)))
+        self.assertEqual(XsUsb(transport=XsSimBoard()).get_dev_key(), None)
+
+    def test_new_board(self):
+        XsUsb.get_xsusb_ports()
+        board = XsSimBoard()
+        self.backend.plug(board)
+        # Asking for a port past the end of the last scan looks again right away.
+        self.assertEqual(XsUsb.get_port_key(2), (0, (3,), 3))
+        self.assertTrue(XsUsb(2)._get_transport() is board)
+        self.assertEqual(self.backend.num_scans, 2)
+
+
+class TestNoReturn(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = XsSimBoard()
+        self.xsusb = XsUsb(transport=self.sim)
+
+    def test_no_echoes(self):
+        with self.xsusb.no_return():
+            self.assertFalse(self.xsusb.returns_enabled())
+            self.assertFalse(self.sim.return_enabled)
+            for i in range(10):
+                self.xsusb.write(runtest(i))
+            with self.xsusb.no_return():
+                pass
+            # The inner block left the echoes off for the outer one.
+            self.assertFalse(self.sim.return_enabled)
+            # Commands that return data still send it.
+            self.xsusb.write(bytearray([XsUsb.INFO_CMD]))
+            self.assertEqual(bytearray(self.xsusb.read(32)), self.sim.get_info())
+        self.assertTrue(self.xsusb.returns_enabled())
+        self.assertTrue(self.sim.return_enabled)
+        self.xsusb.write(runtest(1))
+        self.assertEqual(bytearray(self.xsusb.read(5)), runtest(1))
+        self.assertEqual(self.sim.num_reads, 2)
+
+    def test_checkpoint(self):
+        self.xsusb.checkpoint()
+        with self.xsusb.no_return():
+            self.xsusb.write(runtest(1))
+            self.xsusb.checkpoint()
+            self.assertFalse(self.sim.return_enabled)
+        self.assertEqual(self.sim.num_reads, 2)
+        # A reply that nobody read means the host and the board are out of step.
+        self.xsusb.write(runtest(2))
+        self.assertRaises(XsMajorError, self.xsusb.checkpoint)
+
+
+class TestStats(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = XsSimBoard(latency=0.005)
+        self.xsusb = XsUsb(transport=self.sim)
+
+    def test_measure(self):
+        with self.xsusb.measure() as cost:
+            self.xsusb.write(runtest(1) + runtest(2))
+            self.xsusb.read(10)
+        self.assertEqual((cost['num_writes'], cost['num_reads'], cost['round_trips']), (1, 2, 2))
+        self.assertEqual((cost['bytes_out'], cost['bytes_in']), (10, 10))
+        # Each transfer waits out the latency of the simulated link.
+        self.assertTrue(cost['usb_time'] >= 0.015)
+        self.assertTrue(cost['elapsed'] >= cost['usb_time'])
+        self.assertAlmostEqual(cost['host_time'], cost['elapsed'] - cost['usb_time'])
+        self.assertFalse('payload_ratio' in cost)
+
+    def test_measure_error(self):
+        try:
+            with self.xsusb.measure() as cost:
+                self.xsusb.write(runtest(1))
+                self.xsusb.read(6)
+        except XsMajorError:
+            pass
+        # The cost of a block that failed is still reported.
+        self.assertEqual((cost['num_writes'], cost['num_reads']), (1, 1))
+
+    def test_queued(self):
+        before = self.xsusb.stats()
+        with self.xsusb.queued():
+            for i in range(4):
+                self.xsusb.write(runtest(i))
+            self.xsusb.submit_read(20).result()
+        cost = stats_delta(before, self.xsusb.stats())
+        self.assertEqual((cost['num_writes'], cost['bytes_out'], cost['bytes_in']), (4, 20, 20))
+
+    def test_payload(self):
+        before = dict((name, 0) for name in ('time', 'num_writes', 'num_reads', 'bytes_out', 'bytes_in', 'usb_time',
+                                             'num_tdi_bits', 'num_tdo_bits'))
+        after = dict(before, time=2.0, usb_time=0.5, num_reads=3, bytes_out=20, bytes_in=2,
+                     num_tdi_bits=80, num_tdo_bits=16)
+        cost = stats_delta(before, after)
+        self.assertEqual((cost['elapsed'], cost['host_time'], cost['round_trips']), (2.0, 1.5, 3))
+        self.assertEqual((cost['payload_bytes'], cost['overhead_bytes']), (12.0, 10.0))
+        self.assertAlmostEqual(cost['payload_ratio'], 1.2)
+        # With no overhead, there's no ratio.
+        after.update(bytes_out=10, bytes_in=2)
+        self.assertEqual(stats_delta(before, after)['payload_ratio'], None)
+
+
+if __name__ == '__main__':
+    unittest.main()
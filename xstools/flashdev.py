@@ -95,15 +95,21 @@ class FlashDevice:
             if data_blk.count(chr(0xff)) != self._WRITE_BLK_SZ:
                 self.write_blk(addr, data_blk)
 
+    def read_blk_into(self, addr, buf, num_bytes, offset=0):
+        """Read a block of the flash into a bytearray starting at the offset."""
+
+        buf[offset:offset + num_bytes] = self.read_blk(addr, num_bytes)
+
     def read(self, bottom=None, top=None):
         """Return the hex data stored in a section of the flash."""
 
         (bottom, top) = self._set_blk_bounds(bottom, top, self._WRITE_BLK_SZ)
-        data = bytearray()
+        # Read the blocks into a single image buffer and then hand it to the hex data object.
+        data = bytearray(top - bottom)
         for addr in range(bottom, top, self._READ_BLK_SZ):
-            data.extend(self.read_blk(addr, self._READ_BLK_SZ))
+            self.read_blk_into(addr, data, self._READ_BLK_SZ, addr - bottom)
         hex_data = IntelHex()
-        hex_data[bottom:top] = [byte for byte in data]
+        hex_data.frombytes(data, offset=bottom)
         return hex_data
 
     def verify(self, hexfile, bottom=None, top=None):
@@ -222,9 +228,10 @@ class W25X(FlashDevice):
         self._spi.send(self._FAST_READ_CMD, stop=False)
         self._spi.send(self._addr_bytes(bottom), stop=False)
         self._spi.send([0], stop=False)
-        data = self._spi.receive(num_data=top-bottom, stop=True)
+        data = bytearray(top - bottom)
+        self._spi.receive_into(data, num_data=top-bottom, stop=True)
         hex_data = IntelHex()
-        hex_data[bottom:top] = [byte.uint for byte in data]
+        hex_data.frombytes(data, offset=bottom)
         return hex_data
         
 if __name__ == '__main__':
@@ -25,6 +25,7 @@ import os
 import xstools
 import xsboard as XSBOARD
 import xsusb as XSUSB
+import xssession as XSSESSION
 import xserror as XSERROR
 import wx
 import wx.lib
@@ -47,17 +48,19 @@ icon_dir = os.path.join(xstools.install_dir, 'icons')
 
 
 # ===============================================================
-# Utility routines for connecting and disconnecting the USB port.
+# Utility routine for reconnecting to the board on the USB port.
 # ===============================================================
 
-def disconnect():
-    if active_board != None:
-        active_board.xsusb.disconnect()
-        
+# The board's session stays open between actions. It lets go of the USB interface
+# on its own once it has gone without USB transfers for a while (see check_port_connections).
 def reconnect():
     global active_board
     if active_board != None:
-        active_board = XSBOARD.XsBoard.get_xsboard(active_board.xsusb._xsusb_id)
+        # Re-use the open session and the board type already detected for this board.
+        xsusb_id = active_board.get_xsusb_id()
+        if xsusb_id is None:
+            xsusb_id = active_board.xsusb._xsusb_id
+        active_board = XSSESSION.get_xsboard(xsusb_id)
 
 
 
@@ -284,6 +287,9 @@ class GxsPortPanel(wx.Panel):
 
         global active_board
 
+        # Let go of the USB interfaces of boards that haven't been used in a while.
+        XSSESSION.release_idle()
+
         xsusb_ports = XSUSB.XsUsb.get_xsusb_ports()
         num_boards = len(xsusb_ports)
         #print "# boards = %d" % num_boards
@@ -312,9 +318,8 @@ class GxsPortPanel(wx.Panel):
                         self._port_list.SetSelection(0)
                     else:
                         self._port_list.SetSelection(xsusb_id)
-                active_board = XSBOARD.XsBoard.get_xsboard(self._port_list.GetSelection())
+                active_board = XSSESSION.get_xsboard(self._port_list.GetSelection())
                 wx.PostEvent(self._port_list, wx.PyCommandEvent(wx.EVT_CHOICE.typeId, wx.ID_ANY))
-                disconnect()
 
     def on_port_change(self, event):
 
@@ -335,7 +340,7 @@ class GxsPortPanel(wx.Panel):
         else:
             GxsPortPanel.active_port_id = port_id
             active_port_name = 'USB%d' % GxsPortPanel.active_port_id
-        active_board = XSBOARD.XsBoard.get_xsboard(GxsPortPanel.active_port_id)
+        active_board = XSSESSION.get_xsboard(GxsPortPanel.active_port_id)
         active_board_name = getattr(active_board, 'name', '')
         if hasattr(active_board,'micro'):
             self._blink_button.Enable()
@@ -344,14 +349,12 @@ class GxsPortPanel(wx.Panel):
         pub.sendMessage("Status.Port", port=active_port_name)
         pub.sendMessage("Status.Board", board=active_board_name)
         pub.sendMessage("Status.Change", dummy=None)
-        disconnect()
 
     def on_blink(self, event):
         reconnect()
         port_id = self._port_list.GetSelection()
         if port_id != wx.NOT_FOUND:
             active_board.get_board_info()
-        disconnect()
 
 
 # ===============================================================
@@ -527,7 +530,6 @@ class GxsFlashDownloadThread(Thread):
             wx.MessageBox(str(e), msg_box_title, wx.OK | wx.ICON_ERROR)
         finally:
             pub.sendMessage("Flash.Cleanup")
-            disconnect()
 
 
 # ===============================================================
@@ -554,7 +556,6 @@ class GxsFlashUploadThread(Thread):
             wx.MessageBox(str(e), msg_box_title, wx.OK | wx.ICON_ERROR)
         finally:
             pub.sendMessage("Flash.Cleanup")
-            disconnect()
 
 
 # ===============================================================
@@ -580,7 +581,6 @@ class GxsFlashEraseThread(Thread):
             wx.MessageBox(str(e), msg_box_title, wx.OK | wx.ICON_ERROR)
         finally:
             pub.sendMessage("Flash.Cleanup")
-            disconnect()
 
 
 # ===============================================================
@@ -745,7 +745,6 @@ class GxsSdramDownloadThread(Thread):
             wx.MessageBox(str(e), msg_box_title, wx.OK | wx.ICON_ERROR)
         finally:
             pub.sendMessage("Sdram.Cleanup")
-            disconnect()
 
 
 # ===============================================================
@@ -772,7 +771,6 @@ class GxsSdramUploadThread(Thread):
             wx.MessageBox(str(e), msg_box_title, wx.OK | wx.ICON_ERROR)
         finally:
             pub.sendMessage("Sdram.Cleanup")
-            disconnect()
 
 
 # ===============================================================
@@ -798,7 +796,6 @@ class GxsSdramEraseThread(Thread):
             wx.MessageBox(str(e), msg_box_title, wx.OK | wx.ICON_ERROR)
         finally:
             pub.sendMessage("Sdram.Cleanup")
-            disconnect()
 
 
 # ===============================================================
@@ -894,7 +891,6 @@ class GxsFpgaDownloadThread(Thread):
             wx.MessageBox(str(e), msg_box_title, wx.OK | wx.ICON_ERROR)
         finally:
             pub.sendMessage("Fpga.Cleanup")
-            disconnect()
 
 
 # ===============================================================
@@ -1007,7 +1003,6 @@ class GxsMcuDownloadThread(Thread):
             wx.MessageBox(str(e), msg_box_title, wx.OK | wx.ICON_ERROR)
         finally:
             pub.sendMessage("Micro.Cleanup")
-            disconnect()
 
 
 # ===============================================================
@@ -1076,7 +1071,6 @@ class GxsBoardTestThread(Thread):
         except XSERROR.XsError as e:
             wx.MessageBox(str(e), msg_box_title, wx.OK | wx.ICON_ERROR)
         finally:
-            disconnect()
             pub.sendMessage("Test.Cleanup")
 
 
@@ -1125,7 +1119,6 @@ class GxsBoardFlagsPanel(wx.Panel):
         else:
             self._aux_jtag_flag.Disable()
             self._aux_jtag_flag.SetValue(False)
-        disconnect()
 
     def handle_flash_flag(self, dummy):
         reconnect()
@@ -1135,18 +1128,15 @@ class GxsBoardFlagsPanel(wx.Panel):
         else:
             self._flash_flag.Disable()
             self._flash_flag.SetValue(False)
-        disconnect()
 
     def on_aux_jtag(self, event):
         reconnect()
         self._aux_jtag_flag.SetValue( active_board.toggle_aux_jtag_flag() )
-        disconnect()
         pub.sendMessage("Port.Check", force_check=True) # Because port will change if JTAG feature changes.
 
     def on_flash(self, event):
         reconnect()
         self._flash_flag.SetValue( active_board.toggle_flash_flag() )
-        disconnect()
 
 
 # ===============================================================
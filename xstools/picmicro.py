@@ -42,6 +42,7 @@ class Pic18f14k50(FlashDevice):
 
     def __init__(self, xsusb=None):
         self._xsusb = xsusb
+        self._response = bytearray()  # Reused for the responses to flash reads.
 
     def _addr_bytes(self, addr):
         return bytearray([addr & 0xff, addr >> 8 & 0xff, addr >> 16 & 0xff])
@@ -53,6 +54,8 @@ class Pic18f14k50(FlashDevice):
         cmd = bytearray([self._xsusb.ERASE_FLASH_CMD, num_blocks])
         cmd.extend(self._addr_bytes(addr))
         self._xsusb.write(cmd)
+        if not self._xsusb.returns_enabled():
+            return  # No echo to check (see XsUsb.no_return).
         response = self._xsusb.read(num_bytes=1)
         if response[0] != cmd[0]:
             raise XsMajorError("Incorrect command echo in %s." % sys.sys._getframe().f_code.co_name)
@@ -64,6 +67,8 @@ class Pic18f14k50(FlashDevice):
         cmd.extend(self._addr_bytes(addr))
         cmd.extend(bytearray(data))
         self._xsusb.write(cmd)
+        if not self._xsusb.returns_enabled():
+            return  # No echo to check (see XsUsb.no_return).
         response = self._xsusb.read(num_bytes=1)
         if response[0] != cmd[0]:
             raise XsMajorError("Incorrect command echo in %s." % sys.sys._getframe().f_code.co_name)
@@ -79,6 +84,22 @@ class Pic18f14k50(FlashDevice):
             raise XsMajorError("Incorrect command echo in %s." % sys.sys._getframe().f_code.co_name)
         return response[5:]
 
+    def read_blk_into(self, addr, buf, num_bytes, offset=0):
+        """Read data from the flash in the microcontroller into a bytearray starting at the offset."""
+
+        cmd = bytearray([self._xsusb.READ_FLASH_CMD, num_bytes])
+        cmd.extend(self._addr_bytes(addr))
+        self._xsusb.write(cmd)
+        # The response echoes the command and then holds the data, so read it into
+        # a buffer that's kept for reuse and copy the data over.
+        response_len = num_bytes + len(cmd)
+        if len(self._response) != response_len:
+            self._response = bytearray(response_len)
+        self._xsusb.read_into(self._response)
+        if self._response[0] != cmd[0]:
+            raise XsMajorError("Incorrect command echo in %s." % sys._getframe().f_code.co_name)
+        buf[offset:offset + num_bytes] = buffer(self._response, len(cmd))
+
     def read_eedata(self, addr):
         """Return a byte read from the microcontroller EEDATA."""
 
@@ -97,6 +118,8 @@ class Pic18f14k50(FlashDevice):
         cmd.extend(self._addr_bytes(addr))
         cmd.extend(bytearray([byte]))
         self._xsusb.write(cmd)
+        if not self._xsusb.returns_enabled():
+            return  # No echo to check (see XsUsb.no_return).
         response = self._xsusb.read(num_bytes=1)
         if response[0] != cmd[0]:
             raise XsMajorError("Incorrect command echo in %s." % sys.sys._getframe().f_code.co_name)
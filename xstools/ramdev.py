@@ -34,6 +34,8 @@ class RamDevice:
 
     """Generic RAM memory object."""
 
+    _STREAM_BLK_SZ = 2**16  # Number of words sent to the RAM by each queued write.
+
     def __init__(self, xsusb_id=DEFAULT_XSUSB_ID, module_id=DEFAULT_MODULE_ID, xsjtag=None):
         """Initialize the RAM."""
         self._ram = XsMemIo(xsusb_id=xsusb_id, module_id=module_id, xsjtag=xsjtag)
@@ -96,11 +98,18 @@ class RamDevice:
         hex_to_word_format = self._WORD_ENDIAN + str(num_words) + self._WORD_TYPE
         ram_words = struct.unpack(hex_to_word_format, hexfile.gets(bottom,num_bytes))
         
-        # Write the words to the RAM.
-        self._ram.write(ram_bottom, ram_words)
-
-    def read(self, bottom=None, top=None):
-        """Return the hex data stored in a section of the RAM."""
+        # Write the words to the RAM a block at a time. The USB transfers are queued so the
+        # next block is being prepared while the previous one is still going to the board.
+        with self._ram.xsjtag.queued():
+            for i in range(0, num_words, self._STREAM_BLK_SZ):
+                self._ram.write(ram_bottom + i, ram_words[i:i + self._STREAM_BLK_SZ])
+
+    def read_into(self, buf, bottom=None, top=None, offset=0):
+        """Read the bytes stored in a section of the RAM into a bytearray and return the number of bytes stored.
+        
+        buf = bytearray (or byte array.array) big enough to hold the bytes from bottom to top.
+        offset = index in buf where the byte at the bottom address is stored.
+        """
 
         if bottom is None or top is None:
             raise XsMinorError('Must specify both top and bottom addresses to read %s.', self._DEVICE_NAME)
@@ -110,13 +119,32 @@ class RamDevice:
         num_bytes = (top-bottom+1)
         if num_bytes % self._WORD_SIZE != 0:
             raise XsMinorError('Number of bytes is not a multiple of the %s word size (%x / %d != 0)' % (self._DEVICE_NAME, num_bytes, self._WORD_SIZE))
+        if len(buf) < offset + num_bytes:
+            raise XsMinorError('Buffer is too small to hold %d bytes from %s.' % (num_bytes, self._DEVICE_NAME))
         ram_bottom = bottom/self._WORD_SIZE
         num_words = num_bytes/self._WORD_SIZE
-        
-        ram_words = self._ram.read(ram_bottom, num_words, return_type=int())
-        word_to_hex_format = self._WORD_ENDIAN + str(num_words) + self._WORD_TYPE
+
+        self._ram.read_into(ram_bottom, buf, num_words, offset)
+
+        # The words arrive as little-endian integers, so swap their bytes in place if the RAM is big-endian.
+        if self._WORD_ENDIAN == '>' and self._WORD_SIZE > 1:
+            end = offset + num_bytes
+            words = buf[offset:end]
+            for i in range(self._WORD_SIZE):
+                buf[offset + i:end:self._WORD_SIZE] = words[self._WORD_SIZE - 1 - i::self._WORD_SIZE]
+        return num_bytes
+
+    def read(self, bottom=None, top=None):
+        """Return the hex data stored in a section of the RAM."""
+
+        if bottom is None or top is None:
+            raise XsMinorError('Must specify both top and bottom addresses to read %s.', self._DEVICE_NAME)
+
+        # Read the whole section into a single image buffer and then hand it to the hex data object.
+        image = bytearray(top - bottom + 1)
+        self.read_into(image, bottom, top)
         hex_bytes = IntelHex()
-        hex_bytes.puts(bottom, struct.pack(word_to_hex_format, *ram_words))
+        hex_bytes.frombytes(image, offset=bottom)
         return hex_bytes
 
 
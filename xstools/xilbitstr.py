@@ -30,6 +30,9 @@ import logging
 import string
 from xserror import *
 from xsbitarray import *
+from xslog import *
+
+_log = get_logger(__name__)
 
 
 class XilinxBitstream:
@@ -88,12 +91,12 @@ class XilinxBitstream:
                 self.compile_time = bitfile.read(field_length).tobytes()[:-1]
             elif field_code == BITSTREAM_FC:
                 field_length = bitfile.read(32).uint * 8
-                self.bits = XsBitArray(bitfile.read(field_length))
-                self.bits.reverse()  # Reverse the config bits so the 1st bit to transmit is at the highest bit index.
+                # The config bits are stored MSB-first in the file, so reorder them for transmission.
+                self.bits = XsBitArray.from_msb_bytes(bitfile.read(field_length).tobytes())
             else:
                 raise XsMajorError("Unknown field %d at position %d in bit file '%s'." % (field_code, bitfile.pos - 8, self.filename))
 
-        logging.debug(
+        _log.debug(
             'Bitstream file %s with design %s was compiled for %s at %s on %s into a bitstream of length %d',
             self.filename,
             self.design_name,
@@ -102,7 +105,8 @@ class XilinxBitstream:
             self.compile_date,
             self.bits.len,
             )
-        logging.debug('Bitstream start = %s', self.bits[0:1024])
+        if _log.isEnabledFor(logging.DEBUG):
+            _log.debug('Bitstream start = %s', BitsTrace(self.bits, limit=128))
 
         return True
         
@@ -26,22 +26,108 @@ Xilinx FPGA objects - from generic to more-specific subclasses.
 
 import logging
 import time
+import struct
+import binascii
 from xserror import *
 from xsjtag import *
 from xilbitstr import *
 
+# Fields of the 16-bit configuration packets of Spartan-3A and Spartan-6 bitstreams.
+_CFG_SYNC_WORD = 0xaa99
+_CFG_SYNC_WORD2 = 0x5566  # Spartan-6 bitstreams have a second synchronization word.
+_CFG_WRITE = 2  # Packet opcode for writing a register.
+_CFG_FDRI = 3  # Frame data input register.
+_CFG_FLR = 13  # Frame length register.
+
+
+def _tx_bits(bits, pos, num_bits):
+    """Return num_bits of a bit array starting with the one transmitted at position pos."""
+
+    return bits[bits.len - pos - num_bits:bits.len - pos]
+
+
+def _tx_words(bits, pos, num_words):
+    """Return the 16-bit words (transmitted most-significant bit first) starting at position pos of a bit array."""
+
+    return struct.unpack('>%dH' % num_words, str(_tx_bits(bits, pos, 16 * num_words).to_msb_bytes()))
+
+
+def _find_frames(bits):
+    """Return the position and number of words of the frame data written to FDRI by a bitstream, and its FLR value (or None)."""
+
+    # Skip the dummy words that come before the synchronization word.
+    pos = 0
+    while True:
+        if pos + 16 > bits.len:
+            raise XsMinorError('No synchronization word found in the bitstream.')
+        word = _tx_words(bits, pos, 1)[0]
+        pos += 16
+        if word == _CFG_SYNC_WORD:
+            break
+    if _tx_words(bits, pos, 1)[0] == _CFG_SYNC_WORD2:
+        pos += 16
+
+    # Go through the packets until the one with the frame data.
+    flr = None
+    while pos + 16 <= bits.len:
+        word = _tx_words(bits, pos, 1)[0]
+        pos += 16
+        packet_type, opcode, reg = word >> 13, word >> 11 & 0x3, word >> 5 & 0x3f
+        if packet_type == 1:
+            count = word & 0x1f
+            if opcode == _CFG_WRITE:
+                if reg == _CFG_FLR and count:
+                    flr = _tx_words(bits, pos, 1)[0]
+                pos += 16 * count
+        elif packet_type == 2:
+            # A type 2 packet is followed by a 32-bit word count.
+            count_hi, count_lo = _tx_words(bits, pos, 2)
+            count = count_hi << 16 | count_lo
+            pos += 32
+            if opcode == _CFG_WRITE and reg == _CFG_FDRI:
+                return pos, count, flr
+            if opcode == _CFG_WRITE:
+                pos += 16 * count
+    raise XsMinorError('No frame data found in the bitstream.')
+
+
+def _first_mismatch(actual, expected, ignore=None):
+    """Return the index of the first bit that differs between two byte arrays in USB bit order, or None if they match.
+
+    ignore = byte array whose 1 bits mark the bits that aren't compared.
+    """
+
+    if ignore is None and actual == expected:
+        return None
+    # Turn the bytes into integers with the first bit in the least-significant position.
+    diff = int(binascii.hexlify(str(actual[::-1])), 16) ^ int(binascii.hexlify(str(expected[::-1])), 16)
+    if ignore is not None:
+        diff &= ~int(binascii.hexlify(str(ignore[::-1])), 16)
+    if diff == 0:
+        return None
+    return (diff & -diff).bit_length() - 1
+
 
 class XilinxFpga:
 
     """Generic Xilinx FPGA object."""
 
+    # Configuration readback with 16-bit packets (see verify()). It's only supported if _CFG_SYNC is set.
+    _CFG_SYNC = None  # Hex string with the dummy and synchronization words that start a packet stream.
+    _FRAME_WORDS = None  # Number of words in a frame (None to get it from the FLR value in the bitstream).
+    _READBACK_BATCH_BITS = 1 << 18  # Number of frame bits captured by each USB round trip (a multiple of 16).
+
     def __init__(self, xsjtag=None):
         """Initialize the FPGA."""
 
         self.xsjtag = xsjtag
 
-    def configure(self, bitstream=None):
-        """Download the bitstream into the FPGA."""
+    def configure(self, bitstream=None, verify=False, mask=None):
+        """Download the bitstream into the FPGA.
+
+        verify = True to read back the configuration and compare it with the bitstream (see verify()).
+        mask = mask file for the comparison.
+        """
 
         # If the argument is not already a bitstream, then it must be a file name, so read the bitstream from it.
         if not isinstance(bitstream, XilinxBitstream):
@@ -62,6 +148,71 @@ class XilinxFpga:
         if self.get_status()['DONE'] != True:
             raise XsMinorError('FPGA failed to configure (DONE=False).')
 
+        if verify:
+            mismatch = self.verify(bitstream, mask)
+            if mismatch is not None:
+                raise XsMinorError('FPGA configuration differs from the bitstream at frame word %d: expected 0x%04x, read 0x%04x.' % mismatch)
+
+    def verify(self, bitstream, mask=None):
+        """Read back the configuration frames of the FPGA and compare them with a bitstream.
+
+        mask = bitstream (or the .msk file from bitgen -m) whose 1 bits mark the frame bits that
+               aren't compared, like block RAM and LUT RAM contents that change as the design runs.
+        The frames are captured in batches and each batch is compared as it arrives, so memory use
+        doesn't grow with the size of the FPGA. Returns None if the frames match, or a tuple with the
+        index of the first mismatched word in the frame data, the expected word and the word read back.
+        """
+
+        if self._CFG_SYNC is None:
+            raise XsMinorError('Configuration readback is not supported for %s FPGAs.' % self._DEVICE_TYPE)
+        if not isinstance(bitstream, XilinxBitstream):
+            bitstream = XilinxBitstream(bitstream)
+        if mask is not None and not isinstance(mask, XilinxBitstream):
+            mask = XilinxBitstream(mask)
+        frames_pos, num_words, flr = _find_frames(bitstream.bits)
+        mask_pos = _find_frames(mask.bits)[0] if mask is not None else None
+        frame_words = self._FRAME_WORDS or (flr + 1 if flr is not None else 0)
+        num_bits = 16 * (num_words - frame_words)  # The last frame written to FDRI is a pad frame.
+        xsjtag = self.xsjtag
+
+        # Set the frame address to zero and then read the frames from FDRO.
+        #       0x3022 - Write 2 words to FAR
+        #       0x30a1 - Write CMD with RCFG (0x0004)
+        #       0x2880, 0x4880 - Read FDRO with a type 2 packet and its 32-bit word count
+        command = XsBitArray(hex=self._CFG_SYNC + '2000' + '3022' + '0000' + '0000' + '30a1' + '0004' + '2000'
+                             + '2880' + '4880' + '%08x' % num_words + '2000' + '2000')
+        command.reverse()  # These strings are output MSbit first, so reverse them.
+        xsjtag.load_ir_then_dr(instruction=self._CFG_IN_INSTR, data=command)
+        xsjtag.load_ir_then_dr(instruction=self._CFG_OUT_INSTR)
+        xsjtag.goto_state(XsJtag.SHIFT_DR)
+        try:
+            # The first frame read back is a pad frame, so skip it.
+            xsjtag.shift_tdo(16 * frame_words, do_exit_shift=num_bits == 0)
+            buf = bytearray((min(self._READBACK_BATCH_BITS, num_bits) + 7) // 8)
+            pos = 0
+            while pos < num_bits:
+                n = min(self._READBACK_BATCH_BITS, num_bits - pos)
+                num_bytes = xsjtag.shift_tdo_into(buf, n, do_exit_shift=pos + n == num_bits)
+                actual = buf[:num_bytes]
+                expected = _tx_bits(bitstream.bits, frames_pos + pos, n).to_usb()
+                ignore = _tx_bits(mask.bits, mask_pos + pos, n).to_usb() if mask is not None else None
+                bit = _first_mismatch(actual, expected, ignore)
+                if bit is not None:
+                    word = (pos + bit) // 16
+                    return (word,
+                            _tx_words(bitstream.bits, frames_pos + 16 * word, 1)[0],
+                            _tx_words(XsBitArray.from_usb(actual, n), 16 * word - pos, 1)[0])
+                pos += n
+            return None
+        finally:
+            # Leave the shift-dr state and take the configuration logic out of its packet-processing mode.
+            #       0x30a1 - Write CMD with DESYNC (0x000d)
+            xsjtag.goto_state(XsJtag.RUN_TEST_IDLE)
+            command = XsBitArray(hex='30a1' + '000d' + '2000' + '2000')
+            command.reverse()
+            xsjtag.load_ir_then_dr(instruction=self._CFG_IN_INSTR, data=command)
+            xsjtag.reset_tap()
+
     def get_idcode(self):
         """Return the FPGA's IDCODE."""
 
@@ -108,18 +259,19 @@ class Xc2s(XilinxFpga):
         # Now download the bitstream.
         self.xsjtag.load_ir_then_dr(instruction=self._CFG_IN_INSTR, data=bitstream.bits)
 
-        # Bitstream downloaded, now startup the FPGA.
-        self.xsjtag.load_ir_then_dr(instruction=self._JSTART_INSTR)
-        self.xsjtag.runtest(num_tcks=12)
-        self.xsjtag.load_ir_then_dr(instruction=self._JSTART_INSTR, data=XsBitArray(22))
-        self.xsjtag.run_test_idle()
+        # Bitstream downloaded, now startup the FPGA. The startup sequence is sent in a single write
+        # without waiting for the runtest echo (configure() checks the DONE status afterwards).
+        with self.xsjtag.deferred(), self.xsjtag.no_return():
+            self.xsjtag.load_ir_then_dr(instruction=self._JSTART_INSTR)
+            self.xsjtag.runtest(num_tcks=12)
+            self.xsjtag.load_ir_then_dr(instruction=self._JSTART_INSTR, data=XsBitArray(22))
+            self.xsjtag.run_test_idle()
 
     def get_status(self):
         """Return dict containing the Spartan-2 FPGA's status register bits."""
 
         # See xapp139 & xapp151.
         # Start off in the run-test/idle state.
-        self.xsjtag.reset_tap()
         self.xsjtag.run_test_idle()
 
         # Now download the bitstream.
@@ -181,6 +333,9 @@ class Xc3s(XilinxFpga):
 
     """Generic Xilinx Spartan-3 FPGA object."""
 
+    # Configuration readback (Spartan-3A packets). The frame length comes from the FLR value in the bitstream.
+    _CFG_SYNC = 'ffff' + 'aa99'
+
     # Spartan-3A JTAG instruction opcodes.
     _EXTEST_INSTR = XsBitArray('0b000000')
     _SAMPLE_INSTR = XsBitArray('0b000001')
@@ -217,7 +372,7 @@ class Xc3s(XilinxFpga):
         # http://www.xilinx.com/support/documentation/application_notes/xapp452.pdf
         # Must follow JPROGRAM with CFG_IN to keep device locked to JTAG.
         # See AR 16829.
-        self.xsjtag.load_ir_then_dr(instruction=self._JPROGRAM_INSTR)
+        self.xsjtag.load_ir_then_dr(instruction=self._JPROGRAM_INSTR, force=True)
         self.xsjtag.load_ir_then_dr(instruction=self._CFG_IN_INSTR)
 
         # Give time for FPGA to clear its memory.
@@ -226,11 +381,13 @@ class Xc3s(XilinxFpga):
         # Now download the bitstream.
         self.xsjtag.load_ir_then_dr(instruction=self._CFG_IN_INSTR, data=bitstream.bits)
 
-        # Bitstream downloaded, now startup the FPGA.
-        self.xsjtag.load_ir_then_dr(instruction=self._JSTART_INSTR)
-        self.xsjtag.runtest(num_tcks=12)
-        self.xsjtag.load_ir_then_dr(instruction=self._JSTART_INSTR, data=XsBitArray(22))
-        self.xsjtag.reset_tap()
+        # Bitstream downloaded, now startup the FPGA. The startup sequence is sent in a single write
+        # without waiting for the runtest echo (configure() checks the DONE status afterwards).
+        with self.xsjtag.deferred(), self.xsjtag.no_return():
+            self.xsjtag.load_ir_then_dr(instruction=self._JSTART_INSTR)
+            self.xsjtag.runtest(num_tcks=12)
+            self.xsjtag.load_ir_then_dr(instruction=self._JSTART_INSTR, data=XsBitArray(22))
+            self.xsjtag.reset_tap()
 
     def get_status(self):
         """Return dict containing the Spartan-3A FPGA's status register bits."""
@@ -308,6 +465,10 @@ class Xc6s(XilinxFpga):
 
     """Generic Xilinx Spartan-6 FPGA object."""
 
+    # Configuration readback (UG380).
+    _CFG_SYNC = 'ffff' + 'ffff' + 'aa99' + '5566'
+    _FRAME_WORDS = 65
+
     # Spartan-6 JTAG instruction opcodes.
     _SAMPLE_INSTR = XsBitArray('0b000001')
     _USER1_INSTR = XsBitArray('0b000010')
@@ -340,7 +501,7 @@ class Xc6s(XilinxFpga):
 
         self.xsjtag.reset_tap()
         self.xsjtag.go_thru_tap_states('Run-Test/Idle')
-        self.xsjtag.load_ir_then_dr(instruction=self._JPROGRAM_INSTR)
+        self.xsjtag.load_ir_then_dr(instruction=self._JPROGRAM_INSTR, force=True)
         self.xsjtag.load_ir_then_dr(instruction=self._CFG_IN_INSTR)
 
         # Give time for FPGA to clear its memory.
@@ -349,10 +510,12 @@ class Xc6s(XilinxFpga):
         # Download the bitstream.
         self.xsjtag.load_ir_then_dr(instruction=self._CFG_IN_INSTR, data=bitstream.bits)
 
-        # Bitstream downloaded, now startup the FPGA.
-        self.xsjtag.load_ir_then_dr(instruction=self._JSTART_INSTR)
-        self.xsjtag.runtest(num_tcks=30)
-        self.xsjtag.reset_tap()
+        # Bitstream downloaded, now startup the FPGA. The startup sequence is sent in a single write
+        # without waiting for the runtest echo (configure() checks the DONE status afterwards).
+        with self.xsjtag.deferred(), self.xsjtag.no_return():
+            self.xsjtag.load_ir_then_dr(instruction=self._JSTART_INSTR)
+            self.xsjtag.runtest(num_tcks=30)
+            self.xsjtag.reset_tap()
 
     def get_status(self):
         """Return dict containing the Spartan-6 FPGA's status register bits."""
@@ -363,7 +526,6 @@ class Xc6s(XilinxFpga):
                              + '2901' + '2000' + '2000' + '2000' + '2000')
         command.reverse()  # These strings are output MSbit first, so reverse them.
 
-        self.xsjtag.reset_tap()
         self.xsjtag.load_ir_then_dr(instruction=self._CFG_IN_INSTR, data=command)
 
         # Now read the 32 bits from the status register as defined on UG380, pg 95.
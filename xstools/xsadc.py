@@ -0,0 +1,216 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# **********************************************************************
+#   This program is free software; you can redistribute it and/or
+#   modify it under the terms of the GNU General Public License
+#   as published by the Free Software Foundation; either version 2
+#   of the License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+#   02111-1307, USA.
+#
+#   (c)2012 - X Engineering Software Systems Corp. (www.xess.com)
+# **********************************************************************
+
+"""
+Background sampling of the AIO0/AIO1 analog inputs of an XESS board.
+
+An XsAdcSampler keeps a thread running batches of ADC conversions and
+stores the latest samples in a ring buffer:
+
+    sampler = XsAdcSampler(xsusb, aio=0)
+    sampler.start()
+    ...
+    times, volts = sampler.get_samples(1000)  # The most recent 1000 samples.
+    print sampler.get_stats()
+    sampler.stop()
+
+Nothing else should use the board while the sampler is running.
+"""
+
+import math
+import time
+import array
+import threading
+from xserror import *
+from xslog import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_log = get_logger(__name__)
+
+
+class XsAdcSampler:
+
+    """Thread that samples an analog input into a ring buffer."""
+
+    _CAPACITY = 65536  # Default number of samples kept in the ring buffer.
+    _BATCH_SIZE = 64  # Default number of conversions requested by each USB transfer.
+
+    def __init__(self, xsusb, aio=0, capacity=_CAPACITY, batch_size=_BATCH_SIZE, interval=0.0):
+        """Set up a sampler.
+
+        xsusb = XsUsb object for the board.
+        aio = analog input to sample (0 or 1).
+        capacity = number of samples kept in the ring buffer.
+        batch_size = number of conversions requested by each USB transfer.
+        interval = seconds to wait between batches (0 to sample as fast as possible).
+        """
+
+        self.xsusb = xsusb
+        self.aio = aio
+        self.capacity = capacity
+        self.batch_size = min(batch_size, capacity)  # A batch has to fit in the ring buffer.
+        self.interval = interval
+        if numpy is not None:
+            self._times = numpy.zeros(capacity)
+            self._volts = numpy.zeros(capacity)
+        else:
+            self._times = array.array('d', [0.0]) * capacity
+            self._volts = array.array('d', [0.0]) * capacity
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.error = None  # The exception that stopped the sampler, if there was one.
+        self.clear()
+
+    def clear(self):
+        """Empty the ring buffer and reset the statistics."""
+
+        with self._lock:
+            self._count = 0  # Total number of samples taken (the ring buffer holds the most recent ones).
+            self._first_time = None
+            self._last_time = None
+            # Running mean and variance of the sample period of each batch (Welford's method).
+            self._num_batches = 0
+            self._mean_period = 0.0
+            self._period_m2 = 0.0
+
+    def start(self):
+        """Start sampling in the background."""
+
+        if self._thread is not None:
+            return  # Already sampling.
+        self._stop.clear()
+        self.error = None
+        self._thread = threading.Thread(target=self._run, name='XsAdcSampler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling and raise any error that stopped the sampler early."""
+
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        if self.error is not None:
+            raise self.error
+
+    def is_running(self):
+        """Return True if the sampler thread is taking samples."""
+
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        """Take batches of samples until told to stop."""
+
+        try:
+            while not self._stop.is_set():
+                times, volts = self.xsusb.sample_adc(self.aio, self.batch_size, self.batch_size)
+                self._store(times, volts)
+                if self.interval:
+                    self._stop.wait(self.interval)
+        except Exception as e:
+            _log.error('ADC sampling stopped: %s', e)
+            self.error = e
+
+    def _store(self, times, volts):
+        """Add a batch of samples to the ring buffer and the statistics."""
+
+        n = len(times)
+        with self._lock:
+            # Copy the batch into the ring buffer, wrapping around the end if needed.
+            pos = self._count % self.capacity
+            first = min(n, self.capacity - pos)
+            self._times[pos:pos + first] = times[:first]
+            self._volts[pos:pos + first] = volts[:first]
+            if first < n:
+                self._times[:n - first] = times[first:]
+                self._volts[:n - first] = volts[first:]
+            self._count += n
+
+            if self._first_time is None:
+                self._first_time = times[0]
+            self._last_time = times[-1]
+            if n > 1:
+                period = (times[-1] - times[0]) / (n - 1)
+                self._num_batches += 1
+                delta = period - self._mean_period
+                self._mean_period += delta / self._num_batches
+                self._period_m2 += delta * (period - self._mean_period)
+
+    def get_samples(self, num_samples=None):
+        """Return the timestamps and voltages of the most recent samples, oldest first.
+
+        num_samples = number of samples to return (default is all those in the ring buffer).
+        """
+
+        with self._lock:
+            available = min(self._count, self.capacity)
+            if num_samples is None or num_samples > available:
+                num_samples = available
+            end = self._count % self.capacity
+            start = end - num_samples
+            if numpy is not None:
+                # Index with the positions so the samples are copied out of the ring buffer even if they don't wrap.
+                positions = numpy.arange(start, end) % self.capacity
+                return self._times[positions], self._volts[positions]
+            if start >= 0:
+                return self._times[start:end], self._volts[start:end]
+            # The samples wrap around the end of the ring buffer.
+            return self._times[start:] + self._times[:end], self._volts[start:] + self._volts[:end]
+
+    def get_stats(self):
+        """Return a dictionary with the number of samples, the sampling rate and its jitter.
+
+        rate = samples per second since sampling started.
+        period = average time between samples within a batch (seconds).
+        jitter = standard deviation of the sample period from batch to batch (seconds).
+        """
+
+        with self._lock:
+            elapsed = (self._last_time - self._first_time) if self._count > 1 else 0.0
+            variance = self._period_m2 / (self._num_batches - 1) if self._num_batches > 1 else 0.0
+            return {
+                'samples': self._count,
+                'rate': (self._count - 1) / elapsed if elapsed > 0 else 0.0,
+                'period': self._mean_period,
+                'jitter': math.sqrt(variance),
+                }
+
+
+if __name__ == '__main__':
+    from xsusb import XsUsb
+
+    xsusb = XsUsb()
+    start = time.time()
+    times, volts = xsusb.sample_adc(0, 1000)
+    print '1000 samples of AIO0 in %.3f s, average = %.3f V' % (time.time() - start, sum(volts) / len(volts))
+
+    sampler = XsAdcSampler(xsusb, aio=1)
+    sampler.start()
+    time.sleep(2.0)
+    sampler.stop()
+    print 'Background sampling of AIO1:', sampler.get_stats()
@@ -0,0 +1,342 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# **********************************************************************
+#   This program is free software; you can redistribute it and/or
+#   modify it under the terms of the GNU General Public License
+#   as published by the Free Software Foundation; either version 2
+#   of the License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+#   02111-1307, USA.
+#
+#   (c)2012 - X Engineering Software Systems Corp. (www.xess.com)
+# **********************************************************************
+
+"""
+USB backends that find XESS boards and open transports to them for XsUsb.
+
+    pyusb   - Synchronous transfers through pyusb (the default).
+    libusb1 - Asynchronous transfers through python-libusb1 that keep several
+              bulk OUT URBs in flight, for moving lots of data.
+    sim     - Simulated boards inside this process (see xssim), for running
+              without any hardware.
+
+The backend is chosen with XsUsb.set_backend() or, if that isn't called, with
+the XSTOOLS_USB_BACKEND environment variable.
+"""
+
+import os
+import time
+import logging
+import usb.core
+import usb.util
+from xserror import *
+from xslog import *
+from xstransport import XsTransport, read_result
+
+try:
+    import usb1
+except ImportError:
+    usb1 = None
+
+_log = get_logger(__name__)
+
+ENDPOINT_OUT = 0x00  # Direction bit of an OUT endpoint address.
+ENDPOINT_IN = 0x80  # Direction bit of an IN endpoint address.
+
+BACKEND_ENV_VAR = 'XSTOOLS_USB_BACKEND'
+DEFAULT_BACKEND = 'pyusb'
+
+
+class XsUsbBackend:
+
+    """Interface for the objects XsUsb uses to find and talk to XESS boards.
+
+    The device handles returned by enumerate() must have bus, address and
+    port_numbers attributes so XsUsb can tell the boards apart.
+    """
+
+    name = None
+    errors = ()  # Exceptions the backend raises when a USB operation fails.
+    udev_events = True  # True if udev reports the boards of this backend coming and going.
+
+    def enumerate(self, vendor_id, product_id):
+        """Return a list of handles for the devices with the given vendor and product IDs."""
+
+        raise NotImplementedError
+
+    def open(self, dev):
+        """Return the transport (see xstransport) for a device, opening it if needed."""
+
+        raise NotImplementedError
+
+    def dispose(self, dev):
+        """Release the resources held for a device. The next open() gets them again."""
+
+        pass
+
+    def reset(self, dev):
+        """Reset the USB port of a device.
+
+        Returns True if the device is ready to use again, or False if it leaves
+        and has to be found again when it comes back.
+        """
+
+        return False
+
+
+class PyUsbBackend(XsUsbBackend):
+
+    """Backend that does synchronous transfers through pyusb."""
+
+    name = 'pyusb'
+    errors = (usb.core.USBError,)
+
+    def enumerate(self, vendor_id, product_id):
+        # The find() routine throws exceptions under linux when XESS boards are
+        # connected/reconnected, so catch the exceptions.
+        delay = 0.001
+        while(True):
+            try:
+                return list(usb.core.find(idVendor=vendor_id, idProduct=product_id, find_all=True))
+            except usb.core.USBError:
+                # Keep trying until no exceptions occur, but give the USB bus time to settle.
+                time.sleep(delay)
+                delay = min(2 * delay, 0.1)
+
+    def open(self, dev):
+        # A pyusb device already has the write() and read() methods of a transport.
+        return dev
+
+    def dispose(self, dev):
+        usb.util.dispose_resources(dev)
+
+    def reset(self, dev):
+        if os.name == 'nt':
+            # On Windows, this re-enumerates the USB devices.
+            dev.reset()
+        # linux doesn't re-enumerate the USB port when reset(), so the board has to be disconnected/reconnected.
+        return False
+
+
+class _Libusb1Device:
+
+    """Handle for a device found by the libusb1 backend."""
+
+    def __init__(self, device):
+        self.device = device
+        self.bus = device.getBusNumber()
+        self.address = device.getDeviceAddress()
+        try:
+            self.port_numbers = tuple(device.getPortNumberList() or ())
+        except (AttributeError, NotImplementedError):
+            self.port_numbers = ()  # Older libusb versions don't report the port path.
+        self.transport = None
+
+
+class _Libusb1Transport(XsTransport):
+
+    """Transport that splits each transfer into URBs and keeps several OUT URBs in flight."""
+
+    def __init__(self, context, device, urb_size, num_urbs):
+        self._context = context
+        self._urb_size = urb_size
+        self._handle = device.open()
+        try:
+            self._handle.claimInterface(0)
+        except usb1.USBError:
+            self._handle.close()
+            raise
+        self._transfers = [self._handle.getTransfer() for i in range(num_urbs)]
+
+    def _run(self, endpoint, chunks, timeout):
+        """Do the bulk transfers for a list of buffers (OUT) or sizes (IN) and return the bytes moved by each."""
+
+        results = [None] * len(chunks)
+        free = list(self._transfers)
+        errors = []
+
+        def done(transfer):
+            i = transfer.getUserData()
+            if transfer.getStatus() != usb1.TRANSFER_COMPLETED:
+                errors.append(transfer.getStatus())
+            results[i] = bytearray(transfer.getBuffer()[:transfer.getActualLength()])
+            free.append(transfer)
+
+        next_chunk = 0
+        while len(free) < len(self._transfers) or (next_chunk < len(chunks) and not errors):
+            # Keep as many URBs in flight as possible while there's data left to move.
+            while free and next_chunk < len(chunks) and not errors:
+                transfer = free.pop()
+                transfer.setBulk(endpoint, chunks[next_chunk], callback=done, user_data=next_chunk, timeout=timeout)
+                transfer.submit()
+                next_chunk += 1
+            if errors:
+                # Don't wait for the URBs that are still in flight.
+                for transfer in self._transfers:
+                    if transfer not in free:
+                        try:
+                            transfer.cancel()
+                        except usb1.USBError:
+                            pass  # It finished before it could be cancelled.
+            self._context.handleEvents()
+        if errors:
+            raise XsMajorError('USB transfer on endpoint 0x%02x failed with status %d.' % (endpoint, errors[0]))
+        return results
+
+    def write(self, endpoint, data, timeout=None):
+        data = bytearray(data)
+        size = self._urb_size
+        chunks = [data[i:i + size] for i in range(0, len(data), size)] or [data]
+        return sum(len(r) for r in self._run(endpoint, chunks, timeout or 0))
+
+    def read(self, endpoint, size_or_buffer, timeout=None):
+        num_bytes = size_or_buffer if isinstance(size_or_buffer, (int, long)) else len(size_or_buffer)
+        # The IN URBs go one at a time. A short packet from the board ends the URB it lands in
+        # and the read, so any other URBs in flight would wait forever for bytes that aren't coming.
+        data = bytearray()
+        while True:
+            size = min(self._urb_size, num_bytes - len(data))
+            chunk = self._run(endpoint, [size], timeout or 0)[0]
+            data += chunk
+            if len(chunk) < size or len(data) >= num_bytes:
+                break
+        return read_result(size_or_buffer, data)
+
+    def reset(self):
+        """Reset the USB port of the device."""
+
+        if self._handle is not None:
+            try:
+                self._handle.resetDevice()
+            except usb1.USBError:
+                pass  # The board has already dropped off the bus.
+
+    def close(self):
+        if self._handle is not None:
+            try:
+                self._handle.releaseInterface(0)
+            except usb1.USBError:
+                pass  # The board is probably gone already.
+            self._handle.close()
+            self._handle = None
+
+
+class Libusb1Backend(XsUsbBackend):
+
+    """Backend that does asynchronous transfers through python-libusb1."""
+
+    name = 'libusb1'
+
+    _URB_SIZE = 16384  # Bytes in each URB (a multiple of the 64-byte packet size).
+    _NUM_URBS = 4  # Number of URBs kept in flight for each transfer.
+
+    def __init__(self, urb_size=_URB_SIZE, num_urbs=_NUM_URBS):
+        if usb1 is None:
+            raise XsMajorError('The libusb1 USB backend needs the python-libusb1 package.')
+        self.errors = (usb1.USBError,)
+        self.urb_size = urb_size
+        self.num_urbs = num_urbs
+        self._context = usb1.USBContext()
+
+    def enumerate(self, vendor_id, product_id):
+        return [_Libusb1Device(d) for d in self._context.getDeviceList(skip_on_error=True)
+                if d.getVendorID() == vendor_id and d.getProductID() == product_id]
+
+    def open(self, dev):
+        if dev.transport is None:
+            dev.transport = _Libusb1Transport(self._context, dev.device, self.urb_size, self.num_urbs)
+        return dev.transport
+
+    def dispose(self, dev):
+        if dev.transport is not None:
+            dev.transport.close()
+            dev.transport = None
+
+    def reset(self, dev):
+        if dev.transport is not None:
+            dev.transport.reset()
+        self.dispose(dev)
+        return False
+
+
+class _SimDevice:
+
+    """Handle for a simulated board."""
+
+    def __init__(self, board, address):
+        self.board = board
+        self.bus = 0
+        self.address = address
+        self.port_numbers = (address,)
+
+
+class XsSimBackend(XsUsbBackend):
+
+    """Backend with simulated boards that can be plugged and unplugged by the program."""
+
+    name = 'sim'
+    udev_events = False
+
+    def __init__(self, boards=None):
+        """Start with the simulated boards in a list (default is a single XuLA-200 with its SDRAM)."""
+
+        from xssim import XsSimBoard, XsSimMemory  # Only loaded when boards are simulated.
+        if boards is None:
+            boards = [XsSimBoard(modules={3: XsSimMemory(24, 16)})]
+        self._devs = []
+        self._next_address = 1
+        for board in boards:
+            self.plug(board)
+
+    def plug(self, board):
+        """Attach a simulated board and return its device handle."""
+
+        dev = _SimDevice(board, self._next_address)
+        self._next_address += 1
+        self._devs.append(dev)
+        return dev
+
+    def unplug(self, board):
+        """Detach a simulated board."""
+
+        self._devs = [d for d in self._devs if d.board is not board]
+
+    def enumerate(self, vendor_id, product_id):
+        return list(self._devs)
+
+    def open(self, dev):
+        if dev not in self._devs:
+            raise XsMajorError('Simulated XESS board has been unplugged.')
+        return dev.board
+
+    def reset(self, dev):
+        # The simulated board handles the RESET_CMD itself and never leaves the bus.
+        return True
+
+
+_BACKENDS = {
+    PyUsbBackend.name: PyUsbBackend,
+    Libusb1Backend.name: Libusb1Backend,
+    XsSimBackend.name: XsSimBackend,
+    }
+
+
+def get_backend(name=None):
+    """Create a backend given its name (default is the XSTOOLS_USB_BACKEND environment variable, or pyusb)."""
+
+    if name is None:
+        name = os.environ.get(BACKEND_ENV_VAR) or DEFAULT_BACKEND
+    try:
+        backend_class = _BACKENDS[name.lower()]
+    except KeyError:
+        raise XsMajorError('Unknown USB backend %s. Choose one of: %s.' % (name, ', '.join(sorted(_BACKENDS))))
+    _log.debug('Using the %s USB backend.', backend_class.name)
+    return backend_class()
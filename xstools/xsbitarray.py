@@ -21,96 +21,476 @@
 # **********************************************************************
 
 """
-XESS extensions to the BitArray class of the bitstring module.
+XESS bit array class for storing the TDI, TMS and TDO bit streams sent to
+and received from XESS boards.
 """
 
 import logging
+import binascii
 from xserror import *
 import bitstring
 from bitstring import Bits, BitArray, BitStream, ConstBitStream
 from intelhex import IntelHex
 
 
-class XsBitArray(BitArray):
+# Maximum number of characters used when printing a bit array.
+_MAX_CHARS = 250
+
+# Translation table that reverses the order of the bits in a byte.
+_BIT_REVERSE_TABLE = str(bytearray(int(format(b, '08b')[::-1], 2) for b in range(256)))
+
+
+def _bytes_to_uint(buf):
+    """Return the unsigned integer stored in a little-endian byte array."""
+
+    if len(buf) == 0:
+        return 0
+    return int(binascii.hexlify(str(buf[::-1])), 16)
+
+
+def _uint_to_bytes(value, num_bytes):
+    """Return a little-endian byte array with num_bytes bytes that stores an unsigned integer."""
+
+    if num_bytes == 0:
+        return bytearray()
+    return bytearray(binascii.unhexlify('%0*x' % (2 * num_bytes, value)))[::-1]
+
+
+class XsBitArray(object):
 
     """Class for storing and manipulating bit vectors."""
 
-    # The underlying bitstring class stores a bitstring such as 0b110010 with the
-    # most-significant bit (1 in this case) in index position 0, and the least-significant
-    # bit (0 in this case) in the highest index position (5 in this case).
-    #
     # The bitstrings for the XESS boards typically contain strings of JTAG TDI and TMS
-    # bits which are transmitted starting with the least-significant bit. This creates a
-    # problem if a bitstring like 0b110010 is to be transmitted and followed by another
-    # bitstring like 0b101011. Concatenating the bitstrings gives 0b110010101011, but the
-    # actual transmission order should be 010011110101. It would be easier if the bitstrings
-    # were concatenated in the reverse order as 101011110010 and then transmitted starting
-    # from the highest bit index and proceeding down to index 0. To do this while expressing
-    # the bit string concatenations in their more natural left-to-right order, the +, +=
-    # and append operations were redefined to do their operations in the reverse order.
-    # So a + b with XsBitArrays gives the same result as b + a with BitArrays.
+    # bits which are transmitted starting with the least-significant bit. A bitstring
+    # like 0b110010 is transmitted as 010011, and if it's followed by another bitstring
+    # like 0b101011, then the actual transmission order is 010011110101. This makes
+    # the concatenation a + b equivalent to the bitstring b followed by a, and it
+    # makes the least-significant bit (the one at the highest index) the first bit
+    # that gets transmitted.
+    #
+    # Internally, the bits are stored in a byte array in the order they are
+    # transmitted: the first transmitted bit is in the least-significant bit of the
+    # first byte. Appending bits only touches the end of the byte array, so building
+    # long bit streams one piece at a time takes time proportional to the number of
+    # appended bits and not to the length of the stream. And bits can be popped off the
+    # front of the stream by just advancing an offset into the byte array.
+    #
+    #       Byte array order: | b7 b6 b5 b4 b3 b2 b1 b0 | b15 b14 b13 b12 b11 b10 b9 b8 | ...
+    #
+    # The index ordering of the bits is the same as a bitstring's: index 0 holds the
+    # most-significant (last transmitted) bit and the highest index holds the
+    # least-significant (first transmitted) bit.
+    #
+    #       XsBitArray index order: | b15 b14 b13 b12 b11 b10 b9 b8 b7 b6 b5 b4 b3 b2 b1 b0 |
+
+    def __init__(self, auto=None, **kwargs):
+        """Create a bit array.
+
+        auto = another bit array, a bitstring, a '0b...' or '0x...' string,
+               a list of bit values, or the number of zero bits to create.
+        length = the number of bits in the bit array.
+        uint, int, bin, hex, bytes = initialize the bit array from an
+               unsigned or signed integer, a binary or hex string, or a string of bytes.
+        """
+
+        self._buf = bytearray()  # Bits in transmission order.
+        self._off = 0  # Index of the first bit in the byte array.
+        self._len = 0  # Number of bits in the byte array.
+
+        length = kwargs.pop('length', None)
+        if auto is not None:
+            assert len(kwargs) == 0
+            self._set_auto(auto, length)
+        elif 'uint' in kwargs:
+            value = kwargs.pop('uint')
+            if length is None or value < 0 or value >> length != 0:
+                raise XsMinorError('Unsigned integer %d will not fit into %s bits.' % (value, length))
+            self._set_uint(value, length)
+        elif 'int' in kwargs:
+            value = kwargs.pop('int')
+            if length is None or not -(1 << length - 1) <= value < 1 << length - 1:
+                raise XsMinorError('Signed integer %d will not fit into %s bits.' % (value, length))
+            self._set_uint(value & ((1 << length) - 1), length)
+        elif 'bin' in kwargs:
+            self._set_bin(kwargs.pop('bin'))
+        elif 'hex' in kwargs:
+            self._set_hex(kwargs.pop('hex'))
+        elif 'bytes' in kwargs:
+            self._set_bytes(kwargs.pop('bytes'), length)
+        elif length is not None:
+            self._set_uint(0, length)
+        if len(kwargs) != 0:
+            raise XsMinorError('Unknown XsBitArray initializers: %s.' % ', '.join(kwargs.keys()))
+
+    def _set_uint(self, value, length):
+        """Store length bits of an unsigned integer in the bit array."""
+
+        self._buf = _uint_to_bytes(value, (length + 7) // 8)
+        self._off = 0
+        self._len = length
+
+    def _set_bin(self, s):
+        """Store the bits from a string of binary digits in the bit array."""
+
+        s = s.replace('_', '').replace(' ', '')
+        if s.startswith('0b'):
+            s = s[2:]
+        self._set_uint(int(s, 2) if s else 0, len(s))
+
+    def _set_hex(self, s):
+        """Store the bits from a string of hex digits in the bit array."""
+
+        s = s.replace('_', '').replace(' ', '')
+        if s.startswith('0x'):
+            s = s[2:]
+        self._set_uint(int(s, 16) if s else 0, 4 * len(s))
+
+    def _set_bytes(self, data, length=None):
+        """Store the bits from a string of bytes with the bit at index 0 in the MSB of the first byte."""
+
+        data = bytearray(data)
+        if length is None:
+            length = 8 * len(data)
+        num_bytes = (length + 7) // 8
+        if num_bytes > len(data):
+            raise XsMinorError('Not enough bytes to hold %d bits.' % length)
+        value = _bytes_to_uint(data[num_bytes - 1::-1]) if num_bytes else 0
+        self._set_uint(value >> (8 * num_bytes - length), length)
+
+    def _set_auto(self, auto, length=None):
+        """Store the bits from some type of object in the bit array."""
+
+        if isinstance(auto, XsBitArray):
+            self._buf = auto._get_bytes()
+            self._off = 0
+            self._len = auto._len
+        elif isinstance(auto, Bits):
+            self._set_bytes(auto.tobytes(), auto.len)
+        elif isinstance(auto, (int, long)) and not isinstance(auto, bool):
+            if auto < 0:
+                raise XsMinorError('Cannot create a bit array with a negative length.')
+            self._set_uint(0, auto)
+        elif isinstance(auto, basestring):
+            auto = auto.strip()
+            if auto.startswith('0b'):
+                self._set_bin(auto)
+            elif auto.startswith('0x'):
+                self._set_hex(auto)
+            else:
+                raise XsMinorError("Cannot create a bit array from string '%s'." % auto)
+        elif isinstance(auto, bytearray):
+            self._set_bytes(auto, length)
+        else:
+            # Assume it's a sequence of bit values with the first one at index 0.
+            bits = list(auto)
+            value = 0
+            for b in bits:
+                value = value << 1 | (1 if b else 0)
+            self._set_uint(value, len(bits))
+        if length is not None and length != self._len:
+            raise XsMinorError('Bit array has %d bits but length is %d.' % (self._len, length))
+
+    @staticmethod
+    def _coerce(bits):
+        """Return the argument as an XsBitArray."""
+
+        if isinstance(bits, XsBitArray):
+            return bits
+        return XsBitArray(bits)
+
+    def _get_uint(self, start, stop):
+        """Return the bits in the transmission-ordered range [start, stop) as an unsigned integer."""
+
+        if stop <= start:
+            return 0
+        start += self._off
+        stop += self._off
+        value = _bytes_to_uint(self._buf[start >> 3:(stop + 7) >> 3]) >> (start & 7)
+        return value & ((1 << stop - start) - 1)
+
+    def _get_bytes(self, start=0, stop=None):
+        """Return a byte array with the bits in the transmission-ordered range [start, stop)."""
+
+        if stop is None:
+            stop = self._len
+        if stop <= start:
+            return bytearray()
+        num_bytes = (stop - start + 7) >> 3
+        first = self._off + start
+        if first & 7 == 0:
+            # The range starts on a byte boundary, so just copy the bytes and clear any unused bits.
+            buf = self._buf[first >> 3:(first >> 3) + num_bytes]
+            unused = 8 * num_bytes - (stop - start)
+            if unused:
+                buf[-1] &= 0xff >> unused
+            return buf
+        return _uint_to_bytes(self._get_uint(start, stop), num_bytes)
+
+    def _sub(self, start, stop):
+        """Return a bit array with the bits in the transmission-ordered range [start, stop)."""
+
+        bits = XsBitArray()
+        if stop > start:
+            bits._buf = self._get_bytes(start, stop)
+            bits._len = stop - start
+        return bits
+
+    def _compact(self):
+        """Move the bits to the start of the byte array."""
+
+        if self._off != 0:
+            self._buf = self._get_bytes()
+            self._off = 0
+
+    def _copy(self):
+        """Return a copy of the bit array."""
+
+        return self._sub(0, self._len)
+
+    copy = _copy
+
+    @property
+    def len(self):
+        """Return the number of bits in the bit array."""
+
+        return self._len
+
+    length = len
+
+    def __len__(self):
+        return self._len
+
+    @property
+    def uint(self):
+        """Return the bit array as an unsigned integer."""
+
+        return self._get_uint(0, self._len)
+
+    unsigned = uint
+
+    @property
+    def int(self):
+        """Return the bit array as a two's-complement signed integer."""
+
+        value = self._get_uint(0, self._len)
+        if self._len and value >> (self._len - 1):
+            value -= 1 << self._len
+        return value
+
+    integer = int
+
+    @property
+    def bin(self):
+        """Return the bit array as a string of binary digits."""
+
+        if self._len == 0:
+            return ''
+        return format(self._get_uint(0, self._len), '0%db' % self._len)
+
+    string = bin
+
+    @property
+    def hex(self):
+        """Return the bit array as a string of hex digits."""
+
+        if self._len % 4 != 0:
+            raise XsMinorError('Cannot convert %d bits into hex digits.' % self._len)
+        if self._len == 0:
+            return ''
+        return '%0*x' % (self._len // 4, self._get_uint(0, self._len))
+
+    @property
+    def bytes(self):
+        """Return the bit array as a string of bytes with bit index 0 in the MSB of the first byte."""
+
+        if self._len % 8 != 0:
+            raise XsMinorError('Cannot convert %d bits into whole bytes.' % self._len)
+        return str(self._get_bytes()[::-1])
+
+    def tobytes(self):
+        """Return the bit array as a string of bytes padded with zero bits at the end."""
+
+        num_bytes = (self._len + 7) // 8
+        return str(_uint_to_bytes(self._get_uint(0, self._len) << (8 * num_bytes - self._len), num_bytes)[::-1])
 
     def append(self, bits):
-        """Append the contents of a bitstring to this one, but in reverse order."""
+        """Append the contents of a bitstring so its bits are transmitted after this one's."""
 
-        return super(XsBitArray, self).prepend(bits)
+        if isinstance(bits, list) and len(bits) == 1:
+            # Fast path for appending a single bit.
+            pos = self._off + self._len
+            if pos & 7 == 0:
+                self._buf.append(1 if bits[0] else 0)
+            elif bits[0]:
+                self._buf[-1] |= 1 << (pos & 7)
+            self._len += 1
+            return
+
+        bits = self._coerce(bits)
+        if bits._len == 0:
+            return
+        shift = (self._off + self._len) & 7
+        if shift == 0:
+            self._buf.extend(bits._get_bytes())
+        else:
+            # Shift the appended bits up so they start right after the last bit in the array.
+            num_bytes = (shift + bits._len + 7) >> 3
+            new_bytes = _uint_to_bytes(bits._get_uint(0, bits._len) << shift, num_bytes)
+            self._buf[-1] |= new_bytes[0]
+            self._buf.extend(new_bytes[1:])
+        self._len += bits._len
 
     def prepend(self, bits):
-        """Prepend the contents of a bitstring to this one, but in reverse order."""
+        """Prepend the contents of a bitstring so its bits are transmitted before this one's."""
 
-        return super(XsBitArray, self).append(bits)
+        bits = self._coerce(bits)._copy()
+        bits.append(self)
+        (self._buf, self._off, self._len) = (bits._buf, bits._off, bits._len)
 
     def __add__(self, bits):
-        """Concatenate the contents of two bitstrings, but in the opposite order."""
+        """Concatenate two bitstrings so the bits of the second are transmitted after the first."""
 
         b = self._copy()
         b.append(bits)
         return b
 
     def __radd__(self, bits):
-        """Concatenate the contents of two bitstrings, but in the opposite order."""
+        """Concatenate two bitstrings so the bits of the second are transmitted after the first."""
 
-        b = self._copy()
-        b.prepend(bits)
+        b = XsBitArray(bits)
+        b.append(self)
         return b
 
     def __iadd__(self, bits):
-        """Append the contents of a bitstring to this one, but in reverse order."""
+        """Append the contents of a bitstring to this one."""
 
-        self = self + bits
+        self.append(bits)
         return self
 
     def head(self, length=1):
         """Return the first set of transmitted or received bits from a bitstring."""
 
-        return self[self.len - length:]
+        return self._sub(0, min(length, self._len))
 
     def tail(self, length=1):
         """Return the last set of transmitted or received bits from a bitstring."""
 
-        return self[:length]
+        return self._sub(self._len - min(length, self._len), self._len)
 
     def pop_field(self, length):
         """Remove the first set of transmitted or received bits from a bitstring and return it."""
 
+        if length > self._len:
+            raise XsMinorError('Cannot pop %d bits from a %d-bit array.' % (length, self._len))
         field = self.head(length)  # Get the bits in the field.
-        del self[self.len - length:]  # Remove the field from the bit string.
+        # Remove the field from the bit string by skipping over it.
+        self._off += length
+        self._len -= length
+        # Drop the skipped bytes once they take up at least half the byte array.
+        num_skipped_bytes = self._off >> 3
+        if num_skipped_bytes and 2 * num_skipped_bytes >= len(self._buf):
+            del self._buf[:num_skipped_bytes]
+            self._off &= 7
         return field
 
+    def _index_to_pos(self, index):
+        """Convert a bit array index into a position in the transmission-ordered byte array."""
+
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError('XsBitArray index out of range.')
+        return self._len - 1 - index
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            (start, stop, step) = key.indices(self._len)
+            if step == 1:
+                # Index i is bit len-1-i in transmission order.
+                return self._sub(self._len - max(start, stop), self._len - start)
+            return XsBitArray(bin=self.bin[key])
+        pos = self._index_to_pos(key) + self._off
+        return self._buf[pos >> 3] >> (pos & 7) & 1 == 1
+
+    def __setitem__(self, key, value):
+        if isinstance(key, slice):
+            bits = list(self)
+            bits[key] = list(self._coerce(value))
+            self._set_auto(bits)
+            return
+        pos = self._index_to_pos(key) + self._off
+        if value:
+            self._buf[pos >> 3] |= 1 << (pos & 7)
+        else:
+            self._buf[pos >> 3] &= ~(1 << (pos & 7)) & 0xff
+
+    def __delitem__(self, key):
+        bits = list(self)
+        del bits[key]
+        self._set_auto(bits)
+
+    def __iter__(self):
+        for c in self.bin:
+            yield c == '1'
+
+    def overwrite(self, bits, pos=0):
+        """Overwrite the bits starting at index pos with the contents of a bitstring."""
+
+        bits = self._coerce(bits)
+        if pos < 0:
+            pos += self._len
+        if not 0 <= pos <= self._len - bits._len:
+            raise XsMinorError('Cannot overwrite %d bits at position %d of a %d-bit array.' % (bits._len, pos, self._len))
+        if bits._len == 0:
+            return
+        # Indices [pos, pos+bits.len) are transmission-ordered bits [len-pos-bits.len, len-pos).
+        start = self._off + self._len - pos - bits._len
+        stop = start + bits._len
+        (first, last) = (start >> 3, (stop + 7) >> 3)
+        shift = start & 7
+        mask = ((1 << bits._len) - 1) << shift
+        value = _bytes_to_uint(self._buf[first:last]) & ~mask | bits._get_uint(0, bits._len) << shift
+        self._buf[first:last] = _uint_to_bytes(value, last - first)
+
+    def reverse(self):
+        """Reverse the order of the bits in place."""
+
+        # Clear any bits that were popped off the front of the first byte because
+        # they'll end up past the last bit after the reversal.
+        buf = self._buf[self._off >> 3:]
+        skipped = self._off & 7
+        if skipped:
+            buf[0] &= 0xff << skipped & 0xff
+        # Reverse the order of the bytes and the bits within each byte. Then skip over
+        # the unused bits that were at the end of the last byte and are now at the start.
+        self._buf = buf[::-1].translate(_BIT_REVERSE_TABLE)
+        self._off = 8 * len(buf) - skipped - self._len
+
     def to_usb(self):
         """Convert a bitstring into a byte array with the bits in each byte
            ordered correctly for transmission over USB to an XESS board.
         """
 
-        # The bit strings are stored with the first transmitted bit at the highest index like so:
-        #       XsBitArray order: | b15 b14 b13 b12 b11 b10 b9 b8 | b7 b6 b5 b4 b3 b2 b1 b0 |
-        # But the XESS board expects to get a USB packet with bytes where the least-significant bit
+        # The XESS board expects to get a USB packet with bytes where the least-significant bit
         # of the first byte is the first bit to transmit:
         #       USB buffer bit order: | b7 b6 b5 b4 b3 b2 b1 b0 | b15 b14 b13 b12 b11 b10 b9 b8 |
-        # So this function pads the bit string so it consists of complete bytes, converts
-        # the bitstring into bytes, and finally reverses the order of the bytes.
-        bits = self + XsBitArray((8 - self.len % 8) % 8)  # Pad the bitstring to make complete bytes.
-        return bits.tobytes()[::-1]  # Convert bit string to bytes and reverse their order.
+        # That's the same order used to store the bits in the bit array, so just copy them.
+        return self._get_bytes()
+
+    def to_usb_into(self, buf, offset=0):
+        """Store the bitstring into a byte array starting at the given offset with
+           the bits ordered for USB transmission. Return the number of bytes stored.
+        """
+
+        num_bytes = (self._len + 7) >> 3
+        if self._off & 7 == 0:
+            # The bits start on a byte boundary and any bits after the last one are zero,
+            # so the bytes can be copied directly.
+            first = self._off >> 3
+            buf[offset:offset + num_bytes] = memoryview(self._buf)[first:first + num_bytes]
+        else:
+            buf[offset:offset + num_bytes] = self._get_bytes()
+        return num_bytes
 
     @staticmethod
     def from_usb(usb_bytes, length=0):
@@ -121,36 +501,97 @@ class XsBitArray(BitArray):
         # The bytes sent by XESS boards contain the first received bit in the least-significant bit
         # of the first byte as follows:
         #       USB buffer bit order: | b7 b6 b5 b4 b3 b2 b1 b0 | b15 b14 b13 b12 b11 b10 b9 b8 |
-        # This has to be converted into a bit string with the first received bit at the highest index like so:
-        #       XsBitArray order: | b15 b14 b13 b12 b11 b10 b9 b8 | b7 b6 b5 b4 b3 b2 b1 b0 |
-        # So this function reverses the byte order, creates a bit string, and then cuts it to length.
-        bits = XsBitArray(bytes=usb_bytes[::-1])  # Create a bit string from the reversed USB bytes.
-        return bits[-length:]
-        
+        # That's the same order used to store the bits in the bit array, so just copy the bytes.
+        if length == 0:
+            length = 8 * len(usb_bytes)
+        num_bytes = (length + 7) // 8
+        if num_bytes > len(usb_bytes):
+            raise XsMinorError('Not enough USB bytes to hold %d bits.' % length)
+        bits = XsBitArray()
+        bits._buf = bytearray(buffer(usb_bytes, 0, num_bytes))
+        bits._len = length
+        unused = 8 * num_bytes - length
+        if unused:
+            bits._buf[-1] &= 0xff >> unused  # Clear the unused bits in the last byte.
+        return bits
+
+    def to_msb_bytes(self):
+        """Convert a bitstring into a byte array where the first bit to transmit is
+           in the most-significant bit of the first byte (e.g., a Xilinx bitstream).
+        """
+
+        return self._get_bytes().translate(_BIT_REVERSE_TABLE)
+
+    @staticmethod
+    def from_msb_bytes(msb_bytes, length=0):
+        """Create a bitstring from a byte array where the first bit to transmit is
+           in the most-significant bit of the first byte (e.g., a Xilinx bitstream).
+        """
+
+        if length == 0:
+            length = 8 * len(msb_bytes)
+        num_bytes = (length + 7) // 8
+        return XsBitArray.from_usb(bytearray(buffer(msb_bytes, 0, num_bytes)).translate(_BIT_REVERSE_TABLE), length)
+
     def to_intel_hex(self):
         """Create an IntelHex object from a bitstring."""
-        
+
         ih = IntelHex()
-        ih.frombytes([ord(b) for b in self.tobytes()])
+        ih.frombytes(list(bytearray(self.tobytes())))
         return ih
-        
 
-    def __getattr__(self, name):
-        """Return the unsigned, integer or string representation of a bit array."""
+    def __eq__(self, bits):
+        if bits is None:
+            return False
+        try:
+            bits = self._coerce(bits)
+        except (XsError, TypeError, ValueError):
+            return False
+        return self._len == bits._len and self._get_bytes() == bits._get_bytes()
+
+    def __ne__(self, bits):
+        return not self.__eq__(bits)
+
+    __hash__ = None
 
-        if name == 'integer':
-            name = 'int'
-        elif name == 'unsigned':
-            name = 'uint'
-        elif name == 'string':
-            name = 'bin'
-        return getattr(super(XsBitArray, self), name)
+    def __nonzero__(self):
+        """Return True if any bit is set."""
+
+        return any(self._get_bytes())
+
+    def __str__(self):
+        """Return a hex or binary string for the bit array (truncated if it's very long)."""
+
+        if self._len > 4 * _MAX_CHARS:
+            return '0x' + self[:4 * _MAX_CHARS].hex + '...'
+        if self._len % 4 == 0 and self._len != 0:
+            return '0x' + self.hex
+        return '0b' + self.bin
+
+    def __repr__(self):
+        return "XsBitArray('%s')" % str(self)
 
 
 if __name__ == '__main__':
+    import time
     logging.root.setLevel(logging.DEBUG)
     a = XsBitArray('0b00010')
     b = XsBitArray('0b1111001')
     c = a + b
     print a, b, c
     print repr(c.to_usb())
+
+    # Measure the time it takes to convert bit arrays to/from the USB byte order.
+    MBITS = 8
+    bits = XsBitArray.from_usb(bytearray(range(256)) * (MBITS * 2**20 // 2048))
+    for (name, convert) in (
+            ('to_usb', lambda: bits.to_usb()),
+            ('from_usb', lambda: XsBitArray.from_usb(usb_bytes, bits.len)),
+            ('to_msb_bytes', lambda: bits.to_msb_bytes()),
+            ('reverse', lambda: bits.reverse()),
+            ):
+        usb_bytes = bits.to_usb()
+        t = time.time()
+        convert()
+        t = time.time() - t
+        print '%-12s %8.3f ms/Mbit' % (name, t / MBITS * 1000)
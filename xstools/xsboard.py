@@ -32,6 +32,7 @@ from xsdutio import *
 from flashdev import *
 from ramdev import *
 from picmicro import *
+from xssession import get_session
 
 class XsBoard:
 
@@ -67,13 +68,19 @@ class XulaMicro(XsBoard):
     """Class for XuLA-type boards that only includes methods of the microcontroller interface."""
 
     def __init__(self, xsusb_id=0):
-        # Create a USB interface for the board object.
-        self.xsusb = XsUsb(xsusb_id)
-        # Now attach a JTAG interface to the USB interface.
-        self.xsjtag = XsJtag(self.xsusb)
+        # Use the USB and JTAG interfaces shared by everything else talking to this board.
+        session = get_session(xsusb_id)
+        self.xsusb = session.xsusb
+        self.xsjtag = session.xsjtag
         # Instantiate microcontroller. (Override this in subclass if a different uC is used.)
         self.micro = Pic18f14k50(xsusb=self.xsusb)
 
+    def calibrate(self):
+        """Measure the USB link to the board and store the results for use by later sessions."""
+
+        # The shared XsJtag object sees the TAP reset done by the calibration and forgets its TAP state.
+        return self.xsusb.calibrate()
+
     def reset(self):
         """Reset the XESS board."""
 
@@ -197,9 +204,10 @@ class XulaBase(XulaMicro):
 
         PUBSUB.sendMessage("Progress.Phase", phase="Downloading bitstream")
         # Clear any configuration already in the FPGA.
-        self.xsusb.set_prog(1)
-        self.xsusb.set_prog(0)
-        self.xsusb.set_prog(1)
+        with self.xsusb.batch():
+            self.xsusb.set_prog(1)
+            self.xsusb.set_prog(0)
+            self.xsusb.set_prog(1)
         time.sleep(0.03)  # Wait for FPGA to clear.
         # Configure the FPGA with the bitstream.
         self.fpga.configure(bitstream)
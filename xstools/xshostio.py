@@ -26,6 +26,10 @@ Base object for performing USB I/O between XESS board and host PC.
 
 import logging
 from xsjtag import *
+from xssession import get_session
+from xslog import get_logger, BitsTrace
+
+_log = get_logger(__name__)
 
 DEFAULT_XSUSB_ID = 0
 DEFAULT_MODULE_ID = 255
@@ -52,54 +56,79 @@ class XsHostIo:
         else:
             self.module_id = XsBitArray(module_id)
         if xsjtag == None:
-            self._xsusb = XsUsb(xsusb_id)
-            self.xsjtag = XsJtag(self._xsusb)
+            # Share the USB/JTAG links with everything else using this board.
+            session = get_session(xsusb_id)
+            self._xsusb = session.xsusb
+            self.xsjtag = session.xsjtag
         else:
             self.xsjtag = xsjtag
         self.user_instr = self.USER1_INSTR
         self.initialize()
 
-    def initialize(self):
-        """Initialize the USB I/O link."""
+    def initialize(self, force=False):
+        """Initialize the USB I/O link.
+        
+        This is skipped if the JTAG port is already set up for the USER instruction
+        (e.g., by another object sharing it) unless force is True.
+        """
 
         assert self.xsjtag != None
-        self.xsjtag.reset_tap()  # Reset TAP FSM to test-logic-reset state.
+        if not force and self.xsjtag.get_tap_state() == 'Shift-DR' and self.xsjtag.get_instruction() == self.user_instr:
+            return
 
-        # Send TAP FSM to the shift-ir state.
-        self.xsjtag.go_thru_tap_states('Run-Test/Idle', 'Select-DR-Scan', 'Select-IR-Scan', 'Capture-IR', 'Shift-IR')
+        # None of this needs a response from the board, so send it all in one USB transfer.
+        with self.xsjtag.batch():
+            if force:
+                self.xsjtag.reset_tap(force=True)  # Reset TAP FSM to test-logic-reset state.
 
-        # Now enter the USER1 JTAG instruction into the IR and go to the exit1-ir state.
-        self.xsjtag.shift_tdi(tdi=self.user_instr, do_exit_shift=True)
+            # Send TAP FSM to the shift-ir state. (This resets the TAP first if its state isn't known.)
+            self.xsjtag.goto_state('Shift-IR')
 
-        # USER instruction is now active, so transfer to the shift-dr state where data transfers will occur.
-        self.xsjtag.go_thru_tap_states('Update-IR', 'Select-DR-Scan', 'Capture-DR', 'Shift-DR')
-        self.xsjtag.flush()
+            # Now enter the USER1 JTAG instruction into the IR and go to the exit1-ir state.
+            self.xsjtag.shift_tdi(tdi=self.user_instr, do_exit_shift=True)
+
+            # USER instruction is now active, so transfer to the shift-dr state (through update-ir) where data transfers will occur.
+            self.xsjtag.goto_state('Shift-DR')
+            self.xsjtag.flush()
+            self.xsjtag.set_instruction(self.user_instr)
 
     def reset(self):
         """Reset the USB I/O link."""
 
-        self.initialize()
-
-    def send_rcv(self, payload, num_result_bits):
-        """Send a bit array payload and then return a results bit array with num_result_bits."""
+        self.initialize(force=True)
 
-        logging.debug('Send ' + str(payload.len) + ' bits. Receive ' + str(num_result_bits) + ' bits.')
+    def _send(self, payload, num_result_bits):
+        """Send a bit array payload to the module and tell it num_result_bits will be read back."""
 
-        # Create the TDI bit array by concatenating the module ID, number of bits in the payload, and the payload bits.
-        tdi_bits = self.module_id + XsBitArray(uint=payload.len + num_result_bits, length=32) + payload
+        if _log.isEnabledFor(logging.DEBUG):
+            _log.debug('Module ID = %s. Send %d bits: %s. Receive %d bits.',
+                       self.module_id, payload.len, BitsTrace(payload), num_result_bits)
 
-        logging.debug('Module ID = ' + repr(self.module_id))
-        logging.debug('payload = ' + repr(payload))
-        logging.debug('# TDI bits = ' + str(tdi_bits.len))
-        logging.debug('TDI = ' + repr(tdi_bits))
+        # Send the TDI bits: the module ID, number of bits in the payload, and the payload bits.
+        # They're appended directly to the JTAG TDI buffer without concatenating them first.
+        self.xsjtag.shift_tdi(tdi=self.module_id)
+        self.xsjtag.shift_tdi(tdi=XsBitArray(uint=payload.len + num_result_bits, length=32))
+        self.xsjtag.shift_tdi(tdi=payload)
 
-        # Send the TDI bits.
-        self.xsjtag.shift_tdi(tdi=tdi_bits)
         self.xsjtag.flush()
+
+    def send_rcv(self, payload, num_result_bits):
+        """Send a bit array payload and then return a results bit array with num_result_bits."""
+
+        self._send(payload, num_result_bits)
         # Get the result bits from TDO.
         tdo_bits = self.xsjtag.shift_tdo(num_result_bits)
         return tdo_bits
 
+    def send_rcv_into(self, payload, buf, num_result_bits, offset=0):
+        """Send a bit array payload and then read num_result_bits into a bytearray starting at the offset.
+        
+        The result bits are stored in USB order (see XsJtag.shift_tdo_into()). Returns the number of bytes filled.
+        """
+
+        self._send(payload, num_result_bits)
+        return self.xsjtag.shift_tdo_into(buf, num_result_bits, offset=offset)
+
 
 if __name__ == '__main__':
 
@@ -0,0 +1,175 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# **********************************************************************
+#   This program is free software; you can redistribute it and/or
+#   modify it under the terms of the GNU General Public License
+#   as published by the Free Software Foundation; either version 2
+#   of the License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+#   02111-1307, USA.
+#
+#   (c)2012 - X Engineering Software Systems Corp. (www.xess.com)
+# **********************************************************************
+
+"""
+Watcher for XESS boards being plugged into and pulled out of USB ports.
+
+Under linux with pyudev installed, the watcher sleeps until udev reports a
+USB event. Otherwise it polls the USB ports with an interval that backs off
+while nothing changes.
+"""
+
+import time
+import logging
+from xslog import *
+
+try:
+    import pyudev
+except ImportError:
+    pyudev = None
+
+_log = get_logger(__name__)
+
+
+def _enumerate_xsusb():
+    """Return the (bus, address) of each XESS board attached to a USB port."""
+
+    from xsusb import XsUsb  # Imported here because xsusb uses this module.
+    # Always rescan. This also refreshes the cached list of ports kept by XsUsb.
+    return [(d.bus, d.address) for d in XsUsb.get_xsusb_ports(max_age=0)]
+
+
+class XsHotplug:
+
+    """Report XESS boards connecting to and disconnecting from USB ports."""
+
+    _MIN_POLL_INTERVAL = 0.01  # Seconds between USB scans right after a change.
+    _MAX_POLL_INTERVAL = 0.5  # Longest time between USB scans when nothing is changing.
+
+    def __init__(self, enumerator=None, use_udev=True):
+        """Start watching the USB ports.
+
+        enumerator = function returning identifiers for the attached boards (default is their (bus, address)).
+        use_udev = False to always poll, even if udev is available.
+        """
+
+        if enumerator is None:
+            from xsusb import XsUsb  # Imported here because xsusb uses this module.
+            enumerator = _enumerate_xsusb
+            # There's nothing for udev to see if the boards aren't real.
+            use_udev = use_udev and XsUsb.get_backend().udev_events
+        self._enumerator = enumerator
+        self._interval = self._MIN_POLL_INTERVAL
+        self._monitor = None
+        if use_udev and pyudev is not None:
+            try:
+                self._monitor = pyudev.Monitor.from_netlink(pyudev.Context())
+                self._monitor.filter_by(subsystem='usb')
+                self._monitor.start()
+            except Exception as e:
+                _log.debug('udev monitor unavailable, polling instead: %s', e)
+                self._monitor = None
+        # Start monitoring before scanning so no event falls between the two.
+        self._devices = set(self._enumerator())
+
+    def get_devices(self):
+        """Return the identifiers of the boards that were attached at the last scan."""
+
+        return sorted(self._devices)
+
+    def get_events(self):
+        """Scan the USB ports and return a list of ('connect', id) and ('disconnect', id) events since the last scan."""
+
+        devices = set(self._enumerator())
+        events = [('disconnect', d) for d in sorted(self._devices - devices)]
+        events += [('connect', d) for d in sorted(devices - self._devices)]
+        self._devices = devices
+        if events:
+            self._interval = self._MIN_POLL_INTERVAL  # Things are changing, so look again soon.
+        return events
+
+    def wait_for_events(self, timeout=None):
+        """Return the next list of connect/disconnect events, or an empty list if the timeout (seconds) expires."""
+
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            events = self.get_events()
+            if events:
+                return events
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                return []
+            self._wait(remaining)
+
+    def wait_for_connect(self, known=None, timeout=None):
+        """Wait for a board that isn't in known and return the identifiers of the new boards.
+
+        known = boards to ignore (default is the boards attached at the last scan).
+        Returns an empty list if the timeout (seconds) expires.
+        """
+
+        known = set(self._devices if known is None else known)
+        if self._wait_until(lambda: self._devices - known, timeout):
+            return sorted(self._devices - known)
+        return []
+
+    def wait_for_disconnect(self, device=None, timeout=None):
+        """Wait for a board to disconnect (or all boards if device is None).
+
+        Returns False if the timeout (seconds) expires.
+        """
+
+        if device is None:
+            return self._wait_until(lambda: not self._devices, timeout)
+        return self._wait_until(lambda: device not in self._devices, timeout)
+
+    def close(self):
+        """Stop watching the USB ports and release the udev monitor."""
+
+        monitor, self._monitor = self._monitor, None
+        if monitor is not None:
+            # pyudev monitors don't have a close() method. The udev monitor and its netlink socket
+            # are freed by udev_monitor_unref() when the last reference to the Monitor goes away,
+            # and this object holds the only one, so they're released right here.
+            del monitor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _wait_until(self, condition, timeout):
+        """Scan the USB ports each time they might have changed until the condition holds or the timeout expires."""
+
+        deadline = None if timeout is None else time.time() + timeout
+        self.get_events()
+        while not condition():
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                return False
+            self._wait(remaining)
+            self.get_events()
+        return True
+
+    def _wait(self, timeout):
+        """Sleep until the USB ports might have changed or the timeout (seconds, None=forever) expires."""
+
+        if self._monitor is not None:
+            if self._monitor.poll(timeout=timeout) is not None:
+                # A single plug/unplug makes a burst of udev events, so gather them all before scanning.
+                while self._monitor.poll(timeout=self._MIN_POLL_INTERVAL) is not None:
+                    pass
+            return
+        interval = self._interval if timeout is None else min(self._interval, timeout)
+        time.sleep(interval)
+        self._interval = min(2 * self._interval, self._MAX_POLL_INTERVAL)
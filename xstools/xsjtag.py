@@ -24,129 +24,515 @@
 USB <=> JTAG port interface for an XESS FPGA board.
 """
 
+import re
 import logging
+import struct
+from contextlib import contextmanager
 from xserror import *
 from xsbitarray import *
-from xsusb import XsUsb
+from xsusb import XsUsb, stats_delta
+from xslog import *
+
+_log = get_logger(__name__)
+
+
+def _find_tms_paths(next_tap_state, reset_state, update_ir_state, invalid_state, reset_tms_len):
+    """Return a table of the shortest TMS sequences from each TAP state to every other.
+
+    Each entry is (TMS bit array, True if the path passes through a state that changes the IR).
+    The states are numbered from zero up to the invalid state, and the
+    sequences from the invalid state start by resetting the TAP.
+    """
+
+    num_states = invalid_state
+    paths = [[None] * num_states for s in range(num_states + 1)]
+    for start in range(num_states):
+        # Breadth-first search from the starting state, tracking the TMS bits and IR-changing states along the way.
+        found = {start: (0, 0, False)}  # State: (number of TMS bits, TMS bits as an integer, IR changed).
+        frontier = [start]
+        while frontier:
+            next_frontier = []
+            for state in frontier:
+                length, tms, clobbers_ir = found[state]
+                for bit in (0, 1):
+                    next_state = next_tap_state[state][bit]
+                    if next_state not in found:
+                        found[next_state] = (length + 1, tms | bit << length,
+                                             clobbers_ir or next_state in (reset_state, update_ir_state))
+                        next_frontier.append(next_state)
+            frontier = next_frontier
+        for target, (length, tms, clobbers_ir) in found.items():
+            paths[start][target] = (XsBitArray(uint=tms, length=length), clobbers_ir)
+    for target in range(num_states):
+        # Reset the TAP and then go from the test-logic-reset state.
+        tms, clobbers_ir = paths[reset_state][target]
+        paths[invalid_state][target] = (XsBitArray(uint=(1 << reset_tms_len) - 1, length=reset_tms_len) + tms, True)
+    return paths
+
+
+class XsJtagFuture:
+
+    """TDO bits captured by a deferred scan. They arrive when the XsJtag queue is executed."""
+
+    def __init__(self, xsjtag, num_bits, buf=None, offset=0):
+        self._xsjtag = xsjtag
+        self.num_bits = num_bits
+        self._buf = buf  # Buffer that receives the bytes for shift_tdo_into(), or None to return a bit array.
+        self._offset = offset
+        self._done = False
+        self._result = None
+
+    def _set(self, usb_bytes):
+        """Store the bytes received for the scan."""
+
+        if self._buf is None:
+            self._result = XsBitArray.from_usb(usb_bytes=usb_bytes, length=self.num_bits)
+        else:
+            num_bytes = len(usb_bytes)
+            self._buf[self._offset:self._offset + num_bytes] = usb_bytes
+            if self.num_bits & 7:
+                self._buf[self._offset + num_bytes - 1] &= 0xff >> (8 - (self.num_bits & 7))
+            self._result = num_bytes
+        self._done = True
+
+    def done(self):
+        """Return True if the TDO bits have been received."""
+
+        return self._done
+
+    def result(self):
+        """Return the TDO bits (or the number of bytes stored for shift_tdo_into()), executing the queue if needed."""
+
+        if not self._done:
+            self._xsjtag.execute()
+        return self._result
 
 
 class XsJtag:
 
     """USB<=>JTAG port interface object for XESS FPGA board."""
 
+    # TAP states are kept as integers so they can index the tables below.
+    TEST_LOGIC_RESET = 0
+    RUN_TEST_IDLE = 1
+    SELECT_DR_SCAN = 2
+    CAPTURE_DR = 3
+    SHIFT_DR = 4
+    EXIT1_DR = 5
+    PAUSE_DR = 6
+    EXIT2_DR = 7
+    UPDATE_DR = 8
+    SELECT_IR_SCAN = 9
+    CAPTURE_IR = 10
+    SHIFT_IR = 11
+    EXIT1_IR = 12
+    PAUSE_IR = 13
+    EXIT2_IR = 14
+    UPDATE_IR = 15
+    INVALID = 16
+
+    # Names of the TAP states indexed by their integer values.
+    TAP_STATE_NAMES = (
+        'Test-Logic-Reset', 'Run-Test/Idle',
+        'Select-DR-Scan', 'Capture-DR', 'Shift-DR', 'Exit1-DR', 'Pause-DR', 'Exit2-DR', 'Update-DR',
+        'Select-IR-Scan', 'Capture-IR', 'Shift-IR', 'Exit1-IR', 'Pause-IR', 'Exit2-IR', 'Update-IR',
+        'Invalid',
+        )
+    _TAP_STATE_IDS = dict((name, id) for id, name in enumerate(TAP_STATE_NAMES))
+
     # Table that stores the next JTAG TAP state for a given TAP state and value of TMS.
-    # Current TAP state : [Next TAP state if TMS=0, Next TAP state if TMS=1]
-    _next_tap_state = {
-        'Invalid': ['Invalid', 'Invalid'],
-        'Test-Logic-Reset': ['Run-Test/Idle', 'Test-Logic-Reset'],
-        'Run-Test/Idle': ['Run-Test/Idle', 'Select-DR-Scan'],
-        'Select-DR-Scan': ['Capture-DR', 'Select-IR-Scan'],
-        'Select-IR-Scan': ['Capture-IR', 'Test-Logic-Reset'],
-        'Capture-DR': ['Shift-DR', 'Exit1-DR'],
-        'Capture-IR': ['Shift-IR', 'Exit1-IR'],
-        'Shift-DR': ['Shift-DR', 'Exit1-DR'],
-        'Shift-IR': ['Shift-IR', 'Exit1-IR'],
-        'Exit1-DR': ['Pause-DR', 'Update-DR'],
-        'Exit1-IR': ['Pause-IR', 'Update-IR'],
-        'Pause-DR': ['Pause-DR', 'Exit2-DR'],
-        'Pause-IR': ['Pause-IR', 'Exit2-IR'],
-        'Exit2-DR': ['Shift-DR', 'Update-DR'],
-        'Exit2-IR': ['Shift-IR', 'Update-IR'],
-        'Update-DR': ['Run-Test/Idle', 'Select-DR-Scan'],
-        'Update-IR': ['Run-Test/Idle', 'Select-DR-Scan'],
-        }
+    # Current TAP state : (Next TAP state if TMS=0, Next TAP state if TMS=1)
+    _NEXT_TAP_STATE = (
+        (RUN_TEST_IDLE, TEST_LOGIC_RESET),  # Test-Logic-Reset
+        (RUN_TEST_IDLE, SELECT_DR_SCAN),  # Run-Test/Idle
+        (CAPTURE_DR, SELECT_IR_SCAN),  # Select-DR-Scan
+        (SHIFT_DR, EXIT1_DR),  # Capture-DR
+        (SHIFT_DR, EXIT1_DR),  # Shift-DR
+        (PAUSE_DR, UPDATE_DR),  # Exit1-DR
+        (PAUSE_DR, EXIT2_DR),  # Pause-DR
+        (SHIFT_DR, UPDATE_DR),  # Exit2-DR
+        (RUN_TEST_IDLE, SELECT_DR_SCAN),  # Update-DR
+        (CAPTURE_IR, TEST_LOGIC_RESET),  # Select-IR-Scan
+        (SHIFT_IR, EXIT1_IR),  # Capture-IR
+        (SHIFT_IR, EXIT1_IR),  # Shift-IR
+        (PAUSE_IR, UPDATE_IR),  # Exit1-IR
+        (PAUSE_IR, EXIT2_IR),  # Pause-IR
+        (SHIFT_IR, UPDATE_IR),  # Exit2-IR
+        (RUN_TEST_IDLE, SELECT_DR_SCAN),  # Update-IR
+        (INVALID, INVALID),  # Invalid
+        )
+
+    _RESET_TMS_LEN = 5  # Setting TMS=1 for five clocks puts the TAP in the test-logic-reset state from anywhere.
+
+    # The shortest TMS sequences between any two TAP states: _TMS_PATHS[from_state][to_state].
+    _TMS_PATHS = _find_tms_paths(_NEXT_TAP_STATE, TEST_LOGIC_RESET, UPDATE_IR, INVALID, _RESET_TMS_LEN)
+
+    # Counters for the JTAG traffic (see stats()). The TCK count includes the runtest pulses.
+    _STAT_NAMES = ('num_jtag_cmds', 'num_runtests', 'num_tcks', 'num_tms_bits', 'num_tdi_bits', 'num_tdo_bits',
+                   'num_static_tdi_bits', 'num_ir_skips')
 
     def __init__(self, xsusb=None):
         """Initialize object."""
 
         self._xsusb = xsusb  # USB port to board.
-        self._tap_state = 'Invalid'  # Start TAP FSM in undefined state.
+        self._tap_state = self.INVALID  # Start TAP FSM in undefined state.
         # Clear bit arrays that store TDI and TMS bits to be sent to board.
+        # They always hold the same number of bits: one TMS and one TDI bit for each TCK pulse.
         self._tdi_bits = XsBitArray()
         self._tms_bits = XsBitArray()
+        # Reusable buffer where JTAG_CMD packets are assembled before sending them to the board.
+        self._packet = bytearray()
+        # The instruction in the IR (None if unknown) and the XsUsb PROG count when it was loaded.
+        self._instruction = None
+        self._instruction_prog_count = None
+        # The XsUsb count of TAP resets done without this object, to catch when the TAP state goes stale.
+        self._tap_reset_count = getattr(xsusb, 'tap_reset_count', None)
+        # In deferred mode, the commands waiting to be sent and the responses they'll get back:
+        # (number of bytes, XsJtagFuture or None for a RUNTEST_CMD). Both are None when not deferred.
+        self._deferred_cmds = None
+        self._deferred_responses = None
+        for name in self._STAT_NAMES:
+            setattr(self, name, 0)
+
+    def _check_tap_resets(self):
+        """Forget the TAP state and IR contents if the XsUsb object reset the TAP behind this object's back."""
+
+        tap_reset_count = getattr(self._xsusb, 'tap_reset_count', None)
+        if self._tap_reset_count != tap_reset_count:
+            self._tap_reset_count = tap_reset_count
+            self.invalidate()
+
+    def get_tap_state(self):
+        """Return the name of the current state of the TAP FSM."""
+
+        self._check_tap_resets()
+        return self.TAP_STATE_NAMES[self._tap_state]
+
+    def get_tap_state_id(self):
+        """Return the integer ID of the current state of the TAP FSM."""
+
+        self._check_tap_resets()
+        return self._tap_state
+
+    def get_instruction(self):
+        """Return the instruction in the JTAG IR, or None if it isn't known."""
+
+        self._check_tap_resets()
+        prog_count = getattr(self._xsusb, 'prog_count', None)
+        if prog_count is None:
+            # A link that doesn't count the times the FPGA is reprogrammed can't vouch for the IR.
+            return None
+        if self._instruction_prog_count != prog_count:
+            return None  # The FPGA was reprogrammed since the instruction was loaded.
+        return self._instruction
+
+    def set_instruction(self, instruction):
+        """Record the instruction that was just shifted into the JTAG IR."""
+
+        self._instruction = XsBitArray(instruction)
+        self._instruction_prog_count = getattr(self._xsusb, 'prog_count', None)
+
+    def invalidate(self):
+        """Forget the TAP state and IR contents (e.g., if something else may have used the JTAG port)."""
+
+        self._tap_state = self.INVALID
+        self._instruction = None
+
+    def queued(self, depth=None):
+        """Return a context manager that queues the USB transfers made inside it (see XsUsb.queued)."""
+
+        return self._xsusb.queued(depth)
+
+    def batch(self, max_size=None):
+        """Return a context manager that coalesces the USB writes made inside it (see XsUsb.batch)."""
+
+        return self._xsusb.batch(max_size)
+
+    @contextmanager
+    def no_return(self):
+        """Context manager where the board doesn't echo commands like runtest (see XsUsb.no_return).
+        
+        In deferred mode, the commands that turn the echoes off and on are queued in order with the rest.
+        """
+
+        was_enabled = self._xsusb.returns_enabled()
+        self.flush()
+        self._xsusb.disable_return(write=self._send)
+        try:
+            yield self
+        finally:
+            if was_enabled:
+                self.flush()
+                self._xsusb.enable_return(write=self._send)
+
+    def checkpoint(self):
+        """Send any queued commands and check that the board has carried them all out (see XsUsb.checkpoint)."""
+
+        self.execute()
+        self._xsusb.checkpoint()
+
+    def get_chunk_size(self):
+        """Return the best number of bytes per USB transfer for the link, or None if unknown."""
+
+        return self._xsusb.get_chunk_size()
+
+    def stats(self):
+        """Return a snapshot of the JTAG counters along with the USB counters of the XsUsb object."""
+
+        snapshot = self._xsusb.stats()
+        snapshot.update((name, getattr(self, name)) for name in self._STAT_NAMES)
+        return snapshot
+
+    @contextmanager
+    def measure(self):
+        """Context manager that yields a dictionary that's filled with what the block cost when it exits.
+        
+        The dictionary has the changes in the JTAG and USB counters along with the round trips,
+        the payload-to-overhead ratio and the time spent in the host versus USB (see xsusb.stats_delta()).
+        """
+
+        report = {}
+        before = self.stats()
+        try:
+            yield report
+        finally:
+            self.flush()  # Count the bits that are still waiting to go.
+            report.update(stats_delta(before, self.stats()))
+
+    def start_deferred(self):
+        """Start deferred mode where scans, TAP moves and runtests are queued until execute() is called.
+        
+        In deferred mode, shift_tdo(), shift_tdo_into() and load_ir_then_dr() return an
+        XsJtagFuture for the TDO bits instead of waiting for them to come back.
+        """
+
+        if self._deferred_cmds is not None:
+            return  # Already in deferred mode.
+        self.flush()
+        self._deferred_cmds = []
+        self._deferred_responses = []
+
+    def execute(self):
+        """Send the queued commands in as few USB writes as possible and resolve the futures with a single read."""
+
+        if self._deferred_cmds is None:
+            self.flush()  # Not deferred, so there's nothing queued except maybe some TMS/TDI bits.
+            return
+        self.flush()
+        cmds, self._deferred_cmds = self._deferred_cmds, []
+        responses, self._deferred_responses = self._deferred_responses, []
+
+        # Gather the commands into writes of the link's best chunk size, keeping each command in one write.
+        chunk_size = self._xsusb.get_chunk_size()
+        write = bytearray()
+        for cmd in cmds:
+            if write and chunk_size and len(write) + len(cmd) > chunk_size:
+                self._xsusb.write(write)
+                write = bytearray()
+            write += cmd
+        if write:
+            self._xsusb.write(write)
+
+        # Get the responses to all the commands and hand them out. Each response comes back in
+        # its own USB transfer, and the read keeps going until it has the bytes for all of them.
+        num_bytes = sum(n for n, future in responses)
+        if num_bytes == 0:
+            return
+        response = self._xsusb.read(num_bytes)
+        pos = 0
+        for n, future in responses:
+            if future is None:
+                # Check that the 1st byte of the RUNTEST_CMD response matches the command opcode.
+                if response[pos] != XsUsb.RUNTEST_CMD:
+                    raise XsMajorError("Communication error with XESS board in 'runtest'.")
+            else:
+                future._set(response[pos:pos + n])
+            pos += n
+
+    def stop_deferred(self):
+        """Execute the queued commands and then leave deferred mode."""
+
+        if self._deferred_cmds is None:
+            return  # Not in deferred mode.
+        try:
+            self.execute()
+        finally:
+            self._deferred_cmds = None
+            self._deferred_responses = None
+
+    @contextmanager
+    def deferred(self):
+        """Context manager that runs a block of code in deferred mode and executes the queue when it exits."""
+
+        already_deferred = self._deferred_cmds is not None
+        self.start_deferred()
+        try:
+            yield self
+        finally:
+            if not already_deferred:
+                self.stop_deferred()
+
+    def _send(self, cmd):
+        """Write command bytes to the board, or queue them in deferred mode."""
+
+        if self._deferred_cmds is not None:
+            self._deferred_cmds.append(bytearray(cmd))
+        else:
+            self._xsusb.write(cmd)
 
     def _buffer_is_empty(self):
         """Return True if both TDI and TMS bit buffers are empty."""
 
         return self._tdi_bits.len == 0 and self._tms_bits.len == 0
 
+    def _append_tms(self, tms):
+        """Append a bit array of TMS bits to the buffer with TDI=0 for each of them."""
+
+        self._tms_bits += tms
+        self._tdi_bits += XsBitArray(tms.len)
+
     def shift_tms(self, tms):
         """Append the TMS bit to the TMS bit buffer and update the TAP state."""
 
         assert tms == 0 or tms == 0x01
+        self._check_tap_resets()
         self._tms_bits += [tms]  # Append the bit to the buffer.
-        logging.debug('Current TAP state = %s', self._tap_state)
+        self._tdi_bits += [0]
 
         # Update the TAP state given the current state and the TMS bit value.
-        self._tap_state = self._next_tap_state[self._tap_state][tms]
-        logging.debug('New TAP state = %s', self._tap_state)
+        self._tap_state = self._NEXT_TAP_STATE[self._tap_state][tms]
+        if self._tap_state == self.TEST_LOGIC_RESET:
+            self._instruction = None  # The reset loads the IR with a device-specific instruction.
+        elif self._tap_state == self.UPDATE_IR:
+            self._instruction = None  # The IR is loaded with whatever is in its shift register.
 
     def shift_tdi(self, tdi, do_exit_shift=False):
         """Append given bits to the TDI bit buffer.
         
         do_exit_shift = True if shift-ir or shift-dr state should be exited on last TDI bit.
+        The bits are sent by the next flush() along with any TMS bits before and after them.
         """
 
-        # Flush any pending TMS bits before TDI bits are sent.
-        if self._tms_bits.len > 0:
-            self.flush()
-
         # TAP FSM must be in the shift-ir or shift-dr state if fetching TDO bits.
-        assert self._tap_state == 'Shift-DR' or self._tap_state == 'Shift-IR'
+        assert self._tap_state == self.SHIFT_DR or self._tap_state == self.SHIFT_IR
+        if self._tap_state == self.SHIFT_IR:
+            self._instruction = None  # The IR is changing.
 
         # Create a single-item bit array if just a single bit is being sent.
         if not isinstance(tdi, XsBitArray):
             tdi = XsBitArray([tdi])
 
-        # Append the TDI bits to the end of the TDI buffer.
+        # Append the TDI bits to the end of the TDI buffer with TMS=0 to stay in the shift-ir/dr state.
         self._tdi_bits += tdi
         if do_exit_shift:
-            self.shift_tms(0x01)  # TMS=1 exits the shift-ir/dr state.
-            self.flush()  # Flush everything to the JTAG port.
-            assert self._tap_state == 'Exit1-IR' or self._tap_state == 'Exit1-DR'
+            # TMS=1 on the last TDI bit exits the shift-ir/dr state.
+            self._tms_bits += XsBitArray(tdi.len - 1)
+            self._tms_bits += [0x01]
+            self._tap_state = self._NEXT_TAP_STATE[self._tap_state][0x01]
+            assert self._tap_state == self.EXIT1_IR or self._tap_state == self.EXIT1_DR
+        else:
+            self._tms_bits += XsBitArray(tdi.len)
 
-    def shift_tdo(self, num_bits, do_exit_shift=False):
-        """Return a bit array with a given number of bits from the TDO pin."""
+    def _send_tdo_cmd(self, num_bits, do_exit_shift, tdi=None):
+        """Send the pending TMS/TDI bits and a JTAG_CMD to get num_bits from the TDO pin in a single USB write.
+        
+        If do_exit_shift is True, TMS=1 on the last bit exits the shift-ir/dr state.
+        tdi = bit array sent on the TDI pin while the TDO bits are gathered (default is all zeros).
+        """
 
         # It's an error to gather TDO bits if the USB port is not setup.
         assert self._xsusb is not None
 
+        with self._xsusb.batch():
+            # Flush any pending TMS/TDI bits before gathering TDO bits.
+            self.flush()
+
+            # TAP FSM must be in the shift-ir or shift-dr state if fetching TDO bits.
+            assert self._tap_state == self.SHIFT_DR or self._tap_state == self.SHIFT_IR
+
+            flags = XsUsb.GET_TDO_MASK
+            if tdi is not None:
+                assert tdi.len == num_bits
+                flags |= XsUsb.PUT_TDI_MASK
+            if self._tap_state == self.SHIFT_IR:
+                self._instruction = None  # The IR is changing.
+            if do_exit_shift == True:
+                # Send TMS=0 for all but the last TDO bit and then TMS=1 to exit the shift-ir/dr state.
+                flags |= XsUsb.PUT_TMS_MASK
+                tms = (XsBitArray(num_bits - 1) + XsBitArray([0x01])).to_usb()
+                self._tap_state = self._NEXT_TAP_STATE[self._tap_state][0x01]
+                assert self._tap_state == self.EXIT1_IR or self._tap_state == self.EXIT1_DR
+            cmd = self._make_jtag_cmd_hdr(num_bits=num_bits, flags=flags)
+            self.num_jtag_cmds += 1
+            self.num_tcks += num_bits
+            self.num_tdo_bits += num_bits
+            if flags & XsUsb.PUT_TDI_MASK:
+                self.num_tdi_bits += num_bits
+            if flags & XsUsb.PUT_TMS_MASK:
+                self.num_tms_bits += num_bits
+            if tdi is not None and do_exit_shift == True:
+                # Interleave the TMS and TDI bytes with the TMS bytes at even addresses and the TDI bytes at odd addresses.
+                payload = bytearray(2 * len(tms))
+                payload[0::2] = tms
+                payload[1::2] = tdi.to_usb()
+                cmd += payload
+            elif tdi is not None:
+                cmd += tdi.to_usb()
+            elif do_exit_shift == True:
+                cmd += tms
+            self._send(cmd)
+
+    def shift_tdo(self, num_bits, do_exit_shift=False, tdi=None):
+        """Return a bit array with a given number of bits from the TDO pin (or an XsJtagFuture for it in deferred mode).
+        
+        tdi = bit array with num_bits to send on the TDI pin at the same time (default is all zeros).
+        """
+
         # Return empty array if no bits are requested.
         if num_bits == 0:
             return XsBitArray()
 
-        # Flush any pending TMS/TDI bits before gathering TDO bits.
-        self.flush()
-
-        # TAP FSM must be in the shift-ir or shift-dr state if fetching TDO bits.
-        assert self._tap_state == 'Shift-DR' or self._tap_state == 'Shift-IR'
-
-        if do_exit_shift == True:
-            # Get the first N-1 TDO bits before exiting the shift-ir/dr state.
-            tdo_bits = self.shift_tdo(num_bits=num_bits - 0x01, do_exit_shift=False)
-            # Now make TMS=1 to exit the shift-ir/dr state while getting the last TDO bit.
-            self.shift_tms(0x01)  # Do this just to update the internal TAP state.
-            self._tms_bits = XsBitArray()  # Then clear the TMS bit buffer.
-            # Now get the final TDO bit and set TMS=1 to exit the shift-ir/dr state.
-            cmd = self._make_jtag_cmd_hdr(num_bits=0x01, flags=XsUsb.GET_TDO_MASK | XsUsb.TMS_VAL_MASK)
-            self._xsusb.write(cmd)  # Send the JTAG command with TMS=1.
-            # Get the final TDO bit and put it on the end of the buffer.
-            buffer = self._xsusb.read(0x01)
-            tdo_bits += [buffer[0] & 0x01]
-            assert self._tap_state == 'Exit1-IR' or self._tap_state == 'Exit1-DR'
-        else:
-            # Get the TDO bits but do not exit the shift-ir/dr state.
-            cmd = self._make_jtag_cmd_hdr(num_bits=num_bits, flags=XsUsb.GET_TDO_MASK)
-            self._xsusb.write(cmd)  # Send the JTAG command with TMS=0.
-            # Now get a USB packet with enough bytes to hold all the requested bits.
-            num_bytes = int((num_bits + 7) / 8)
-            buffer = self._xsusb.read(num_bytes)
-            # Turn the byte array into a bit array.
-            tdo_bits = XsBitArray.from_usb(usb_bytes=buffer, length=num_bits)
-            assert self._tap_state == 'Shift-IR' or self._tap_state == 'Shift-DR'
-        logging.debug('shift_tdo TDO => %s', tdo_bits)
+        self._send_tdo_cmd(num_bits, do_exit_shift, tdi)
+        if self._deferred_cmds is not None:
+            future = XsJtagFuture(self, num_bits)
+            self._deferred_responses.append(((num_bits + 7) // 8, future))
+            return future
+        # Now get a USB packet with enough bytes to hold all the requested bits.
+        num_bytes = (num_bits + 7) // 8
+        buffer = self._xsusb.read(num_bytes)
+        # Turn the byte array into a bit array.
+        tdo_bits = XsBitArray.from_usb(usb_bytes=buffer, length=num_bits)
+        if _log.isEnabledFor(logging.DEBUG):
+            _log.debug('shift_tdo TDO => %s', BitsTrace(tdo_bits))
         return tdo_bits
 
+    def shift_tdo_into(self, buf, num_bits, do_exit_shift=False, offset=0):
+        """Read a given number of bits from the TDO pin into a bytearray starting at the offset.
+        
+        The bits are stored in the same order as XsBitArray.to_usb(): the first bit received
+        is in the least-significant bit of the first byte. Returns the number of bytes filled
+        (or an XsJtagFuture for it in deferred mode, and then buf mustn't be touched until it's done).
+        """
+
+        if num_bits == 0:
+            return 0
+
+        self._send_tdo_cmd(num_bits, do_exit_shift)
+        if self._deferred_cmds is not None:
+            future = XsJtagFuture(self, num_bits, buf, offset)
+            self._deferred_responses.append(((num_bits + 7) // 8, future))
+            return future
+        num_bytes = (num_bits + 7) // 8
+        self._xsusb.read_into(buf, num_bytes, offset)
+        if num_bits & 7:
+            buf[offset + num_bytes - 1] &= 0xff >> (8 - (num_bits & 7))  # Clear the unused bits in the last byte.
+        if _log.isEnabledFor(logging.DEBUG):
+            _log.debug('shift_tdo_into TDO => (%d bits) %s', num_bits, HexTrace(buf[offset:offset + num_bytes]))
+        return num_bytes
+
+    _JTAG_CMD_HDR_FORMAT = '<BIB'  # JTAG_CMD byte, 32-bit number of bits, flags byte.
+    _JTAG_CMD_HDR_LEN = struct.calcsize(_JTAG_CMD_HDR_FORMAT)
+
     def _make_jtag_cmd_hdr(self, num_bits=0, flags=0):
         """Create the first six bytes of a JTAG_CMD command packet.
         num_bits = number of TDI/TDO/TMS bits in the packet.
@@ -156,17 +542,33 @@ class XsJtag:
         # The command packet contains the JTAG_CMD byte and then the
         # number of bits as a 32-bit number starting with the least-significant byte
         # and then the flags byte.
-        return bytearray([
-            XsUsb.JTAG_CMD,
-            num_bits & 0xff,
-            num_bits >> 8 & 0xff,
-            num_bits >> 16 & 0xff,
-            num_bits >> 24 & 0xff,
-            flags,
-            ])
+        return bytearray(struct.pack(self._JTAG_CMD_HDR_FORMAT, XsUsb.JTAG_CMD, num_bits, flags))
+
+    def _alloc_packet(self, num_bytes):
+        """Make sure the packet buffer can hold the given number of bytes."""
+
+        if len(self._packet) < num_bytes:
+            # Grow the buffer. It's kept at its largest size so it can be reused for later packets.
+            self._packet.extend(bytearray(num_bytes - len(self._packet)))
+
+    # A run of TCK pulses with TMS=0 gets its own TDI-only JTAG_CMD if it's at least this many bytes long.
+    # Otherwise, it's cheaper to send its TMS bytes than the header of another JTAG_CMD.
+    _MIN_TDI_ONLY_BYTES = 2 * _JTAG_CMD_HDR_LEN + 1
+    _TMS_ZERO_RUN = re.compile('\x00{%d,}' % _MIN_TDI_ONLY_BYTES)
+    # Runs of TDI bytes that are all zeros or all ones and long enough to be worth sending as a static TDI level
+    # (it takes one JTAG_CMD header for the run and another to pick up the TDI bits after it).
+    _MIN_STATIC_TDI_BYTES = 2 * _JTAG_CMD_HDR_LEN + 1
+    _TDI_STATIC_RUN = re.compile('\x00{%d,}|\xff{%d,}' % (_MIN_STATIC_TDI_BYTES, _MIN_STATIC_TDI_BYTES))
 
     def flush(self):
-        """Flush the TDI/TMS buffers through the USB port."""
+        """Flush the TDI/TMS buffers through the USB port.
+        
+        The bits are sent as JTAG_CMD packets in a single USB write (or in writes of
+        the link's best chunk size, if it's known). Runs of bits with TMS=0 are sent with
+        just their TDI bits, and the rest with their TMS and TDI bits interleaved. Long runs
+        of TDI bits that are all zeros or all ones (like bitstream padding) are sent as a
+        static TDI level with just a bit count.
+        """
 
         # It's an error to flush if the USB port is not setup.
         assert self._xsusb is not None
@@ -175,134 +577,215 @@ class XsJtag:
         if self._buffer_is_empty():
             return
 
-        if self._tdi_bits.len == 0:
-            # No TDI bits to send, so just send the TMS bits.
-            # Create the JTAG_CMD header for sending only the TMS bits.
-            buffer = self._make_jtag_cmd_hdr(num_bits=self._tms_bits.len, flags=XsUsb.PUT_TMS_MASK)
-            # Append the TMS bits (in byte array format) to the JTAG_CMD header.
-            buffer.extend(self._tms_bits.to_usb())
-        else:
-            if self._tms_bits.len == 0:
-                # No TMS bits to send, so just send the TDI bits.
-                # Create the JTAG_CMD header for sending only the TDI bits.
-                buffer = self._make_jtag_cmd_hdr(num_bits=self._tdi_bits.len, flags=XsUsb.PUT_TDI_MASK)
-                # Append the TDI bits (in byte array format) to the JTAG_CMD header.
-                buffer.extend(self._tdi_bits.to_usb())
-            else:
-                # Both TMS and TDI bits need to be sent.
-                if self._tms_bits.len == self._tdi_bits.len:
-                    # TDI and TMS bit buffers are equal in #bits.
-                    # Create the JTAG_CMD header for sending both the TDI and TMS bits.
-                    buffer = self._make_jtag_cmd_hdr(num_bits=self._tdi_bits.len, flags=XsUsb.PUT_TMS_MASK | XsUsb.PUT_TDI_MASK)
-                    # Create byte arrays to hold the TDI and TMS bits for USB transfer.
-                    tms_buffer = self._tms_bits.to_usb()
-                    tdi_buffer = self._tdi_bits.to_usb()
-                    # Create another byte array to hold the interleaved TDI and TMS buffers.
-                    tms_tdi_buffer = bytearray(len(tms_buffer) + len(tdi_buffer))
-                    # Interleave TMS and TDI bytes with the TMS bytes at even addresses...
-                    tms_tdi_buffer[0::2] = tms_buffer
-                    # ... and the TDI bytes at odd addresses.
-                    tms_tdi_buffer[0x01::2] = tdi_buffer
-                    # Append the TDI and TMS byte arrays to the JTAG_CMD header.
-                    buffer.extend(tms_tdi_buffer)
-                elif self._tms_bits.len == 0x01:
-                    # There's multiple TDI bits but only one TMS bit.
-                    # Remove the last TMS and TDI bits from the buffers.
-                    last_tms_bit = self._tms_bits.tail(0x01)
-                    self._tms_bits = self._tms_bits.head(self._tms_bits.len - 0x01)
-                    last_tdi_bit = self._tdi_bits.tail(0x01)
-                    self._tdi_bits = self._tdi_bits.head(self._tdi_bits.len - 0x01)
-                    assert self._tms_bits.len == 0
-                    assert self._tdi_bits.len != 0
-                    # Now only TDI bits remain, so flush those.
-                    self.flush()
-                    # Now put the last TDI and TMS bits into the buffers and flush those.
-                    self._tms_bits += [last_tms_bit]
-                    self._tdi_bits += [last_tdi_bit]
-                    self.flush()
-                    return
-                else:
-                    # It's an error if we ever get here! That would mean there are
-                    # both multiple TMS and TDI bits, but not the same number of each.
-                    assert False
-
-        # Send the JTAG_CMD packet with the attached TMS and/or TDI bits.
-        self._xsusb.write(buffer)
-
+        num_bits = self._tms_bits.len
+        assert self._tdi_bits.len == num_bits
+        tms = self._tms_bits.to_usb()
+        tdi = self._tdi_bits.to_usb()
         # Clear the TMS and TDI buffers.
         self._tms_bits = XsBitArray()
         self._tdi_bits = XsBitArray()
 
-    def go_thru_tap_states(self, *states):
-        """Go through a sequence of TAP states."""
+        # Split the bytes of TCK pulses into JTAG_CMDs: (first byte, last byte + 1, flags).
+        chunk_size = self._xsusb.get_chunk_size()
+        cmds = []
+
+        def add_cmds(start, stop):
+            # Send a short stretch of TCK pulses with just the TMS or TDI bits if the other ones are all zero.
+            if not any(tms[start:stop]):
+                cmds.append((start, stop, XsUsb.PUT_TDI_MASK))
+            elif not any(tdi[start:stop]):
+                cmds.append((start, stop, XsUsb.PUT_TMS_MASK))
+            else:
+                cmds.append((start, stop, XsUsb.PUT_TMS_MASK | XsUsb.PUT_TDI_MASK))
+
+        def add_tdi_cmds(start, stop):
+            # Send the TDI bits of TCK pulses with TMS=0 in chunks the link likes.
+            if stop <= start:
+                return
+            step = chunk_size or (stop - start)
+            for chunk_start in range(start, stop, step):
+                cmds.append((chunk_start, min(chunk_start + step, stop), XsUsb.PUT_TDI_MASK))
+
+        pos = 0
+        for run in self._TMS_ZERO_RUN.finditer(str(tms)):
+            if run.start() > pos:
+                add_cmds(pos, run.start())
+            # Long run of TCK pulses with TMS=0, so just send the TDI bits except for
+            # long stretches of all zeros or all ones that are sent as a static TDI level.
+            pos = run.start()
+            for static in self._TDI_STATIC_RUN.finditer(tdi, run.start(), run.end()):
+                add_tdi_cmds(pos, static.start())
+                cmds.append((static.start(), static.end(), XsUsb.TDI_VAL_MASK if tdi[static.start()] else 0))
+                pos = static.end()
+            add_tdi_cmds(pos, run.end())
+            pos = run.end()
+        if pos < len(tms):
+            add_cmds(pos, len(tms))
+
+        # Assemble the JTAG_CMD packets in the packet buffer.
+        hdr_len = self._JTAG_CMD_HDR_LEN
+        both = XsUsb.PUT_TMS_MASK | XsUsb.PUT_TDI_MASK
+        packet_len = sum(hdr_len + (stop - start) * (2 if flags == both else 1 if flags & both else 0)
+                         for start, stop, flags in cmds)
+        self._alloc_packet(packet_len)
+        packet = self._packet
+        writes = []  # End of each USB write in the packet buffer.
+        write_start = 0
+        i = 0
+        for start, stop, flags in cmds:
+            num_cmd_bits = min(8 * stop, num_bits) - 8 * start
+            struct.pack_into(self._JTAG_CMD_HDR_FORMAT, packet, i, XsUsb.JTAG_CMD, num_cmd_bits, flags)
+            self.num_jtag_cmds += 1
+            self.num_tcks += num_cmd_bits
+            if flags & XsUsb.PUT_TMS_MASK:
+                self.num_tms_bits += num_cmd_bits
+            if flags & XsUsb.PUT_TDI_MASK:
+                self.num_tdi_bits += num_cmd_bits
+            elif not flags & XsUsb.PUT_TMS_MASK:
+                self.num_static_tdi_bits += num_cmd_bits
+            i += hdr_len
+            if flags == both:
+                # Interleave TMS and TDI bytes with the TMS bytes at even addresses and the TDI bytes at odd addresses.
+                n = 2 * (stop - start)
+                packet[i:i + n:2] = tms[start:stop]
+                packet[i + 1:i + n:2] = tdi[start:stop]
+            elif flags & both:
+                n = stop - start
+                packet[i:i + n] = (tdi if flags == XsUsb.PUT_TDI_MASK else tms)[start:stop]
+            else:
+                n = 0  # Static TMS and TDI levels, so there's no payload.
+            i += n
+            if chunk_size and i - write_start >= chunk_size:
+                writes.append(i)
+                write_start = i
+        if write_start < i:
+            writes.append(i)
+
+        # Send the JTAG_CMD packets with the attached TMS and/or TDI bits.
+        start = 0
+        for stop in writes:
+            self._send(memoryview(packet)[start:stop])
+            start = stop
 
-        for next_state in states:
-            assert next_state in self._next_tap_state, 'Illegal TAP state label: %s.' % next_state
+    def go_thru_tap_states(self, *states):
+        """Go through a sequence of TAP states, each reachable from the one before it."""
+
+        # Gather the TMS bits for the whole sequence and append them to the buffer all at once.
+        self._check_tap_resets()
+        tms = 0
+        state = self._tap_state
+        for i, next_state in enumerate(states):
+            assert next_state in self._TAP_STATE_IDS, 'Illegal TAP state label: %s.' % next_state
+            next_state = self._TAP_STATE_IDS[next_state]
             # Make sure the next TAP state is reachable from current state.
-            assert next_state == self._next_tap_state[self._tap_state][0] or next_state == self._next_tap_state[self._tap_state][0x01]
-            # Append the TMS bit that will move the TAP FSM to the desired state.
-            self.shift_tms(next_state == self._next_tap_state[self._tap_state][0x01])
+            next_states = self._NEXT_TAP_STATE[state]
+            assert next_state in next_states
+            if next_state == next_states[0x01]:
+                tms |= 1 << i
+            if next_state == self.TEST_LOGIC_RESET:
+                self._instruction = None  # The reset loads the IR with a device-specific instruction.
+            elif next_state == self.UPDATE_IR:
+                self._instruction = None  # The IR is loaded with whatever is in its shift register.
+            state = next_state
+        self._append_tms(XsBitArray(uint=tms, length=len(states)))
+        self._tap_state = state
+
+    def goto_state(self, target):
+        """Move the TAP FSM to a state (given by name or ID) with the shortest sequence of TMS bits.
+        
+        If the current state isn't known, the TAP is reset first.
+        """
+
+        if isinstance(target, basestring):
+            target = self._TAP_STATE_IDS[target]
+        self._check_tap_resets()
+        tms, clobbers_ir = self._TMS_PATHS[self._tap_state][target]
+        if tms.len == 0:
+            return  # Already there.
+        if _log.isEnabledFor(logging.DEBUG):
+            _log.debug('TAP state %s => %s with TMS %s', self.get_tap_state(), self.TAP_STATE_NAMES[target], BitsTrace(tms))
+        self._append_tms(tms)
+        self._tap_state = target
+        if clobbers_ir:
+            self._instruction = None  # The IR was reset or updated on the way.
 
     def load_ir_then_dr(
         self,
         instruction=None,
         data=None,
         num_return_bits=0,
+        force=False,
         ):
-        """Load JTAG IR and then DR and return bits shifted out of DR.
+        """Load JTAG IR and then DR and return bits shifted out of DR (an XsJtagFuture in deferred mode).
         instruction = opcode for JTAG IR.
         data = bits to load into JTAG DR.
         num_return_bits = # of bits to shift out of DR.
+        force = True to load the IR even if it already holds the instruction (for instructions
+                that act when they're loaded, like JPROGRAM).
         """
 
-        # The TAP FSM should always start and return to the run-test/idle state until all instructions are done.
-        if self._tap_state != 'Run-Test/Idle':
-            self.reset_tap()
-            self.go_thru_tap_states('Run-Test/Idle')
-
-        if instruction != None:
-            # Go  to the shift-ir state.
-            self.go_thru_tap_states('Select-DR-Scan', 'Select-IR-Scan', 'Capture-IR', 'Shift-IR')
-            # Now shift in the instruction opcode and activate it.
-            self.shift_tdi(tdi=instruction, do_exit_shift=True)
-            self.go_thru_tap_states('Update-IR')
-
-        # TAP FSM can get to select-dr-scan from either of these states.
-        assert self._tap_state == 'Run-Test/Idle' or self._tap_state == 'Update-IR'
-        bits = XsBitArray()
-        if data != None:
-            # If there's data to send, then there should never be data to return.
-            assert num_return_bits == 0
-            # Go  to the shift-dr state.
-            self.go_thru_tap_states('Select-DR-Scan', 'Capture-DR', 'Shift-DR')
-            # Now shift in the data for the instruction.
-            self.shift_tdi(tdi=data, do_exit_shift=True)
-            self.go_thru_tap_states('Update-DR')
-        elif num_return_bits != 0:
-            # No data to send, but there is data to receive from the DR.
-            self.go_thru_tap_states('Select-DR-Scan', 'Capture-DR', 'Shift-DR')
-            # Shift the data out of the DR.
-            bits = self.shift_tdo(num_bits=num_return_bits, do_exit_shift=True)
-            self.go_thru_tap_states('Update-DR')
-        assert self._tap_state == 'Run-Test/Idle' or self._tap_state == 'Update-IR' or self._tap_state == 'Update-DR'
-        self.go_thru_tap_states('Run-Test/Idle')
-        self.flush()
-        return bits
+        # The TMS-only and TDI-only packets for the IR and DR scans are sent in as few USB transfers as possible.
+        with self._xsusb.batch():
+            # The TAP FSM should always start and return to the run-test/idle state until all instructions are done.
+            # The TAP only gets reset on the way if its state isn't known.
+            self.goto_state(self.RUN_TEST_IDLE)
+
+            if instruction != None and not force and self.get_instruction() == instruction:
+                # The IR already holds the instruction, so go straight to the DR scan.
+                self.num_ir_skips += 1
+            elif instruction != None:
+                # Go  to the shift-ir state.
+                self.goto_state(self.SHIFT_IR)
+                # Now shift in the instruction opcode and activate it.
+                self.shift_tdi(tdi=instruction, do_exit_shift=True)
+                self.goto_state(self.UPDATE_IR)
+                self.set_instruction(instruction)
+
+            # TAP FSM can get to select-dr-scan from either of these states.
+            assert self._tap_state == self.RUN_TEST_IDLE or self._tap_state == self.UPDATE_IR
+            bits = XsBitArray()
+            if data != None:
+                # If there's data to send, then there should never be data to return.
+                assert num_return_bits == 0
+                # Go  to the shift-dr state.
+                self.goto_state(self.SHIFT_DR)
+                # Now shift in the data for the instruction.
+                self.shift_tdi(tdi=data, do_exit_shift=True)
+                self.goto_state(self.UPDATE_DR)
+            elif num_return_bits != 0:
+                # No data to send, but there is data to receive from the DR.
+                self.goto_state(self.SHIFT_DR)
+                # Shift the data out of the DR.
+                bits = self.shift_tdo(num_bits=num_return_bits, do_exit_shift=True)
+                self.goto_state(self.UPDATE_DR)
+            assert self._tap_state == self.RUN_TEST_IDLE or self._tap_state == self.UPDATE_IR or self._tap_state == self.UPDATE_DR
+            self.goto_state(self.RUN_TEST_IDLE)
+            self.flush()
+            return bits
 
-    def reset_tap(self):
-        """Reset the TAP FSM."""
+    def reset_tap(self, force=False):
+        """Reset the TAP FSM.
+        
+        The reset is skipped if the TAP is already known to be in the test-logic-reset state, unless force is True.
+        """
+
+        self._check_tap_resets()
+        if self._tap_state == self.TEST_LOGIC_RESET and not force:
+            return
 
         # Flush anything that's already in the buffer.
         self.flush()
 
         # Setting TMS=1 for five clocks guarantees TAP is in test-logic-reset state.
-        for i in range(0, 5):
-            self.shift_tms(0x01)
+        self._append_tms(XsBitArray(uint=(1 << self._RESET_TMS_LEN) - 1, length=self._RESET_TMS_LEN))
         self.flush()
-        self._tap_state = 'Test-Logic-Reset'
+        self._tap_state = self.TEST_LOGIC_RESET
+        self._instruction = None  # The reset loads the IR with a device-specific instruction.
 
     def run_test_idle(self):
-        self.go_thru_tap_states('Run-Test/Idle')
+        """Move the TAP FSM to the run-test/idle state."""
+
+        self.goto_state(self.RUN_TEST_IDLE)
 
     def runtest(self, num_tcks):
         """Clock the JTAG port a given number of times."""
@@ -313,7 +796,14 @@ class XsJtag:
         # The command packet contains the RUNTEST_CMD byte and then the
         # number of clocks as a 32-bit number starting with the least-significant byte.
         cmd = bytearray([XsUsb.RUNTEST_CMD, num_tcks & 0xff, num_tcks >> 8 & 0xff, num_tcks >> 16 & 0xff, num_tcks >> 24 & 0xff])
-        self._xsusb.write(cmd)  # Send the command.
+        self._send(cmd)  # Send the command.
+        self.num_runtests += 1
+        self.num_tcks += num_tcks
+        if not self._xsusb.returns_enabled():
+            return  # The board won't echo the command, so there's nothing to check.
+        if self._deferred_cmds is not None:
+            self._deferred_responses.append((5, None))  # The response gets checked by execute().
+            return
 
         # Check that the 1st byte of the command response matches the command opcode.
         if self._xsusb.read(5)[0] != XsUsb.RUNTEST_CMD:
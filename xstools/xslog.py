@@ -0,0 +1,80 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# **********************************************************************
+#   This program is free software; you can redistribute it and/or
+#   modify it under the terms of the GNU General Public License
+#   as published by the Free Software Foundation; either version 2
+#   of the License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+#   02111-1307, USA.
+#
+#   (c)2012 - X Engineering Software Systems Corp. (www.xess.com)
+# **********************************************************************
+
+"""
+Logging helpers for the USB/JTAG data path.
+
+Each module gets its own logger under 'xstools' so tracing can be turned on
+for one layer at a time, e.g.:
+
+    logging.getLogger('xstools.xsusb').setLevel(logging.DEBUG)
+
+Trace records for bulk data are wrapped in HexTrace/BitsTrace objects so the
+formatting only happens if the record is actually emitted, and then only for
+the first few bytes of the data.
+"""
+
+import logging
+import binascii
+
+TRACE_BYTES = 32  # Default number of bytes shown in a data trace.
+
+
+def get_logger(module_name):
+    """Return the logger for an XSTOOLs module given its __name__."""
+
+    return logging.getLogger('xstools.' + module_name.split('.')[-1])
+
+
+class HexTrace(object):
+
+    """Lazily-formatted hex dump of the start of a byte buffer."""
+
+    __slots__ = ('_data', '_limit')
+
+    def __init__(self, data, limit=TRACE_BYTES):
+        self._data = data
+        self._limit = limit
+
+    def __str__(self):
+        num_bytes = len(self._data)
+        s = binascii.hexlify(bytearray(self._data[:self._limit]))
+        if num_bytes > self._limit:
+            s += '... (%d bytes)' % num_bytes
+        return s
+
+
+class BitsTrace(object):
+
+    """Lazily-formatted string for the first bits of a bit array."""
+
+    __slots__ = ('_bits', '_limit')
+
+    def __init__(self, bits, limit=TRACE_BYTES):
+        self._bits = bits
+        self._limit = limit * 8
+
+    def __str__(self):
+        num_bits = self._bits.len
+        if num_bits > self._limit:
+            # Bit arrays index from the last bit sent, so the first bits sent are at the end.
+            return '%s... (%d bits)' % (self._bits[num_bits - self._limit:], num_bits)
+        return str(self._bits)
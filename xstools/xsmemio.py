@@ -29,6 +29,9 @@ import logging
 import itertools
 import struct
 from xshostio import *
+from xslog import get_logger
+
+_log = get_logger(__name__)
 
 
 class XsMemIo(XsHostIo):
@@ -62,8 +65,8 @@ class XsMemIo(XsHostIo):
         (self.address_width, self.data_width) = self._get_mem_widths()
         assert self.address_width != 0
         assert self.data_width != 0
-        logging.debug('address width = ' + str(self.address_width))
-        logging.debug('data width = ' + str(self.data_width))
+        _log.debug('address width = %d', self.address_width)
+        _log.debug('data width = %d', self.data_width)
 
     def _get_mem_widths(self):
         """Return the (address_width, data_width) of the memory."""
@@ -82,6 +85,14 @@ class XsMemIo(XsHostIo):
         data_width = params.pop_field(self._SIZE_RESULT_LENGTH / 2).unsigned
         return (address_width, data_width)
 
+    def _get_words_per_chunk(self):
+        """Return how many data words fit in the link's best USB transfer size, or None if it's unknown."""
+
+        chunk_size = self.xsjtag.get_chunk_size()
+        if chunk_size is None:
+            return None
+        return max(8 * chunk_size // self.data_width, 1)
+
     def read(self, begin_address, num_of_reads=1, return_type=XsBitArray()):
         """Return a list of bit arrays read from memory.
         
@@ -90,6 +101,9 @@ class XsMemIo(XsHostIo):
         return_type = instance of the type of data to return. Negative integer=signed; positive integer=unsigned.
         """
 
+        if _log.isEnabledFor(logging.DEBUG):
+            _log.debug('Read %d words starting at address %d.', num_of_reads, begin_address)
+
         # Start the payload with the READ_OPCODE.
         payload = XsBitArray(self._READ_OPCODE)
 
@@ -99,8 +113,18 @@ class XsMemIo(XsHostIo):
         # Send the opcode and beginning address and then read back the memory data.
         # The number of values read back is one more than requested because the first value
         # returned is crap since the memory isn't ready to respond.
-        result = self.send_rcv(payload=payload,
-                               num_result_bits=self.data_width * (num_of_reads + 1))
+        num_result_bits = self.data_width * (num_of_reads + 1)
+        words_per_chunk = self._get_words_per_chunk()
+        if words_per_chunk is None or num_of_reads <= words_per_chunk:
+            result = self.send_rcv(payload=payload, num_result_bits=num_result_bits)
+        else:
+            # A long read is a single request, but the data comes back in pieces
+            # that match the best USB transfer size for the link.
+            self._send(payload=payload, num_result_bits=num_result_bits)
+            result = XsBitArray()
+            chunk_bits = words_per_chunk * self.data_width
+            for i in range(0, num_result_bits, chunk_bits):
+                result += self.xsjtag.shift_tdo(min(chunk_bits, num_result_bits - i))
 
         if num_of_reads == 1: # Return the result bit array if there's only a single read.
             result.pop_field(self.data_width)  # Remove the first data value which is crap.
@@ -129,13 +153,13 @@ class XsMemIo(XsHostIo):
                     w_type = {1:'B', 2:'H', 4:'I', 8:'Q'}[w // 8]
                     if return_type < 0:
                         w_type = str.lower(w_type)
-                    alignment = '>'
+                    alignment = '<'
                     n_words = l // w  # Number of words in the bit array.
                     fmt = '{}{}{}'.format(alignment, n_words, w_type)
-                    # Get bytes from bit array, form them into integers and reverse
-                    # their order so index [0] corresponds to lowest memory address.
+                    # The USB byte order of the bit array holds the words as little-endian
+                    # integers with the word for the lowest memory address first.
                     # (Skip first integer because it's crap.)
-                    return struct.unpack(fmt, result.bytes)[-2::-1]
+                    return struct.unpack(fmt, result.to_usb())[1:]
                 except KeyError:
                     # Slower method:
                     #     Chop the bit array into an array of smaller bit arrays.
@@ -148,6 +172,38 @@ class XsMemIo(XsHostIo):
                         results = [d.uint for d in results]
                     return results
 
+    def read_into(self, begin_address, buf, num_of_reads=1, offset=0):
+        """Read words from memory into a bytearray and return the number of bytes stored.
+        
+        begin_address = memory address of first read.
+        buf = bytearray that receives the words as little-endian integers with the word for the lowest address first.
+        num_of_reads = number of memory reads to perform.
+        offset = index in buf where the first word is stored.
+        """
+
+        if self.data_width % 8 != 0:
+            raise XsMinorError('Memory data width of %d bits is not a whole number of bytes.' % self.data_width)
+
+        if _log.isEnabledFor(logging.DEBUG):
+            _log.debug('Read %d words starting at address %d into a buffer.', num_of_reads, begin_address)
+
+        # Send the opcode and beginning address.
+        payload = XsBitArray(self._READ_OPCODE)
+        payload += XsBitArray(uint=begin_address, length=self.address_width)
+        w = self.data_width
+        self._send(payload=payload, num_result_bits=w * (num_of_reads + 1))
+
+        # The first value returned is crap since the memory isn't ready to respond, so skip it.
+        self.xsjtag.shift_tdo(w)
+
+        # Then the data goes straight into the buffer, in pieces that match the best USB transfer size for the link.
+        words_per_chunk = self._get_words_per_chunk() or num_of_reads
+        bytes_per_word = w // 8
+        for i in range(0, num_of_reads, words_per_chunk):
+            n = min(words_per_chunk, num_of_reads - i)
+            self.xsjtag.shift_tdo_into(buf, n * w, offset=offset + i * bytes_per_word)
+        return num_of_reads * bytes_per_word
+
     def write(self, begin_address, data, data_type=None):
         """Write a list of bit arrays to the memory.
         
@@ -162,6 +218,16 @@ class XsMemIo(XsHostIo):
             else:
                 data_type = 1  # Unsigned, positive integer.
 
+        if _log.isEnabledFor(logging.DEBUG):
+            _log.debug('Write %d words starting at address %d.', len(data), begin_address)
+
+        # Split long writes into pieces that match the best USB transfer size for the link.
+        words_per_chunk = self._get_words_per_chunk()
+        if words_per_chunk is not None and len(data) > words_per_chunk:
+            for i in range(0, len(data), words_per_chunk):
+                self.write(begin_address + i, data[i:i + words_per_chunk], data_type)
+            return
+
         # Concatenate the data to the payload.
         if isinstance(data_type, XsBitArray):
             w = data_type.len
@@ -173,11 +239,22 @@ class XsMemIo(XsHostIo):
         else:
             w = self.data_width
             l = len(data)
-            if w % 8 == 0:
+            if w in (8, 16, 32, 64):
+                # Pack the words as little-endian integers with the first word at the start.
+                # That's the order the bits are transmitted over USB.
+                w_type = {1:'B', 2:'H', 4:'I', 8:'Q'}[w // 8]
+                mask = (1 << w) - 1
+                try:
+                    packed = struct.pack('<%d%s' % (l, w_type), *data)
+                except struct.error:
+                    # Some of the words must be negative, so convert them to unsigned.
+                    packed = struct.pack('<%d%s' % (l, w_type), *[d & mask for d in data])
+                payload = XsBitArray.from_usb(packed, w * l)
+            elif w % 8 == 0:
                 words = [[(d>>i) & 0xff for i in range(0,w,8)] for d in data]
                 bytes = [byte for word in words for byte in word]
                 bytes.reverse()
-                payload = BitArray(bytes=bytes)
+                payload = XsBitArray(bytes=bytes)
             else:
                 payload = XsBitArray(w * len(data))
                 index = w * (len(data)-1)
@@ -0,0 +1,158 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# **********************************************************************
+#   This program is free software; you can redistribute it and/or
+#   modify it under the terms of the GNU General Public License
+#   as published by the Free Software Foundation; either version 2
+#   of the License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+#   02111-1307, USA.
+#
+#   (c)2012 - X Engineering Software Systems Corp. (www.xess.com)
+# **********************************************************************
+
+"""
+Process-wide pool of open USB/JTAG links to XESS boards.
+
+Every object that talks to a board without being handed an XsJtag object
+gets its links from here, so there's only one XsUsb and one XsJtag per
+physical board and they all agree on the state of its JTAG TAP.
+"""
+
+import time
+import threading
+from xserror import *
+from xsusb import XsUsb
+from xsjtag import XsJtag
+
+
+class XsSession:
+
+    """Open USB and JTAG links to a single XESS board."""
+
+    def __init__(self, xsusb_id=0):
+        self.xsusb = XsUsb(xsusb_id)
+        self.xsjtag = XsJtag(self.xsusb)
+        # Use the measured timeouts and transfer sizes if this board has been calibrated on this USB port.
+        self.xsusb.load_link_profile()
+        self.xsboard = None  # The board object, once the type of board has been detected.
+        self.last_used = time.time()  # When the session was last handed out (XsUsb.last_used has the last transfer).
+        self.released = False  # True if the USB interface was given up because the session was idle.
+
+    def get_key(self):
+        """Return the registry key of the USB device for this board, or None if it's disconnected."""
+
+        return self.xsusb.get_dev_key()
+
+
+class XsSessionPool:
+
+    """Keeps a session open for each XESS board that's in use."""
+
+    _IDLE_TIME_OUT = 10.0  # Seconds of inactivity before a session gives up its USB interface.
+
+    def __init__(self, idle_time_out=_IDLE_TIME_OUT):
+        self.idle_time_out = idle_time_out
+        self._sessions = {}  # Sessions keyed by the registry key of their USB device.
+        self._lock = threading.RLock()
+
+    def get_session(self, xsusb_id=0):
+        """Return the session for the board on a USB port, opening one if needed."""
+
+        key = XsUsb.get_port_key(xsusb_id)
+        if key is None:
+            raise XsMinorError('XESS USB device could not be found.')
+
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None or session.get_key() != key:
+                # Sessions move if their board was reset and came back on another address.
+                self._rekey()
+                session = self._sessions.get(key)
+            if session is None:
+                session = XsSession(xsusb_id)
+                self._sessions[key] = session
+            elif session.released:
+                # Something else could have used the board while it was released.
+                session.xsjtag.invalidate()
+                session.released = False
+            session.last_used = time.time()
+            return session
+
+    def get_xsboard(self, xsusb_id=0, xsboard_name=''):
+        """Return the board object for the board on a USB port, detecting its type only the first time."""
+
+        if xsusb_id is None:
+            return None
+        try:
+            session = self.get_session(xsusb_id)
+        except XsError:
+            return None  # No board on that port.
+        if session.xsboard is None or (xsboard_name and session.xsboard.name.lower() != xsboard_name.lower()):
+            from xsboard import XsBoard  # Imported here because the board classes use this module.
+            session.xsboard = XsBoard.get_xsboard(xsusb_id, xsboard_name)
+        return session.xsboard
+
+    def release_idle(self, idle_time_out=None):
+        """Give up the USB interfaces of sessions that have been idle and forget boards that are gone."""
+
+        if idle_time_out is None:
+            idle_time_out = self.idle_time_out
+        now = time.time()
+        with self._lock:
+            self._rekey()
+            for session in self._sessions.values():
+                # A session is in use while it's being handed out or its board is doing USB transfers.
+                last_used = max(session.last_used, session.xsusb.last_used)
+                if not session.released and now - last_used > idle_time_out:
+                    session.xsusb.release()
+                    session.released = True
+
+    def close(self):
+        """Close every session in the pool."""
+
+        with self._lock:
+            for session in self._sessions.values():
+                session.xsusb.disconnect()
+            self._sessions = {}
+
+    def _rekey(self):
+        """Re-file the sessions under the current keys of their boards and drop the ones that are gone."""
+
+        XsUsb.get_xsusb_ports()  # Make sure the registry is up to date.
+        sessions = {}
+        for session in self._sessions.values():
+            key = session.get_key()
+            if XsUsb.is_registered(key):
+                sessions[key] = session
+        self._sessions = sessions
+
+
+# The pool shared by everything in this process.
+_pool = XsSessionPool()
+
+
+def get_session(xsusb_id=0):
+    """Return the shared session for the board on a USB port."""
+
+    return _pool.get_session(xsusb_id)
+
+
+def get_xsboard(xsusb_id=0, xsboard_name=''):
+    """Return the shared board object for the board on a USB port."""
+
+    return _pool.get_xsboard(xsusb_id, xsboard_name)
+
+
+def release_idle(idle_time_out=None):
+    """Give up the USB interfaces of the shared sessions that have been idle."""
+
+    _pool.release_idle(idle_time_out)
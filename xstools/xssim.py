@@ -0,0 +1,865 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# **********************************************************************
+#   This program is free software; you can redistribute it and/or
+#   modify it under the terms of the GNU General Public License
+#   as published by the Free Software Foundation; either version 2
+#   of the License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+#   02111-1307, USA.
+#
+#   (c)2012 - X Engineering Software Systems Corp. (www.xess.com)
+# **********************************************************************
+
+"""
+Software model of a XuLA board for running XSTOOLs without hardware.
+
+XsSimBoard is a transport (see xstransport) that understands the USB
+commands of the XuLA firmware and drives a model of a Xilinx FPGA's JTAG
+TAP. The FPGA model has IDCODE, CFG_IN/CFG_OUT (with readback of the
+configuration frames), JPROGRAM/JSTART and a USER1 bus where models of the
+HostIo modules (XsSimMemory, XsSimDut) respond to XsMemIo and XsDutIo objects:
+
+    sim = XsSimBoard(modules={3: XsSimMemory(24, 16)}, latency=0.001, bandwidth=1.0e6)
+    xsjtag = XsJtag(XsUsb(transport=sim))
+    ram = XsMemIo(module_id=3, xsjtag=xsjtag)
+
+The TDO bits a module sends only depend on the TDI bits it received in earlier
+JTAG commands, which is how the XsHostIo objects use them.
+"""
+
+import time
+import struct
+import logging
+from collections import deque
+from xserror import *
+from xslog import *
+from xsbitarray import XsBitArray
+from xstransport import XsTransport, read_result
+
+_log = get_logger(__name__)
+
+# These are the same as in XsUsb, but that module isn't imported so the simulator can be used by the transports under it.
+INFO_CMD = 0x40
+RUNTEST_CMD = 0x47
+PROG_CMD = 0x49
+ENABLE_RETURN_CMD = 0x4d
+DISABLE_RETURN_CMD = 0x4e
+JTAG_CMD = 0x4f
+READ_EEDATA_CMD = 0x04
+WRITE_EEDATA_CMD = 0x05
+AIO0_ADC_CMD = 0x60
+AIO1_ADC_CMD = 0x61
+RESET_CMD = 0xff
+GET_TDO_MASK = 0x01
+PUT_TMS_MASK = 0x02
+TMS_VAL_MASK = 0x04
+PUT_TDI_MASK = 0x08
+TDI_VAL_MASK = 0x10
+
+# TAP state transitions indexed by the current state and then the TMS bit.
+_NEXT_TAP_STATE = {
+    'Test-Logic-Reset': ('Run-Test/Idle', 'Test-Logic-Reset'),
+    'Run-Test/Idle': ('Run-Test/Idle', 'Select-DR-Scan'),
+    'Select-DR-Scan': ('Capture-DR', 'Select-IR-Scan'),
+    'Capture-DR': ('Shift-DR', 'Exit1-DR'),
+    'Shift-DR': ('Shift-DR', 'Exit1-DR'),
+    'Exit1-DR': ('Pause-DR', 'Update-DR'),
+    'Pause-DR': ('Pause-DR', 'Exit2-DR'),
+    'Exit2-DR': ('Shift-DR', 'Update-DR'),
+    'Update-DR': ('Run-Test/Idle', 'Select-DR-Scan'),
+    'Select-IR-Scan': ('Capture-IR', 'Test-Logic-Reset'),
+    'Capture-IR': ('Shift-IR', 'Exit1-IR'),
+    'Shift-IR': ('Shift-IR', 'Exit1-IR'),
+    'Exit1-IR': ('Pause-IR', 'Update-IR'),
+    'Pause-IR': ('Pause-IR', 'Exit2-IR'),
+    'Exit2-IR': ('Shift-IR', 'Update-IR'),
+    'Update-IR': ('Run-Test/Idle', 'Select-DR-Scan'),
+    }
+
+
+def _words_to_bits(words, width):
+    """Return a bit array with the words in transmission order, first word first."""
+
+    if width in (8, 16, 32, 64):
+        fmt = '<%d%s' % (len(words), {8: 'B', 16: 'H', 32: 'I', 64: 'Q'}[width])
+        return XsBitArray.from_usb(bytearray(struct.pack(fmt, *words)), width * len(words))
+    bits = XsBitArray()
+    for w in words:
+        bits += XsBitArray(uint=w, length=width)
+    return bits
+
+
+def _bits_to_words(bits, width):
+    """Return the list of words in a bit array holding a whole number of words in transmission order."""
+
+    n = bits.len // width
+    if width in (8, 16, 32, 64):
+        fmt = '<%d%s' % (n, {8: 'B', 16: 'H', 32: 'I', 64: 'Q'}[width])
+        return list(struct.unpack(fmt, str(bits.to_usb())))
+    bits = XsBitArray(bits)
+    return [bits.pop_field(width).uint for i in range(n)]
+
+
+class XsSimModule:
+
+    """Model of a HostIo module attached to the USER1 bus of the FPGA."""
+
+    def start(self):
+        """Get ready for a new transaction from the host."""
+
+        pass
+
+    def shift(self, tdi):
+        """Take a bit array of TDI bits and return a bit array with as many TDO bits."""
+
+        return XsBitArray(tdi.len)
+
+
+class XsSimOpcodeModule(XsSimModule):
+
+    """Model of a module whose transactions start with a two-bit opcode (like XsMemIo and XsDutIo)."""
+
+    _NOP = 0
+    _SIZE = 1  # Return the two 8-bit widths of the module after one skipped cycle.
+    _WRITE = 2
+    _READ = 3
+
+    def start(self):
+        self._opcode = None
+        self._rx = XsBitArray()  # TDI bits that haven't been used yet.
+        self._tx = XsBitArray()  # TDO bits waiting to go out.
+
+    def shift(self, tdi):
+        # The TDO bits come from what the module received earlier, so get them before looking at the new TDI bits.
+        tdo = self._emit(tdi.len)
+        self._rx += tdi
+        if self._opcode is None and self._rx.len >= 2:
+            self._opcode = self._rx.pop_field(2).uint
+            if self._opcode == self._SIZE:
+                skip = XsBitArray(1)
+                widths = self.get_widths()
+                self._tx = skip + XsBitArray(uint=widths[0], length=8) + XsBitArray(uint=widths[1], length=8)
+        if self._opcode is not None:
+            self._receive(self._opcode)
+        return tdo
+
+    def _emit(self, num_bits):
+        """Return the next num_bits TDO bits."""
+
+        if self._tx.len < num_bits:
+            self._tx += self._more_output(num_bits - self._tx.len)
+        if self._tx.len < num_bits:
+            self._tx += XsBitArray(num_bits - self._tx.len)
+        return self._tx.pop_field(num_bits)
+
+    def get_widths(self):
+        """Return the pair of widths sent in response to the SIZE opcode."""
+
+        return (0, 0)
+
+    def _receive(self, opcode):
+        """Use the TDI bits received after the opcode."""
+
+        self._rx = XsBitArray()
+
+    def _more_output(self, num_bits):
+        """Return at least num_bits more TDO bits if the module is streaming a result, or an empty bit array."""
+
+        return XsBitArray()
+
+
+class XsSimMemory(XsSimOpcodeModule):
+
+    """Model of a memory that's read and written through an XsMemIo object."""
+
+    def __init__(self, address_width=24, data_width=16, contents=None):
+        """Create a memory.
+
+        contents = dictionary of initial word values keyed by address (unlisted words are zero).
+        """
+
+        self.address_width = address_width
+        self.data_width = data_width
+        self.mem = contents if contents is not None else {}
+        self.start()
+
+    def start(self):
+        XsSimOpcodeModule.start(self)
+        self._addr = None
+        self._first = True
+
+    def get_widths(self):
+        return (self.address_width, self.data_width)
+
+    def _receive(self, opcode):
+        if opcode not in (self._READ, self._WRITE):
+            self._rx = XsBitArray()
+            return
+        if self._addr is None:
+            if self._rx.len < self.address_width:
+                return
+            self._addr = self._rx.pop_field(self.address_width).uint
+        if opcode == self._WRITE:
+            # Store every whole word that has arrived.
+            num_words = self._rx.len // self.data_width
+            if num_words:
+                words = _bits_to_words(self._rx.pop_field(num_words * self.data_width), self.data_width)
+                mask = (1 << self.address_width) - 1
+                for i, w in enumerate(words):
+                    self.mem[(self._addr + i) & mask] = w
+                self._addr += num_words
+        else:
+            self._rx = XsBitArray()  # The TDI bits are ignored while data is being read.
+
+    def _more_output(self, num_bits):
+        if self._opcode != self._READ or self._addr is None:
+            return XsBitArray()
+        num_words = (num_bits + self.data_width - 1) // self.data_width
+        words = []
+        if self._first:
+            # The first word out isn't valid because the memory hasn't had time to respond.
+            words.append(0)
+            self._first = False
+            num_words -= 1
+        mask = (1 << self.address_width) - 1
+        mem = self.mem
+        words.extend(mem.get((self._addr + i) & mask, 0) for i in range(num_words))
+        self._addr += num_words
+        return _words_to_bits(words, self.data_width)
+
+
+class XsSimDut(XsSimOpcodeModule):
+
+    """Model of a device-under-test that's driven through an XsDutIo object."""
+
+    def __init__(self, input_width, output_width, function=None):
+        """Create a DUT.
+
+        function = function that gets the DUT inputs as a bit array (first field first) and
+                   returns the outputs as a bit array or an unsigned integer. If None, the
+                   inputs are looped back to the outputs.
+        """
+
+        self.input_width = input_width
+        self.output_width = output_width
+        self.function = function
+        self.inputs = XsBitArray(input_width)
+        self.start()
+
+    def get_widths(self):
+        return (self.input_width, self.output_width)
+
+    def _receive(self, opcode):
+        if opcode == self._WRITE:
+            if self._rx.len >= self.input_width:
+                self.inputs = self._rx.pop_field(self.input_width)
+                self._rx = XsBitArray()
+        else:
+            self._rx = XsBitArray()
+            if opcode == self._READ and self._tx.len == 0:
+                self._tx = XsBitArray(1) + self.get_outputs()  # Outputs follow one skipped cycle.
+
+    def get_outputs(self):
+        """Return a bit array with the DUT outputs for the current inputs."""
+
+        if self.function is None:
+            if self.input_width >= self.output_width:
+                return self.inputs.head(self.output_width)
+            return self.inputs + XsBitArray(self.output_width - self.input_width)
+        outputs = self.function(XsBitArray(self.inputs))
+        if isinstance(outputs, XsBitArray):
+            if outputs.len != self.output_width:
+                raise XsMinorError('Simulated DUT returned %d output bits instead of %d.' % (outputs.len, self.output_width))
+            return outputs
+        return XsBitArray(uint=outputs & ((1 << self.output_width) - 1), length=self.output_width)
+
+
+class _ShiftRegister:
+
+    """JTAG data or instruction register."""
+
+    def __init__(self, length, capture=None):
+        """capture = function returning the value loaded in the Capture state (default zero)."""
+
+        self.length = length
+        self._capture = capture
+        self.bits = XsBitArray(length)
+
+    def capture(self):
+        value = self._capture() if self._capture is not None else 0
+        self.bits = XsBitArray(uint=value, length=self.length)
+
+    def shift(self, tdi):
+        # The bits in the register go out first and the TDI bits are left in it.
+        total = self.bits + tdi
+        self.bits = total.tail(self.length)
+        return total.head(tdi.len)
+
+    def update(self):
+        pass
+
+
+class _CfgPackets:
+
+    """Configuration logic that carries out the 16-bit packets of a Spartan-3A/Spartan-6 bitstream.
+
+    Only what's needed for configuration and readback is modeled: the frames
+    written to FDRI are kept, and a read of FDRO after an RCFG command returns
+    a pad frame followed by those frames.
+    """
+
+    _SYNC_WORD = 0xaa99
+    _SYNC_WORD2 = 0x5566  # Second sync word of a Spartan-6 bitstream.
+    _FDRI = 3
+    _FDRO = 4
+    _CMD = 5
+    _FLR = 13
+    _RCFG = 4
+    _DESYNC = 13
+
+    def __init__(self):
+        self.frames = bytearray()  # Words written to FDRI, most-significant byte first.
+        self.frame_words = 0  # Frame length in words (from the FLR register).
+        self.readback = None  # Words to shift out of CFG_OUT for a read of FDRO.
+        self._synced = False
+        self._reg = None  # Register of the last type 1 packet.
+        self._count = 0  # Number of data words left in the current packet.
+        self._type2_header = None  # Header of a type 2 packet waiting for its two word-count words.
+        self._rcfg = False
+        self.start()
+
+    def start(self):
+        """Start a new scan through CFG_IN."""
+
+        self._bits = XsBitArray()
+        self._last_word = None
+
+    def put(self, tdi):
+        """Take bits shifted into CFG_IN and act on the complete words."""
+
+        self._bits += tdi
+        num_words = self._bits.len // 16
+        if num_words:
+            data = self._bits.pop_field(16 * num_words).to_msb_bytes()
+            for word in struct.unpack('>%dH' % num_words, str(data)):
+                self._word(word)
+
+    def _word(self, word):
+        last_word, self._last_word = self._last_word, word
+        if not self._synced:
+            self._synced = word == self._SYNC_WORD
+            return
+        if word == self._SYNC_WORD2 and last_word == self._SYNC_WORD:
+            return
+        if self._count:
+            # Data word of a packet.
+            self._count -= 1
+            if self._reg == self._FDRI:
+                self.frames += struct.pack('>H', word)
+            elif self._reg == self._FLR:
+                self.frame_words = word + 1
+            elif self._reg == self._CMD:
+                self._rcfg = word == self._RCFG
+                if word == self._DESYNC:
+                    self._synced = False
+            return
+        if self._type2_header is not None:
+            # Word count of a type 2 packet.
+            self._type2_header.append(word)
+            if len(self._type2_header) == 3:
+                header, count = self._type2_header[0], self._type2_header[1] << 16 | self._type2_header[2]
+                self._type2_header = None
+                self._reg = header >> 5 & 0x3f
+                if header >> 11 & 0x3 == 2:
+                    self._count = count
+                elif self._reg == self._FDRO and self._rcfg:
+                    pad = bytearray(2 * self.frame_words)
+                    self.readback = (pad + self.frames)[:2 * count]
+            return
+        packet_type = word >> 13
+        if packet_type == 1:
+            self._reg = word >> 5 & 0x3f
+            if word >> 11 & 0x3 == 2:
+                self._count = word & 0x1f
+        elif packet_type == 2:
+            self._type2_header = [word]
+
+    def clear(self):
+        """Clear the configuration memory."""
+
+        self.__init__()
+
+
+class _CfgIn:
+
+    """Data register that takes a configuration bitstream."""
+
+    def __init__(self, fpga):
+        self._fpga = fpga
+
+    def capture(self):
+        self._fpga.cfg.start()
+
+    def shift(self, tdi):
+        self._fpga.cfg_bits += tdi.len
+        self._fpga.cfg.put(tdi)
+        return XsBitArray(tdi.len)
+
+    def update(self):
+        pass
+
+
+class _CfgOut:
+
+    """Data register that returns the status register or the frames requested by a read of FDRO."""
+
+    def __init__(self, fpga):
+        self._fpga = fpga
+        self._bits = XsBitArray()
+
+    def capture(self):
+        cfg = self._fpga.cfg
+        if cfg.readback is not None:
+            self._bits = XsBitArray.from_msb_bytes(cfg.readback)
+            cfg.readback = None
+        else:
+            self._bits = XsBitArray(uint=self._fpga.get_status(), length=32)
+
+    def shift(self, tdi):
+        n = min(tdi.len, self._bits.len)
+        return self._bits.pop_field(n) + XsBitArray(tdi.len - n)
+
+    def update(self):
+        pass
+
+
+class _HostIoBus:
+
+    """USER1 data register that splits the TDI bits into transactions for the HostIo modules.
+
+    Each transaction starts with an 8-bit module ID and a 32-bit count of the
+    bits that follow it, just like XsHostIo.send_rcv() sends them.
+    """
+
+    _HEADER_LEN = 8 + 32
+
+    def __init__(self, modules):
+        self._modules = modules
+        self.capture()
+
+    def capture(self):
+        self._header = XsBitArray()
+        self._module = None
+        self._remaining = 0
+
+    def shift(self, tdi):
+        tdi = XsBitArray(tdi)
+        tdo = XsBitArray()
+        while tdi.len:
+            if self._remaining == 0:
+                # Gather the header of the next transaction.
+                n = min(self._HEADER_LEN - self._header.len, tdi.len)
+                self._header += tdi.pop_field(n)
+                tdo += XsBitArray(n)
+                if self._header.len == self._HEADER_LEN:
+                    module_id = self._header.pop_field(8).uint
+                    self._remaining = self._header.pop_field(32).uint
+                    self._header = XsBitArray()
+                    self._module = self._modules.get(module_id)
+                    if self._module is not None:
+                        self._module.start()
+                    elif _log.isEnabledFor(logging.DEBUG):
+                        _log.debug('No simulated module with ID %d.', module_id)
+            else:
+                # Pass the bits of the transaction to the module.
+                n = min(self._remaining, tdi.len)
+                bits = tdi.pop_field(n)
+                tdo += self._module.shift(bits) if self._module is not None else XsBitArray(n)
+                self._remaining -= n
+        return tdo
+
+    def update(self):
+        pass
+
+
+class XsSimFpga:
+
+    """Model of the JTAG port of a Xilinx FPGA."""
+
+    # Xilinx instruction opcodes (Spartan-3A and Spartan-6).
+    USER1_INSTR = 0x02
+    CFG_OUT_INSTR = 0x04
+    CFG_IN_INSTR = 0x05
+    IDCODE_INSTR = 0x09
+    JPROGRAM_INSTR = 0x0b
+    JSTART_INSTR = 0x0c
+
+    _MIN_BITSTREAM_BITS = 1024  # CFG_IN has to get at least this many bits before JSTART will set DONE.
+    _DONE_BIT = 13  # Position of the DONE bit in the status register as read through CFG_OUT.
+    _INIT_BIT = 12
+
+    def __init__(self, idcode, modules=None, ir_length=6):
+        """Create the FPGA.
+
+        idcode = the 32-bit IDCODE as an integer or bit array.
+        modules = dictionary of XsSimModule objects keyed by their module IDs.
+        """
+
+        self.idcode = idcode if isinstance(idcode, (int, long)) else XsBitArray(idcode).uint
+        self.modules = modules if modules is not None else {}
+        self.ir_length = ir_length
+        self.state = 'Test-Logic-Reset'
+        self.done = False  # True once the FPGA is configured.
+        self.cfg_bits = 0  # Number of bits received by CFG_IN since the FPGA was cleared.
+        self.cfg = _CfgPackets()  # Configuration logic behind CFG_IN and CFG_OUT.
+        self.idle_clocks = 0  # Number of TCK pulses spent in the run-test/idle state.
+        self._ir = _ShiftRegister(ir_length, capture=lambda: 0x01)
+        self._bypass = _ShiftRegister(1)
+        self._drs = {
+            self.IDCODE_INSTR: _ShiftRegister(32, capture=lambda: self.idcode),
+            self.CFG_IN_INSTR: _CfgIn(self),
+            self.CFG_OUT_INSTR: _CfgOut(self),
+            self.USER1_INSTR: _HostIoBus(self.modules),
+            }
+        self._reset()
+        self._dr = self._bypass
+
+    def _reset(self):
+        """Put the TAP in its test-logic-reset condition."""
+
+        self.instruction = self.IDCODE_INSTR
+
+    def clear(self):
+        """Clear the configuration (e.g., when PROG# is pulled low)."""
+
+        self.done = False
+        self.cfg_bits = 0
+        self.cfg.clear()
+
+    def get_status(self):
+        """Return the status register contents as they're read through CFG_OUT."""
+
+        return (self.done << self._DONE_BIT) | (1 << self._INIT_BIT)
+
+    def _enter(self, state):
+        """Do what the TAP does on entering a state."""
+
+        self.state = state
+        if state == 'Test-Logic-Reset':
+            self._reset()
+        elif state == 'Capture-DR':
+            self._dr = self._drs.get(self.instruction, self._bypass)
+            self._dr.capture()
+        elif state == 'Capture-IR':
+            self._ir.capture()
+        elif state == 'Update-DR':
+            self._dr.update()
+        elif state == 'Update-IR':
+            self.instruction = self._ir.bits.uint
+            if self.instruction == self.JPROGRAM_INSTR:
+                self.clear()
+            elif self.instruction == self.JSTART_INSTR and self.cfg_bits >= self._MIN_BITSTREAM_BITS:
+                self.done = True
+
+    def clock(self, num_bits, tms, tdi):
+        """Pulse TCK num_bits times and return the bit array of TDO values.
+
+        tms = list of TMS bit values, or a single value for all the clocks.
+        tdi = bit array of TDI values, or a single value for all the clocks.
+        """
+
+        if isinstance(tdi, XsBitArray):
+            tdi = XsBitArray(tdi)  # This gets consumed as it's used.
+        tdo = XsBitArray()
+        i = 0
+        while i < num_bits:
+            state = self.state
+            tms_bit = tms if isinstance(tms, int) else tms[i]
+            if _NEXT_TAP_STATE[state][tms_bit] == state:
+                # The TAP stays in this state for as long as TMS doesn't change, so do all those clocks at once.
+                j = num_bits
+                if not isinstance(tms, int):
+                    j = i + 1
+                    while j < num_bits and tms[j] == tms_bit:
+                        j += 1
+                n = j - i
+                if isinstance(tdi, XsBitArray):
+                    tdi_bits = tdi.pop_field(n)
+                elif state in ('Shift-DR', 'Shift-IR'):
+                    tdi_bits = XsBitArray(uint=(1 << n) - 1 if tdi else 0, length=n)
+                if state == 'Shift-DR':
+                    tdo += self._dr.shift(tdi_bits)
+                elif state == 'Shift-IR':
+                    tdo += self._ir.shift(tdi_bits)
+                else:
+                    if state == 'Run-Test/Idle':
+                        self.idle_clocks += n
+                    tdo += XsBitArray(n)
+                i = j
+            else:
+                # Clock the TAP into another state.
+                tdi_bit = tdi.pop_field(1) if isinstance(tdi, XsBitArray) else XsBitArray([tdi])
+                if state == 'Shift-DR':
+                    tdo += self._dr.shift(tdi_bit)
+                elif state == 'Shift-IR':
+                    tdo += self._ir.shift(tdi_bit)
+                else:
+                    tdo += XsBitArray(1)
+                self._enter(_NEXT_TAP_STATE[state][tms_bit])
+                i += 1
+        return tdo
+
+
+class XsSimBoard(XsTransport):
+
+    """Transport that simulates a XuLA board instead of talking to one."""
+
+    DEFAULT_IDCODE = XsBitArray('0b00000010001000011000000010010011')  # XC3S200A, as on the XuLA-200.
+
+    def __init__(self, idcode=DEFAULT_IDCODE, modules=None, latency=0.0, bandwidth=None,
+                 description='XuLA simulator', version=(1, 3), ir_length=6, packet_size=64):
+        """Create a simulated board.
+
+        idcode = IDCODE of the simulated FPGA.
+        modules = dictionary of XsSimModule objects on the FPGA's USER1 bus keyed by their module IDs.
+        latency = seconds added to each USB transfer.
+        bandwidth = bytes per second for USB transfers (None for no limit).
+        description, version = what the board reports as its information.
+        packet_size = size of the USB packets the board sends (None to treat the IN pipe as a stream of bytes).
+        """
+
+        self.fpga = XsSimFpga(idcode, modules, ir_length)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.description = description
+        self.version = version
+        self.packet_size = packet_size
+        self.eedata = {}  # Microcontroller EEPROM contents keyed by address.
+        self.aio = [0.0, 0.0]  # Voltages (or functions returning them) on the AIO0 and AIO1 pins.
+        self.prog = 1  # Level of the FPGA PROG# pin.
+        self.return_enabled = True  # False if commands aren't echoed (DISABLE_RETURN_CMD).
+        self._cmds = bytearray()  # Command bytes that haven't been processed yet.
+        self._response = bytearray()  # Bytes waiting to be read by the host.
+        self._packet_lens = deque()  # Lengths of the USB packets the bytes waiting to be read are sent in.
+        # Transfer counts for benchmarks.
+        self.num_writes = 0
+        self.num_reads = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+
+    def _delay(self, num_bytes):
+        """Take as long as a transfer of num_bytes over the simulated link."""
+
+        secs = self.latency
+        if self.bandwidth:
+            secs += num_bytes / float(self.bandwidth)
+        if secs > 0:
+            time.sleep(secs)
+
+    def write(self, endpoint, data, timeout=None):
+        num_bytes = len(data)
+        self._delay(num_bytes)
+        self.num_writes += 1
+        self.bytes_out += num_bytes
+        self._cmds += data
+        self._process()
+        return num_bytes
+
+    def read(self, endpoint, size_or_buffer, timeout=None):
+        num_bytes = size_or_buffer if isinstance(size_or_buffer, (int, long)) else len(size_or_buffer)
+        if self.packet_size:
+            # Like a real USB read, take whole packets until the request is filled or a short packet ends the transfer.
+            length = 0
+            while length < num_bytes and self._packet_lens:
+                packet_len = self._packet_lens[0]
+                if length + packet_len > num_bytes:
+                    raise XsMajorError('Simulated XESS board sent a %d-byte USB packet with only %d bytes left in the read.'
+                                       % (packet_len, num_bytes - length))
+                self._packet_lens.popleft()
+                length += packet_len
+                if packet_len < self.packet_size:
+                    break
+            else:
+                if length < num_bytes:
+                    # A real board would leave the host waiting until the USB transfer timed out.
+                    raise XsMajorError('Simulated XESS board has only %d of the %d bytes requested.'
+                                       % (length, num_bytes))
+            num_bytes = length
+        elif len(self._response) < num_bytes:
+            # A real board would leave the host waiting until the USB transfer timed out.
+            raise XsMajorError('Simulated XESS board has only %d of the %d bytes requested.'
+                               % (len(self._response), num_bytes))
+        self._delay(num_bytes)
+        self.num_reads += 1
+        self.bytes_in += num_bytes
+        data = self._response[:num_bytes]
+        del self._response[:num_bytes]
+        return read_result(size_or_buffer, data)
+
+    def _respond(self, data):
+        """Queue a response for the host as the USB packets the board sends it in."""
+
+        self._response += data
+        if self.packet_size:
+            # Each response is a separate transfer that ends with a short packet unless it fills the last one.
+            num_full, rest = divmod(len(data), self.packet_size)
+            self._packet_lens.extend([self.packet_size] * num_full)
+            if rest:
+                self._packet_lens.append(rest)
+
+    def get_info(self):
+        """Return the 32 bytes the board sends in response to INFO_CMD."""
+
+        info = bytearray(32)
+        info[0] = INFO_CMD
+        info[1:3] = bytearray([0xff, 0x8c])  # Product ID.
+        info[3:5] = bytearray(self.version)
+        desc = bytearray(self.description[:25])
+        info[5:5 + len(desc)] = desc
+        info[31] = -sum(info) & 0xff  # Checksum makes the bytes add up to zero.
+        return info
+
+    def _command_length(self):
+        """Return the length of the command at the start of the command bytes, or None if it's not all there."""
+
+        cmds = self._cmds
+        cmd = cmds[0]
+        if cmd in (INFO_CMD, RESET_CMD, AIO0_ADC_CMD, AIO1_ADC_CMD, ENABLE_RETURN_CMD, DISABLE_RETURN_CMD):
+            return 1
+        if cmd == PROG_CMD:
+            return 2
+        if cmd in (RUNTEST_CMD, READ_EEDATA_CMD):
+            return 5
+        if cmd == WRITE_EEDATA_CMD:
+            return 5 + cmds[1] if len(cmds) >= 2 else None
+        if cmd == JTAG_CMD:
+            if len(cmds) < 6:
+                return None
+            num_bits, flags = struct.unpack_from('<IB', buffer(cmds), 1)
+            num_bytes = (num_bits + 7) // 8
+            if flags & PUT_TMS_MASK and flags & PUT_TDI_MASK:
+                num_bytes *= 2
+            elif not flags & (PUT_TMS_MASK | PUT_TDI_MASK):
+                num_bytes = 0
+            return 6 + num_bytes
+        raise XsMajorError('Simulated XESS board does not support command 0x%02x.' % cmd)
+
+    def _process(self):
+        """Carry out all the complete commands that have been received."""
+
+        while self._cmds:
+            cmd_len = self._command_length()
+            if cmd_len is None or cmd_len > len(self._cmds):
+                return  # Wait for the rest of the command.
+            cmd = self._cmds[:cmd_len]
+            del self._cmds[:cmd_len]
+            self._do_command(cmd)
+
+    def _do_command(self, cmd):
+        """Carry out a single command."""
+
+        if cmd[0] == JTAG_CMD:
+            self._do_jtag(cmd)
+        elif cmd[0] == INFO_CMD:
+            self._respond(self.get_info())
+        elif cmd[0] == RUNTEST_CMD:
+            num_tcks = struct.unpack_from('<I', buffer(cmd), 1)[0]
+            self.fpga.clock(num_tcks, 0, 0)
+            if self.return_enabled:
+                self._respond(cmd)  # The command is echoed when the clocks are done.
+        elif cmd[0] == PROG_CMD:
+            self.prog = cmd[1]
+            if self.prog == 0:
+                self.fpga.clear()
+        elif cmd[0] == READ_EEDATA_CMD:
+            addr = cmd[2] | cmd[3] << 8 | cmd[4] << 16
+            self._respond(cmd + bytearray(self.eedata.get(addr + i, 0xff) for i in range(cmd[1])))
+        elif cmd[0] == WRITE_EEDATA_CMD:
+            addr = cmd[2] | cmd[3] << 8 | cmd[4] << 16
+            for i in range(cmd[1]):
+                self.eedata[addr + i] = cmd[5 + i]
+            if self.return_enabled:
+                self._respond(cmd[:1])
+        elif cmd[0] in (AIO0_ADC_CMD, AIO1_ADC_CMD):
+            volts = self.aio[cmd[0] - AIO0_ADC_CMD]
+            if callable(volts):
+                volts = volts()
+            count = min(max(int(round(volts / 2.048 * 1023)), 0), 1023)  # 10-bit ADC with a 2.048 V reference.
+            self._respond(bytearray([cmd[0], count >> 8, count & 0xff]))
+        elif cmd[0] in (ENABLE_RETURN_CMD, DISABLE_RETURN_CMD):
+            self.return_enabled = cmd[0] == ENABLE_RETURN_CMD
+        elif cmd[0] == RESET_CMD:
+            self.fpga.state = 'Test-Logic-Reset'
+            self.return_enabled = True
+
+    def _do_jtag(self, cmd):
+        """Carry out a JTAG_CMD."""
+
+        num_bits, flags = struct.unpack_from('<IB', buffer(cmd), 1)
+        payload = cmd[6:]
+        if flags & PUT_TMS_MASK and flags & PUT_TDI_MASK:
+            # The TMS and TDI bytes are interleaved.
+            tms_bytes, tdi_bytes = payload[0::2], payload[1::2]
+        elif flags & PUT_TMS_MASK:
+            tms_bytes, tdi_bytes = payload, None
+        elif flags & PUT_TDI_MASK:
+            tms_bytes, tdi_bytes = None, payload
+        else:
+            tms_bytes, tdi_bytes = None, None
+
+        if tms_bytes is None:
+            tms = 1 if flags & TMS_VAL_MASK else 0
+        else:
+            tms = [tms_bytes[i >> 3] >> (i & 7) & 1 for i in range(num_bits)]
+        if tdi_bytes is None:
+            tdi = 1 if flags & TDI_VAL_MASK else 0
+        else:
+            tdi = XsBitArray.from_usb(tdi_bytes, num_bits)
+
+        tdo = self.fpga.clock(num_bits, tms, tdi)
+        if flags & GET_TDO_MASK:
+            self._respond(tdo.to_usb())
+
+
+if __name__ == '__main__':
+    # Measure how long some common operations take over a simulated full-speed USB link.
+    import os
+    from xsusb import XsUsb
+    from xsjtag import XsJtag
+    from xsmemio import XsMemIo
+    from xsdutio import XsDutIo
+    from xilfpga import Xc3s200avq100
+
+    MEM_ID = 3
+    DUT_ID = 4
+    sim = XsSimBoard(modules={MEM_ID: XsSimMemory(24, 16), DUT_ID: XsSimDut(16, 8, lambda i: i.uint & 0xff)},
+                     latency=0.001, bandwidth=1.0e6)
+    xsjtag = XsJtag(XsUsb(transport=sim))
+
+    def timed(label, f):
+        with xsjtag.measure() as cost:
+            result = f()
+        print '%-24s %7.3f s (%.3f s host)  %4d writes %4d round trips %5d JTAG_CMDs  payload/overhead %s' % (
+            label, cost['elapsed'], cost['host_time'], cost['num_writes'], cost['round_trips'], cost['num_jtag_cmds'],
+            '%.1f' % cost['payload_ratio'] if cost['payload_ratio'] is not None else '-')
+        return result
+
+    fpga = Xc3s200avq100(xsjtag)
+    bitstream = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'xula', 'ramintfc_jtag_200.bit')
+    timed('Configure FPGA', lambda: fpga.configure(bitstream))
+    assert timed('Verify configuration', lambda: fpga.verify(bitstream)) is None
+    ram = XsMemIo(module_id=MEM_ID, xsjtag=xsjtag)
+    data = range(2**15)
+    timed('Write 32K words', lambda: ram.write(0, data))
+    assert timed('Read 32K words', lambda: list(ram.read(0, len(data), return_type=int()))) == data
+    dut = XsDutIo(module_id=DUT_ID, xsjtag=xsjtag)
+    timed('Execute DUT 100 times', lambda: [dut.execute(i) for i in range(100)])
@@ -94,6 +94,20 @@ class XsSpi:
             packet.append(self._memio.read(self._SINGLE_XFER_ADDR))
             return packet
 
+    def receive_into(self, buf, num_data=0, stop=True, offset=0):
+        """Receive a packet of data from the SPI slave into a bytearray starting at the offset."""
+
+        if num_data == 0:
+            if stop:
+                self.reset() # Reset the SPI interface to de-select the SPI device.
+            return
+
+        if not stop:
+            self._memio.read_into(self._MULTI_XFER_ADDR, buf, num_data, offset)
+        else:
+            self.receive_into(buf, num_data-1, stop=False, offset=offset)
+            buf[offset + num_data - 1] = self._memio.read(self._SINGLE_XFER_ADDR).uint
+
 if __name__ == '__main__':
     #logging.root.setLevel(logging.DEBUG)
     
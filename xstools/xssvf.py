@@ -0,0 +1,540 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# **********************************************************************
+#   This program is free software; you can redistribute it and/or
+#   modify it under the terms of the GNU General Public License
+#   as published by the Free Software Foundation; either version 2
+#   of the License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+#   02111-1307, USA.
+#
+#   (c)2012 - X Engineering Software Systems Corp. (www.xess.com)
+# **********************************************************************
+
+"""
+Player for SVF and XSVF files that drives the JTAG port of an XESS board.
+
+The files are read a statement at a time, so only the record being played
+is held in memory. The scans and runtests are queued in the deferred mode of
+XsJtag and sent to the board in large transfers, and the TDO bits they
+return are checked against the expected values after each transfer:
+
+    player = XsSvfPlayer(xsjtag)
+    report = player.play('design.svf')
+    print report['scan_bits_per_sec']
+"""
+
+import os
+import time
+import logging
+import binascii
+from xserror import *
+from xsbitarray import *
+from xsjtag import XsJtag
+from xslog import *
+
+_log = get_logger(__name__)
+
+# SVF names of the TAP states, in the same order as the XsJtag state IDs.
+_SVF_STATE_NAMES = (
+    'RESET', 'IDLE',
+    'DRSELECT', 'DRCAPTURE', 'DRSHIFT', 'DREXIT1', 'DRPAUSE', 'DREXIT2', 'DRUPDATE',
+    'IRSELECT', 'IRCAPTURE', 'IRSHIFT', 'IREXIT1', 'IRPAUSE', 'IREXIT2', 'IRUPDATE',
+    )
+_SVF_STATE_IDS = dict((name, id) for id, name in enumerate(_SVF_STATE_NAMES))
+
+# States where the TAP can wait between SVF statements.
+_STABLE_STATES = (XsJtag.TEST_LOGIC_RESET, XsJtag.RUN_TEST_IDLE, XsJtag.PAUSE_DR, XsJtag.PAUSE_IR)
+
+# Scans that start in a pause state leave it through the update state so the register gets captured again.
+_PAUSE_EXITS = {XsJtag.PAUSE_DR: XsJtag.UPDATE_DR, XsJtag.PAUSE_IR: XsJtag.UPDATE_IR}
+
+# XSVF command codes.
+XCOMPLETE = 0x00
+XTDOMASK = 0x01
+XSIR = 0x02
+XSDR = 0x03
+XRUNTEST = 0x04
+XREPEAT = 0x07
+XSDRSIZE = 0x08
+XSDRTDO = 0x09
+XSETSDRMASKS = 0x0a
+XSDRINC = 0x0b
+XSDRB = 0x0c
+XSDRC = 0x0d
+XSDRE = 0x0e
+XSDRTDOB = 0x0f
+XSDRTDOC = 0x10
+XSDRTDOE = 0x11
+XSTATE = 0x12
+XENDIR = 0x13
+XENDDR = 0x14
+XSIR2 = 0x15
+XCOMMENT = 0x16
+XWAIT = 0x17
+
+
+def _svf_statements(f):
+    """Return (line number, list of tokens) for each statement in an SVF file, reading it a line at a time."""
+
+    parts = []
+    start_line = None
+    for line_num, line in enumerate(f, 1):
+        # Strip the comments.
+        for comment in ('!', '//'):
+            i = line.find(comment)
+            if i >= 0:
+                line = line[:i]
+        pieces = line.split(';')
+        for i, piece in enumerate(pieces):
+            if piece.strip():
+                if start_line is None:
+                    start_line = line_num
+                parts.append(piece)
+            if i < len(pieces) - 1:
+                # A semicolon ends the statement.
+                if parts:
+                    yield start_line, ' '.join(parts).replace('(', ' ( ').replace(')', ' ) ').upper().split()
+                parts = []
+                start_line = None
+    if parts and ''.join(parts).strip():
+        raise XsMinorError('SVF statement starting at line %d has no terminating semicolon.' % start_line)
+
+
+class _SvfPattern:
+
+    """Length and the TDI, TDO, MASK and SMASK values of an SIR, SDR, HIR, HDR, TIR or TDR statement.
+
+    The values carry over to the next statement of the same kind if its length doesn't change.
+    The TDO value only carries over for the header and trailer statements (HIR, HDR, TIR, TDR)
+    since those apply to every scan that follows them.
+    """
+
+    def __init__(self):
+        self.length = 0
+        self.tdi = 0
+        self.tdo = None
+        self.mask = 0
+        self.smask = 0
+
+    def update(self, length, values, where):
+        """Update the pattern from the values in a statement and return its TDO value (or None if there isn't one)."""
+
+        if length != self.length:
+            # A new length resets the values (a TDI value has to be given again).
+            if length and 'TDI' not in values:
+                raise XsMinorError('%s changes the scan length without giving a TDI value.' % where)
+            self.length = length
+            self.tdi = 0
+            self.tdo = None
+            self.mask = (1 << length) - 1
+            self.smask = (1 << length) - 1
+        for field in ('TDI', 'TDO', 'MASK', 'SMASK'):
+            if field in values:
+                setattr(self, field.lower(), values[field])
+        return values.get('TDO')
+
+
+class XsSvfPlayer:
+
+    """Play SVF and XSVF files through an XsJtag object."""
+
+    _MAX_PENDING_BYTES = 1 << 20  # Size of the queued commands that triggers sending them to the board.
+
+    def __init__(self, xsjtag, max_pending_bytes=_MAX_PENDING_BYTES, tck_hz=None):
+        """Set up the player.
+
+        xsjtag = XsJtag object for the board.
+        max_pending_bytes = number of queued JTAG command bytes that are sent to the board at once.
+        tck_hz = TCK frequency used to turn waits into TCK pulses so they can be queued with
+                 the scans. If None, the queue is sent and the host sleeps for each wait.
+        """
+
+        self.xsjtag = xsjtag
+        self.max_pending_bytes = max_pending_bytes
+        self.tck_hz = tck_hz
+
+    def play(self, filename):
+        """Play an SVF or XSVF file (chosen by the file extension) and return a throughput report."""
+
+        if os.path.splitext(filename)[1].lower() == '.xsvf':
+            return self.play_xsvf(filename)
+        return self.play_svf(filename)
+
+    def _start(self, filename):
+        """Reset the player state and the statistics at the start of a file."""
+
+        self._filename = filename
+        self._pending_bytes = 0
+        self._checks = []  # (XsJtagFuture, expected TDO, TDO mask, where) for the queued scans.
+        self._start_time = time.time()
+        self.stats = {
+            'records': 0,
+            'scans': 0,
+            'scan_bits': 0,
+            'tdo_checks': 0,
+            'tdo_retries': 0,
+            'round_trips': 0,
+            'wait_time': 0.0,
+            }
+
+    def _finish(self):
+        """Send any queued commands, check their results, and return the throughput report."""
+
+        self._execute()
+        report = dict(self.stats)
+        elapsed = time.time() - self._start_time
+        report['elapsed'] = elapsed
+        report['scan_bits_per_sec'] = report['scan_bits'] / elapsed if elapsed > 0 else 0.0
+        report['records_per_sec'] = report['records'] / elapsed if elapsed > 0 else 0.0
+        _log.info('Played %s: %s', self._filename, report)
+        return report
+
+    def _execute(self):
+        """Send the queued commands to the board and compare the TDO bits they returned with the expected values."""
+
+        self.xsjtag.execute()
+        if self._pending_bytes:
+            self.stats['round_trips'] += 1
+        self._pending_bytes = 0
+        checks, self._checks = self._checks, []
+        for future, expected, mask, where in checks:
+            self._check_tdo(future.result().uint, expected, mask, where)
+
+    def _check_tdo(self, actual, expected, mask, where):
+        """Raise an error if the TDO bits of a scan don't match the expected bits where the mask is set."""
+
+        if (actual ^ expected) & mask:
+            raise XsMinorError('TDO mismatch in %s: expected 0x%x, got 0x%x (mask 0x%x).'
+                               % (where, expected & mask, actual & mask, mask))
+
+    def _queued(self, num_bytes):
+        """Count the bytes added to the queue and send it if it's grown too large."""
+
+        self._pending_bytes += num_bytes
+        if self._pending_bytes >= self.max_pending_bytes:
+            self._execute()
+
+    def _goto(self, state):
+        """Move the TAP to a state, always resetting the TAP if the state is test-logic-reset."""
+
+        if state == XsJtag.TEST_LOGIC_RESET:
+            self.xsjtag.reset_tap(force=True)
+        else:
+            self.xsjtag.goto_state(state)
+
+    def _scan(self, shift_state, length, tdi, expected, mask, where, exit_state=None):
+        """Shift bits through the IR or DR and queue a check of the TDO bits that come back.
+
+        tdi, expected and mask are integers with the first bit shifted in their least-significant bit.
+        exit_state = stable state to go to after the scan, or None to stay in the shift state.
+        """
+
+        state = self.xsjtag.get_tap_state_id()
+        if state != shift_state:
+            if state in _PAUSE_EXITS:
+                self.xsjtag.goto_state(_PAUSE_EXITS[state])
+            self.xsjtag.goto_state(shift_state)
+        if length:
+            bits = XsBitArray(uint=tdi, length=length)
+            if expected is None or not mask:
+                self.xsjtag.shift_tdi(bits, do_exit_shift=exit_state is not None)
+            else:
+                future = self.xsjtag.shift_tdo(length, do_exit_shift=exit_state is not None, tdi=bits)
+                self._checks.append((future, expected, mask, where))
+                self.stats['tdo_checks'] += 1
+            self.stats['scans'] += 1
+            self.stats['scan_bits'] += length
+        if exit_state is not None:
+            self._goto(exit_state)
+        self._queued(2 * ((length + 7) // 8))
+
+    def _scan_with_retries(self, length, tdi, expected, mask, where, exit_state, run_time, repeat):
+        """Do an XSVF DR scan, checking its TDO bits right away and shifting it again up to repeat times until they match.
+
+        As in the XSVF players from Xilinx, a failed scan is shifted again from pause-DR without
+        capturing the DR, and the wait after the scan grows by 25% with each retry.
+        """
+
+        # The TDO bits decide what comes next, so send everything that's queued and then the scan by itself.
+        self._execute()
+        bits = XsBitArray(uint=tdi, length=length)
+        state = self.xsjtag.get_tap_state_id()
+        if state in _PAUSE_EXITS:
+            self.xsjtag.goto_state(_PAUSE_EXITS[state])
+        for attempt in range(repeat + 1):
+            self.xsjtag.goto_state(XsJtag.SHIFT_DR)
+            future = self.xsjtag.shift_tdo(length, do_exit_shift=True, tdi=bits)
+            self.xsjtag.execute()
+            self.stats['round_trips'] += 1
+            actual = future.result().uint
+            if not (actual ^ expected) & mask or attempt == repeat:
+                break
+            self.stats['tdo_retries'] += 1
+            self.xsjtag.goto_state(XsJtag.PAUSE_DR)
+            run_time += run_time / 4
+        self._check_tdo(actual, expected, mask, where)
+        self.stats['scans'] += 1
+        self.stats['scan_bits'] += length
+        self.stats['tdo_checks'] += 1
+        self._goto(exit_state)
+        self._wait(run_time)
+
+    def _wait(self, seconds):
+        """Wait for a given time in the current TAP state."""
+
+        if seconds <= 0:
+            return
+        if self.tck_hz and self.xsjtag.get_tap_state_id() != XsJtag.TEST_LOGIC_RESET:
+            # Wait by pulsing TCK so the wait can be queued along with everything else.
+            self.xsjtag.runtest(int(seconds * self.tck_hz + 0.5))
+            self._queued(5)
+        else:
+            # Get everything queued so far done and then wait.
+            self._execute()
+            time.sleep(seconds)
+            self.stats['wait_time'] += seconds
+
+    def _svf_state(self, name, where, stable=False):
+        """Return the XsJtag ID for an SVF state name (which has to be a stable state if stable is True)."""
+
+        try:
+            state = _SVF_STATE_IDS[name]
+        except KeyError:
+            raise XsMinorError('%s has an unknown TAP state %s.' % (where, name))
+        if stable and state not in _STABLE_STATES:
+            raise XsMinorError('%s: %s is not a stable TAP state.' % (where, name))
+        return state
+
+    def play_svf(self, filename):
+        """Play an SVF file and return a throughput report."""
+
+        self._start(filename)
+        patterns = dict((cmd, _SvfPattern()) for cmd in ('SIR', 'SDR', 'HIR', 'HDR', 'TIR', 'TDR'))
+        end_ir = end_dr = XsJtag.RUN_TEST_IDLE
+        run_state = run_end_state = XsJtag.RUN_TEST_IDLE
+        try:
+            f = open(filename, 'r')
+        except (IOError, OSError) as e:
+            raise XsMinorError('Unable to open SVF file %s: %s' % (filename, e))
+        with f:
+            self.xsjtag.start_deferred()
+            try:
+                for line_num, tokens in _svf_statements(f):
+                    cmd, args = tokens[0], tokens[1:]
+                    where = '%s at line %d of %s' % (cmd, line_num, filename)
+                    self.stats['records'] += 1
+
+                    if cmd in patterns:
+                        # Get the length and any (TDI/TDO/MASK/SMASK value) fields of the statement.
+                        try:
+                            length = int(args[0])
+                            values = {}
+                            i = 1
+                            while i < len(args):
+                                assert args[i + 1] == '('
+                                close = args.index(')', i + 2)
+                                values[args[i]] = int(''.join(args[i + 2:close]), 16)
+                                i = close + 1
+                        except (IndexError, ValueError, AssertionError):
+                            raise XsMinorError('%s is not a valid statement.' % where)
+                        tdo = patterns[cmd].update(length, values, where)
+                        if cmd not in ('SIR', 'SDR'):
+                            continue  # The header and trailer patterns get used by the next scan.
+
+                        # Put the header, body and trailer of the scan together, header first.
+                        head, body, tail = [patterns[k + cmd[1:]] for k in ('H', 'S', 'T')]
+                        tdi = head.tdi | body.tdi << head.length | tail.tdi << head.length + body.length
+                        # Check the TDO bits of each part that has a TDO value.
+                        expected, mask = 0, 0
+                        for pattern, part_tdo, offset in ((head, head.tdo, 0), (body, tdo, head.length),
+                                                          (tail, tail.tdo, head.length + body.length)):
+                            if part_tdo is not None:
+                                expected |= part_tdo << offset
+                                mask |= pattern.mask << offset
+                        if not mask:
+                            expected = None
+                        total = head.length + body.length + tail.length
+                        if cmd == 'SIR':
+                            self._scan(XsJtag.SHIFT_IR, total, tdi, expected, mask, where, end_ir)
+                        else:
+                            self._scan(XsJtag.SHIFT_DR, total, tdi, expected, mask, where, end_dr)
+
+                    elif cmd == 'RUNTEST':
+                        # RUNTEST [run_state] [run_count TCK|SCK] [min_time SEC [MAXIMUM max_time SEC]] [ENDSTATE end_state]
+                        if args and args[0] in _SVF_STATE_IDS:
+                            run_state = run_end_state = self._svf_state(args.pop(0), where, stable=True)
+                        num_tcks = 0
+                        min_time = 0.0
+                        try:
+                            while args:
+                                if args[0] == 'ENDSTATE':
+                                    run_end_state = self._svf_state(args[1], where, stable=True)
+                                    args = args[2:]
+                                elif args[0] == 'MAXIMUM':
+                                    args = args[3:]  # The player never waits too long, so the maximum can be ignored.
+                                elif args[1] == 'TCK':
+                                    num_tcks = int(float(args[0]))
+                                    args = args[2:]
+                                elif args[1] == 'SCK':
+                                    args = args[2:]  # The board has no system clock to pulse.
+                                elif args[1] == 'SEC':
+                                    min_time = float(args[0])
+                                    args = args[2:]
+                                else:
+                                    raise ValueError
+                        except (IndexError, ValueError):
+                            raise XsMinorError('%s is not a valid statement.' % where)
+                        self._goto(run_state)
+                        if num_tcks and run_state != XsJtag.TEST_LOGIC_RESET:
+                            self.xsjtag.runtest(num_tcks)
+                            self._queued(5)
+                            if self.tck_hz:
+                                min_time -= num_tcks / float(self.tck_hz)  # The TCK pulses already took up some of the time.
+                        self._wait(min_time)
+                        self._goto(run_end_state)
+
+                    elif cmd == 'STATE':
+                        # Go through the listed states in order.
+                        for name in args:
+                            self._goto(self._svf_state(name, where))
+
+                    elif cmd == 'ENDIR':
+                        end_ir = self._svf_state(args[0], where, stable=True)
+                    elif cmd == 'ENDDR':
+                        end_dr = self._svf_state(args[0], where, stable=True)
+                    elif cmd in ('FREQUENCY', 'TRST'):
+                        _log.debug('Ignoring %s (the board sets its own TCK rate and has no TRST pin).', where)
+                    else:
+                        raise XsMinorError('%s is not supported.' % where)
+                return self._finish()
+            finally:
+                self.xsjtag.stop_deferred()
+
+    def play_xsvf(self, filename):
+        """Play an XSVF file and return a throughput report.
+
+        The TDO checks are made after the queued scans come back from the board,
+        except when XREPEAT allows retries of failed checks. Then each XSDR or
+        XSDRTDO scan with a TDO check is sent by itself and retried until it passes.
+        """
+
+        self._start(filename)
+        try:
+            f = open(filename, 'rb')
+        except (IOError, OSError) as e:
+            raise XsMinorError('Unable to open XSVF file %s: %s' % (filename, e))
+
+        def read_bytes(num_bytes):
+            data = f.read(num_bytes)
+            if len(data) != num_bytes:
+                raise XsMinorError('XSVF file %s ends in the middle of a command.' % filename)
+            return data
+
+        def read_value(num_bits):
+            # The values are stored with their most-significant byte first.
+            data = read_bytes((num_bits + 7) // 8)
+            return int(binascii.hexlify(data), 16) if data else 0
+
+        def read_uint(num_bytes):
+            return read_value(8 * num_bytes)
+
+        sdr_size = 0
+        tdo_mask = 0
+        tdo_expected = None
+        repeat = 0  # Number of times a scan is retried if its TDO check fails.
+        run_time = 0.0  # Seconds to wait in run-test/idle after each scan.
+        end_ir = end_dr = XsJtag.RUN_TEST_IDLE
+        with f:
+            self.xsjtag.start_deferred()
+            try:
+                while True:
+                    cmd = f.read(1)
+                    if cmd == '':
+                        break  # Some files just end without an XCOMPLETE.
+                    cmd = ord(cmd)
+                    where = 'XSVF command 0x%02x at byte %d of %s' % (cmd, f.tell() - 1, filename)
+                    self.stats['records'] += 1
+                    if cmd == XCOMPLETE:
+                        break
+                    elif cmd == XTDOMASK:
+                        tdo_mask = read_value(sdr_size)
+                    elif cmd in (XSIR, XSIR2):
+                        length = read_uint(1 if cmd == XSIR else 2)
+                        tdi = read_value(length)
+                        self._scan(XsJtag.SHIFT_IR, length, tdi, None, 0, where,
+                                   XsJtag.RUN_TEST_IDLE if run_time else end_ir)
+                        self._wait(run_time)
+                    elif cmd in (XSDR, XSDRTDO):
+                        tdi = read_value(sdr_size)
+                        if cmd == XSDRTDO:
+                            tdo_expected = read_value(sdr_size)
+                        exit_state = XsJtag.RUN_TEST_IDLE if run_time else end_dr
+                        if repeat and sdr_size and tdo_expected is not None and tdo_mask:
+                            self._scan_with_retries(sdr_size, tdi, tdo_expected, tdo_mask, where,
+                                                    exit_state, run_time, repeat)
+                        else:
+                            self._scan(XsJtag.SHIFT_DR, sdr_size, tdi, tdo_expected, tdo_mask, where, exit_state)
+                            self._wait(run_time)
+                    elif cmd in (XSDRB, XSDRC, XSDRE, XSDRTDOB, XSDRTDOC, XSDRTDOE):
+                        # Pieces of a long DR scan: begin, continue and end.
+                        tdi = read_value(sdr_size)
+                        expected = read_value(sdr_size) if cmd >= XSDRTDOB else None
+                        is_end = cmd in (XSDRE, XSDRTDOE)
+                        self._scan(XsJtag.SHIFT_DR, sdr_size, tdi, expected, tdo_mask, where,
+                                   end_dr if is_end else None)
+                    elif cmd == XRUNTEST:
+                        run_time = read_uint(4) * 1.0e-6
+                    elif cmd == XREPEAT:
+                        repeat = read_uint(1)
+                    elif cmd == XSDRSIZE:
+                        sdr_size = read_uint(4)
+                    elif cmd == XSTATE:
+                        state = read_uint(1)
+                        if state >= len(_SVF_STATE_NAMES):
+                            raise XsMinorError('%s has an unknown TAP state %d.' % (where, state))
+                        self._goto(state)
+                    elif cmd == XENDIR:
+                        end_ir = (XsJtag.RUN_TEST_IDLE, XsJtag.PAUSE_IR)[read_uint(1) & 1]
+                    elif cmd == XENDDR:
+                        end_dr = (XsJtag.RUN_TEST_IDLE, XsJtag.PAUSE_DR)[read_uint(1) & 1]
+                    elif cmd == XCOMMENT:
+                        comment = []
+                        while True:
+                            c = read_bytes(1)
+                            if c == '\0':
+                                break
+                            comment.append(c)
+                        _log.debug('XSVF comment: %s', ''.join(comment))
+                    elif cmd == XWAIT:
+                        wait_state, end_state = read_uint(1), read_uint(1)
+                        seconds = read_uint(4) * 1.0e-6
+                        self._goto(wait_state)
+                        self._wait(seconds)
+                        self._goto(end_state)
+                    else:
+                        raise XsMinorError('%s is not supported.' % where)
+                return self._finish()
+            finally:
+                self.xsjtag.stop_deferred()
+
+
+if __name__ == '__main__':
+    import sys
+    from xsusb import XsUsb
+
+    # Play each SVF/XSVF file named on the command line and print its throughput report.
+    player = XsSvfPlayer(XsJtag(XsUsb()))
+    for filename in sys.argv[1:]:
+        report = player.play(filename)
+        print '%s: %d records, %d scans, %d scan bits in %.3f s (%.0f bits/s), %d round trips, %d TDO checks' % (
+            filename, report['records'], report['scans'], report['scan_bits'], report['elapsed'],
+            report['scan_bits_per_sec'], report['round_trips'], report['tdo_checks'])
@@ -42,6 +42,7 @@ import os
 import string
 from argparse import ArgumentParser
 import xsboard as XSBOARD
+import xshotplug as XSHOTPLUG
 import xserror as XSERROR
 from __init__ import __version__
 
@@ -83,38 +84,41 @@ def xstest():
             
         args = p.parse_args()
 
-        while (True):
-            num_boards = XSBOARD.XsUsb.get_num_xsusb()
-            if num_boards > 0:
-                xs_board = XSBOARD.XsBoard.get_xsboard(args.usb, args.board)
-                try:
-                    xs_board.do_self_test()
-                except XSERROR.XsError as e:
+        # Watch for boards being plugged in and pulled out.
+        with XSHOTPLUG.XsHotplug() as hotplug:
+            while (True):
+                num_boards = XSBOARD.XsUsb.get_num_xsusb()
+                if num_boards > 0:
+                    xs_board = XSBOARD.XsBoard.get_xsboard(args.usb, args.board)
                     try:
-                        winsound.MessageBeep(winsound.MB_ICONEXCLAMATION)
+                        xs_board.do_self_test()
+                    except XSERROR.XsError as e:
+                        try:
+                            winsound.MessageBeep(winsound.MB_ICONEXCLAMATION)
+                        except:
+                            pass
+                        if args.multiple:
+                            xs_board.xsusb.disconnect()
+                            hotplug.wait_for_disconnect()
+                            continue
+                        else:
+                            sys.exit(FAILURE)
+                    print "Success:", xs_board.name, "passed diagnostic test!"
+                    try:
+                        winsound.MessageBeep()
                     except:
                         pass
                     if args.multiple:
                         xs_board.xsusb.disconnect()
-                        while XSBOARD.XsUsb.get_num_xsusb() != 0:
-                            pass
+                        hotplug.wait_for_disconnect()
                         continue
                     else:
-                        sys.exit(FAILURE)
-                print "Success:", xs_board.name, "passed diagnostic test!"
-                try:
-                    winsound.MessageBeep()
-                except:
-                    pass
-                if args.multiple:
-                    xs_board.xsusb.disconnect()
-                    while XSBOARD.XsUsb.get_num_xsusb() != 0:
-                        pass
-                    continue
+                        sys.exit(SUCCESS)
+                elif not args.multiple:
+                    XSERROR.XsFatalError("No XESS Boards found!")
                 else:
-                    sys.exit(SUCCESS)
-            elif not args.multiple:
-                XSERROR.XsFatalError("No XESS Boards found!")
+                    # Sleep until the next board is plugged in.
+                    hotplug.wait_for_connect(known=())
 
     except SystemExit as e:
         os._exit(SUCCESS)
@@ -0,0 +1,246 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# **********************************************************************
+#   This program is free software; you can redistribute it and/or
+#   modify it under the terms of the GNU General Public License
+#   as published by the Free Software Foundation; either version 2
+#   of the License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+#   02111-1307, USA.
+#
+#   (c)2012 - X Engineering Software Systems Corp. (www.xess.com)
+# **********************************************************************
+
+"""
+Transports that carry the bulk transfers between XsUsb and an XESS board.
+
+A transport has the same write() and read() methods as a pyusb device, so
+XsUsb uses the pyusb device of the board directly unless it's been given
+some other transport. The ones here let the USB traffic of a session be
+recorded to a file and then played back later without a board:
+
+    xsusb.record('session.xsrec')
+    ... use the board ...
+    xsusb.stop_recording()
+
+    xsusb = XsUsb(transport=XsReplay('session.xsrec', time_scale=0))
+    ... do the same things again ...
+"""
+
+import time
+import array
+import struct
+import logging
+from xserror import *
+from xslog import *
+
+_log = get_logger(__name__)
+
+# Recording file layout: the header and then a record for each transfer, each
+# followed by the bytes that were transferred.
+_FILE_MAGIC = 'XSUSBREC'
+_FILE_VERSION = 1
+_HEADER_FORMAT = '<8sB'  # Magic string, file version.
+_RECORD_FORMAT = '<BBdfI'  # Direction, endpoint, start time, duration (seconds), number of bytes.
+_HEADER_LEN = struct.calcsize(_HEADER_FORMAT)
+_RECORD_LEN = struct.calcsize(_RECORD_FORMAT)
+
+OUT = 0  # Record of a transfer from the host to the board.
+IN = 1  # Record of a transfer from the board to the host.
+
+
+class XsTransport:
+
+    """Interface for objects that carry USB transfers for XsUsb."""
+
+    def write(self, endpoint, data, timeout=None):
+        """Send the data to an OUT endpoint and return the number of bytes sent."""
+
+        raise NotImplementedError
+
+    def read(self, endpoint, size_or_buffer, timeout=None):
+        """Receive data from an IN endpoint.
+
+        size_or_buffer = number of bytes to receive, or a byte array.array to fill.
+        Returns an array with the bytes received, or the number of bytes stored in the buffer.
+        """
+
+        raise NotImplementedError
+
+    def close(self):
+        """Stop using the transport."""
+
+        pass
+
+
+def read_result(size_or_buffer, data):
+    """Return the data the way a pyusb read would for the size_or_buffer argument."""
+
+    if isinstance(size_or_buffer, array.array):
+        n = min(len(size_or_buffer), len(data))
+        size_or_buffer[:n] = array.array('B', data[:n])
+        return n
+    return array.array('B', data)
+
+
+def read_recording(filename):
+    """Return a list of (direction, endpoint, start, duration, bytearray) tuples for the transfers in a recording."""
+
+    try:
+        with open(filename, 'rb') as f:
+            contents = f.read()
+    except (IOError, OSError) as e:
+        raise XsMinorError('Unable to read USB recording %s: %s' % (filename, e))
+    if len(contents) < _HEADER_LEN:
+        raise XsMinorError('%s is not a USB recording.' % filename)
+    magic, version = struct.unpack_from(_HEADER_FORMAT, contents)
+    if magic != _FILE_MAGIC:
+        raise XsMinorError('%s is not a USB recording.' % filename)
+    if version != _FILE_VERSION:
+        raise XsMinorError('USB recording %s has unknown version %d.' % (filename, version))
+
+    records = []
+    pos = _HEADER_LEN
+    while pos < len(contents):
+        if pos + _RECORD_LEN > len(contents):
+            raise XsMinorError('USB recording %s is truncated.' % filename)
+        direction, endpoint, start, duration, num_bytes = struct.unpack_from(_RECORD_FORMAT, contents, pos)
+        pos += _RECORD_LEN
+        data = bytearray(buffer(contents, pos, num_bytes))
+        if len(data) != num_bytes:
+            raise XsMinorError('USB recording %s is truncated.' % filename)
+        pos += num_bytes
+        records.append((direction, endpoint, start, duration, data))
+    return records
+
+
+class XsRecorder(XsTransport):
+
+    """Transport that passes transfers on to another transport and records them in a file."""
+
+    def __init__(self, transport, filename):
+        """Start recording.
+
+        transport = transport (or pyusb device) that does the actual transfers.
+        filename = file that receives the recording.
+        """
+
+        self.transport = transport
+        self.filename = filename
+        try:
+            self._file = open(filename, 'wb')
+        except (IOError, OSError) as e:
+            raise XsMinorError('Unable to create USB recording %s: %s' % (filename, e))
+        self._file.write(struct.pack(_HEADER_FORMAT, _FILE_MAGIC, _FILE_VERSION))
+        self._start_time = time.time()
+        self.num_records = 0
+
+    def _record(self, direction, endpoint, start, data):
+        """Add a transfer to the recording."""
+
+        duration = time.time() - start
+        self._file.write(struct.pack(_RECORD_FORMAT, direction, endpoint & 0x7f,
+                                     start - self._start_time, duration, len(data)))
+        self._file.write(data)
+        self.num_records += 1
+
+    def write(self, endpoint, data, timeout=None):
+        start = time.time()
+        num_bytes = self.transport.write(endpoint, data, timeout=timeout)
+        self._record(OUT, endpoint, start, buffer(data, 0, num_bytes))
+        return num_bytes
+
+    def read(self, endpoint, size_or_buffer, timeout=None):
+        start = time.time()
+        result = self.transport.read(endpoint, size_or_buffer, timeout=timeout)
+        if isinstance(size_or_buffer, array.array):
+            data = buffer(size_or_buffer, 0, result)
+        else:
+            data = result
+        self._record(IN, endpoint, start, data)
+        return result
+
+    def close(self):
+        """Finish the recording. The transport that was being recorded is left open."""
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            _log.debug('Recorded %d USB transfers in %s.', self.num_records, self.filename)
+
+
+class XsReplay(XsTransport):
+
+    """Transport that plays back the transfers in a recording instead of talking to a board."""
+
+    def __init__(self, filename, time_scale=1.0, check_writes=True):
+        """Load a recording for playback.
+
+        time_scale = multiplier for the recorded transfer times (0 to replay as fast as possible).
+        check_writes = False to only check the length of each write instead of its contents.
+        """
+
+        self.filename = filename
+        self.time_scale = time_scale
+        self.check_writes = check_writes
+        self._records = read_recording(filename)
+        self._index = 0
+
+    def _next_record(self, direction, endpoint):
+        """Return the next transfer in the recording after making sure it goes the right way."""
+
+        if self._index >= len(self._records):
+            raise XsMajorError('USB replay of %s ran past the end of the recording.' % self.filename)
+        record = self._records[self._index]
+        if record[0] != direction or record[1] != endpoint & 0x7f:
+            raise XsMajorError('USB replay of %s diverged at transfer %d: expected %s on endpoint %d.'
+                               % (self.filename, self._index, ('an OUT', 'an IN')[record[0]], record[1]))
+        self._index += 1
+        if self.time_scale:
+            time.sleep(record[3] * self.time_scale)
+        return record
+
+    def write(self, endpoint, data, timeout=None):
+        recorded = self._next_record(OUT, endpoint)[4]
+        if len(data) != len(recorded) or (self.check_writes and bytearray(data) != recorded):
+            raise XsMajorError('USB replay of %s diverged at transfer %d: wrote %s instead of %s.'
+                               % (self.filename, self._index - 1, HexTrace(data), HexTrace(recorded)))
+        return len(data)
+
+    def read(self, endpoint, size_or_buffer, timeout=None):
+        recorded = self._next_record(IN, endpoint)[4]
+        return read_result(size_or_buffer, recorded)
+
+    def is_finished(self):
+        """Return True if every transfer in the recording has been played back."""
+
+        return self._index >= len(self._records)
+
+    def rewind(self):
+        """Start playing the recording again from the beginning."""
+
+        self._index = 0
+
+
+if __name__ == '__main__':
+    import sys
+
+    # Print a summary of each recording named on the command line.
+    for filename in sys.argv[1:]:
+        records = read_recording(filename)
+        num_bytes = [0, 0]
+        busy = 0.0
+        for direction, endpoint, start, duration, data in records:
+            num_bytes[direction] += len(data)
+            busy += duration
+        elapsed = records[-1][2] + records[-1][3] if records else 0.0
+        print '%s: %d transfers, %d bytes out, %d bytes in, %.3f s total, %.3f s in transfers' % (
+            filename, len(records), num_bytes[OUT], num_bytes[IN], elapsed, busy)
@@ -29,9 +29,84 @@ import sys
 import os
 import math
 import struct
-import usb.core
-import usb.util
+import json
+import threading
+import Queue
+import array
+import functools
+from contextlib import contextmanager
 from xserror import *
+from xslog import *
+from xshotplug import XsHotplug
+from xstransport import XsRecorder
+from xsbackend import get_backend, ENDPOINT_IN, ENDPOINT_OUT
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_log = get_logger(__name__)
+
+
+def stats_delta(before, after):
+    """Return what an operation cost from stats() snapshots taken before and after it.
+    
+    Along with the change in each counter, the result has:
+        elapsed = seconds the operation took.
+        round_trips = number of reads (each one waits for the board to respond).
+        host_time = seconds not spent blocked in USB transfers.
+    For XsJtag snapshots, it also has the payload bytes (TDI and TDO bits), the other
+    bytes moved over USB (command headers, TMS bits, echoes, padding), and their ratio.
+    """
+
+    delta = dict((name, after[name] - before[name]) for name in after)
+    delta['elapsed'] = delta.pop('time')
+    delta['round_trips'] = delta['num_reads']
+    delta['host_time'] = max(delta['elapsed'] - delta['usb_time'], 0.0)
+    if 'num_tdi_bits' in delta:
+        payload = (delta['num_tdi_bits'] + delta['num_tdo_bits']) / 8.0
+        overhead = delta['bytes_out'] + delta['bytes_in'] - payload
+        delta['payload_bytes'] = payload
+        delta['overhead_bytes'] = overhead
+        delta['payload_ratio'] = payload / overhead if overhead > 0 else None
+    return delta
+
+
+class XsUsbFuture:
+
+    """Result of a USB transfer submitted to the XsUsb I/O thread."""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._exception = None
+
+    def _set(self, result=None, exception=None):
+        self._result = result
+        self._exception = exception
+        self._done.set()
+
+    def done(self):
+        """Return True if the transfer has completed (successfully or not)."""
+
+        return self._done.is_set()
+
+    def exception(self, timeout=None):
+        """Wait for the transfer to complete and return the exception it raised (or None)."""
+
+        if not self._done.wait(timeout):
+            raise XsMinorError('USB transfer did not complete within %s seconds.' % timeout)
+        return self._exception
+
+    def result(self, timeout=None):
+        """Wait for the transfer to complete and return its result (the bytes for a read)."""
+
+        exception = self.exception(timeout)
+        if exception is not None:
+            raise exception
+        return self._result
+
 
 class XsUsb:
 
@@ -42,6 +117,47 @@ class XsUsb:
     _DEFAULT_ENDPOINT = 0x01
     _BIT_RATE = 1.0e6 # USB bit-rate of 1 Mbps.
     _MIN_TIME_OUT = 500 # Smallest timeout for USB read or write operation.
+    _QUEUE_DEPTH = 8 # Default number of transfers that can be waiting in queued mode.
+    _BATCH_SIZE = 4096 # Default size limit for writes coalesced in batch mode.
+    _TIME_OUT_MARGIN = 4 # Timeouts from a link profile allow this many times the expected transfer time.
+    _CALIBRATION_SIZES = (64, 256, 1024, 4096, 16384, 65536, 262144) # Transfer sizes measured by calibrate().
+    _PROFILE_FILE = os.path.join(os.path.expanduser('~'), '.xstools', 'link_profiles.json')
+    _ADC_BATCH_SIZE = 64 # Default number of ADC conversions requested by each USB transfer.
+    _ADC_VOLTS_PER_COUNT = 2.048 / 1023.0 # Scale factor for the 10-bit ADC readings.
+
+    link_profile = None # Measured latency, throughput and chunk size for the link (see calibrate()).
+    prog_count = 0 # Number of times the FPGA has been reprogrammed or reset through this link.
+    tap_reset_count = 0 # Number of times the JTAG TAP was reset by this object instead of an XsJtag object.
+    last_used = 0.0 # time.time() when the last USB transfer finished (tells XsSessionPool the link is in use).
+
+    # Queued-mode state. The I/O thread only exists while queued mode is active.
+    _io_thread = None
+    _io_queue = None
+    _io_error = None
+
+    # Batch-mode state. Writes are gathered here while batch mode is active.
+    _batch = None
+    _batch_size = _BATCH_SIZE
+
+    # Receive buffer reused by read_into() when the caller's buffer can't be handed to pyusb.
+    _rx_buf = None
+
+    # False while the board has been told not to echo commands (see disable_return()).
+    _return_enabled = True
+
+    # Transfer counters and the seconds spent blocked in USB transfers (see stats()).
+    num_writes = 0
+    num_reads = 0
+    bytes_out = 0
+    bytes_in = 0
+    usb_time = 0.0
+    _STAT_NAMES = ('num_writes', 'num_reads', 'bytes_out', 'bytes_in', 'usb_time')
+
+    # Transport for the USB transfers (see xstransport). If None, they go to the device through the backend.
+    _transport = None
+
+    # Backend that finds the boards and opens transports to them (see xsbackend). Shared by all XsUsb objects.
+    _backend = None
 
     #  Commands understood by XESS FPGA boards.
     READ_VERSION_CMD = 0x00  # Read the product version information.
@@ -95,6 +211,11 @@ class XsUsb:
     
     # This array will store the currently-active XESS USB devices.
     _xsusb_devs = []
+    # Registry of the active devices and their positions in _xsusb_devs, keyed by (bus, port path, address).
+    _xsusb_registry = {}
+    _xsusb_index = {}
+    _PORTS_TTL = 0.5 # Seconds that a scan of the USB ports is reused before scanning again.
+    _ports_scan_time = None # When the USB ports were last scanned.
     # This array stores discarded USB devices so their __del__ method doesn't kick in.
     _usb_discard_pile = []
 
@@ -136,31 +257,63 @@ class XsUsb:
     def _IOW(type, nr, size): return _IOC(_IOC_WRITE, type, nr, size)
     def _IOWR(type, nr, size): return _IOC(_IOC_READ | _IOC_WRITE, type, nr, size)
 
+    @staticmethod
+    def _dev_key(dev):
+        """Return the registry key that identifies a USB device: (bus, port path, address)."""
+
+        return (dev.bus, tuple(getattr(dev, 'port_numbers', None) or ()), dev.address)
+
     @classmethod
-    def get_xsusb_ports(cls):
-        """Return the device descriptors for all XESS boards attached to USB ports."""
+    def get_backend(cls):
+        """Return the USB backend, picking it with the XSTOOLS_USB_BACKEND environment variable if none has been set."""
+
+        if XsUsb._backend is None:
+            XsUsb._backend = get_backend()
+        return XsUsb._backend
+
+    @classmethod
+    def set_backend(cls, backend):
+        """Use a USB backend (a backend object or a name like 'pyusb', 'libusb1' or 'sim') for the boards found from now on."""
+
+        if isinstance(backend, basestring):
+            backend = get_backend(backend)
+        XsUsb._backend = backend
+        # Devices found by the old backend are meaningless to the new one.
+        XsUsb._xsusb_devs = []
+        XsUsb._xsusb_registry = {}
+        XsUsb._xsusb_index = {}
+        XsUsb._ports_scan_time = None
+
+    @classmethod
+    def invalidate_ports(cls):
+        """Make the next call to get_xsusb_ports() scan the USB ports again."""
+
+        cls._ports_scan_time = None
+
+    @classmethod
+    def get_xsusb_ports(cls, max_age=None):
+        """Return the device descriptors for all XESS boards attached to USB ports.
+        
+        max_age = seconds that an earlier scan of the USB ports can be reused (default is _PORTS_TTL).
+        """
+
+        if max_age is None:
+            max_age = cls._PORTS_TTL
+        if cls._ports_scan_time is not None and time.time() - cls._ports_scan_time < max_age:
+            return cls._xsusb_devs
 
         # Get the currently-active XESS USB devices.
-        # The find() routine throws exceptions under linux when XESS boards are
-        # connected/reconnected, so catch the exceptions.
-        while(True):
-            try:
-                devs = list(usb.core.find(idVendor=cls._VENDOR_ID,
-                                          idProduct=cls._PRODUCT_ID, find_all=True))
-                break # Exit the loop once find() completes without an exception.
-            except usb.core.USBError:
-                pass # Keep trying until no exceptions occur.
-            
-        # Compare them to the previous set of active XESS USB devices.
-        for i in range(len(devs)):
-            for d in cls._xsusb_devs:
-                if devs[i].bus == d.bus and devs[i].address == d.address:
-                    # Re-use a previously-assigned XESS USB device instead of the new device
-                    # so that multiple devices can share the USB link to a single XESS board.
-                    devs[i] = d
+        devs = cls.get_backend().enumerate(cls._VENDOR_ID, cls._PRODUCT_ID)
+
+        # Re-use a previously-assigned XESS USB device instead of the new device
+        # so that multiple devices can share the USB link to a single XESS board.
+        devs = [cls._xsusb_registry.get(cls._dev_key(d), d) for d in devs]
                     
-        # Update the array of currently-active XESS USB devices.
+        # Update the array and registry of currently-active XESS USB devices.
         cls._xsusb_devs = devs
+        cls._xsusb_registry = dict((cls._dev_key(d), d) for d in devs)
+        cls._xsusb_index = dict((cls._dev_key(d), i) for i, d in enumerate(devs))
+        cls._ports_scan_time = time.time()
         return cls._xsusb_devs
 
     @classmethod
@@ -168,21 +321,56 @@ class XsUsb:
         """Return the number of XESS boards attached to USB ports."""
 
         return len(cls.get_xsusb_ports())
+
+    @classmethod
+    def get_port_key(cls, xsusb_id):
+        """Return the registry key of the board on a USB port, or None if there's no board there."""
+
+        devs = cls.get_xsusb_ports()
+        if len(devs) <= xsusb_id:
+            # The board might have been plugged in since the last scan, so look again.
+            devs = cls.get_xsusb_ports(max_age=0)
+        if len(devs) <= xsusb_id:
+            return None
+        return cls._dev_key(devs[xsusb_id])
+
+    @classmethod
+    def is_registered(cls, key):
+        """Return True if a registry key belongs to one of the boards found by the last scan of the USB ports."""
+
+        return key in cls._xsusb_registry
+
+    def get_dev_key(self):
+        """Return the registry key of the USB device for this object, or None if it isn't on a USB port."""
+
+        if self._dev is None:
+            return None
+        return XsUsb._dev_key(self._dev)
         
     def get_xsusb_id(self):
         if self._dev is None:
             return None
-        devs = XsUsb.get_xsusb_ports()
-        indexed_devs = zip(range(0,len(devs)), devs)
-        for index, dev in indexed_devs:
-            if (self._dev.bus, self._dev.address) == (dev.bus, dev.address):
-                return index
-        return None
+        XsUsb.get_xsusb_ports()  # Make sure the registry is up to date.
+        return XsUsb._xsusb_index.get(XsUsb._dev_key(self._dev))
+
+    def __init__(self, xsusb_id=0, endpoint=1, transport=None):
+        """Initiate a USB connection to an XESS board.
+        
+        transport = object that carries the USB transfers instead of a board on a USB port (e.g., an XsReplay).
+        """
 
-    def __init__(self, xsusb_id=0, endpoint=1):
-        """Initiate a USB connection to an XESS board."""
+        if transport is not None:
+            self._xsusb_id = xsusb_id
+            self._dev = None
+            self._transport = transport
+            self._endpoint = endpoint
+            self.terminate = False
+            return
 
         devs = XsUsb.get_xsusb_ports()
+        if len(devs) <= xsusb_id:
+            # The board might have been plugged in since the last scan, so look again.
+            devs = XsUsb.get_xsusb_ports(max_age=0)
         if devs == []:
             raise XsMinorError('XESS USB device could not be found.')
         self._xsusb_id = xsusb_id
@@ -192,82 +380,612 @@ class XsUsb:
         
     def _calc_time_out(self,num_bytes):
         """Calculate USB transaction interval (in milliseconds) for a given bit-rate."""
+        if self.link_profile is not None:
+            # Use the measured latency and throughput of the link.
+            secs = self.link_profile['latency'] + num_bytes / self.link_profile['throughput']
+            return max(int(math.ceil(secs * 1000 * self._TIME_OUT_MARGIN)), self._MIN_TIME_OUT)
         return max(int(math.ceil(num_bytes * 8 / self._BIT_RATE * 1000)), self._MIN_TIME_OUT)
 
+    def get_chunk_size(self):
+        """Return the number of bytes per transfer that gets the most from the link, or None if unknown."""
+
+        if self.link_profile is None:
+            return None
+        return self.link_profile['chunk_size']
+
+    def _get_profile_key(self):
+        """Return the key for this board in the link profile file.
+        
+        The key has the product ID and firmware version of the board and, if it's on a USB port,
+        the bus and port path it's plugged into. The boards don't have serial numbers, and it's
+        the hubs and host controller between the board and the PC that set the link's latency
+        and throughput, so each board gets its own profile for the port it's plugged into.
+        """
+
+        info = self.get_info()
+        key = '%02x%02x-%d.%d' % (info[1], info[2], info[3], info[4])
+        if self._dev is not None:
+            bus, port_path, address = XsUsb._dev_key(self._dev)
+            if port_path:
+                key += '@%d-%s' % (bus, '.'.join(str(p) for p in port_path))
+            else:
+                key += '@%d-%d' % (bus, address)  # No port path, so the address is the best there is.
+        return key
+
+    @classmethod
+    def _read_profile_file(cls):
+        try:
+            with open(cls._PROFILE_FILE) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def load_link_profile(self):
+        """Load the stored link profile for this board, if there is one, and return it."""
+
+        try:
+            key = self._get_profile_key()
+        except (XsError,) + self.get_backend().errors:
+            return None
+        self.link_profile = self._read_profile_file().get(key)
+        return self.link_profile
+
+    def calibrate(self, sizes=_CALIBRATION_SIZES, repeats=3, save=True):
+        """Measure the latency and throughput of the USB link and return them as a link profile.
+        
+        The latency is the round-trip time of an INFO_CMD. The throughput is measured
+        by sending JTAG_CMD packets of several sizes with TMS held at 1, so the TAP
+        ends up in the Test-Logic-Reset state (XsJtag objects using this link see
+        tap_reset_count change and forget their TAP state). The chunk size is the smallest transfer
+        size that gets within 90% of the best throughput.
+        The profile is used for timeouts and transfer sizes from then on and,
+        if save is True, it is stored so load_link_profile() can find it later.
+        """
+
+        key = self._get_profile_key()
+
+        def round_trip():
+            start = time.time()
+            self.get_info()
+            return time.time() - start
+
+        # Use the default timeouts while measuring, and go back to the old profile if the measurements fail.
+        previous_profile, self.link_profile = self.link_profile, None
+        try:
+            latency = min(round_trip() for i in range(repeats))
+
+            rates = []
+            for size in sizes:
+                # Static TMS=1 with TDI bits keeps the TAP FSM parked in the Test-Logic-Reset state.
+                cmd = bytearray(struct.pack('<BIB', self.JTAG_CMD, size * 8, self.TMS_VAL_MASK | self.PUT_TDI_MASK))
+                cmd.extend(bytearray(size))
+                best = None
+                for i in range(repeats):
+                    start = time.time()
+                    self.write(cmd)
+                    round_trip()  # The board answers this only after it has handled the JTAG bits.
+                    elapsed = time.time() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                rates.append((size, size / max(best - latency, 1e-6)))
+        finally:
+            self.link_profile = previous_profile
+            # Even a failed calibration may have clocked the TAP into Test-Logic-Reset.
+            self.tap_reset_count += 1
+
+        throughput = max(rate for size, rate in rates)
+        chunk_size = min(size for size, rate in rates if rate >= 0.9 * throughput)
+        profile = {
+            'latency': latency,
+            'throughput': throughput,
+            'chunk_size': chunk_size,
+            'rates': rates,
+            }
+        _log.info('Link profile for board %s: %s', key, profile)
+
+        if save:
+            profiles = self._read_profile_file()
+            profiles[key] = profile
+            try:
+                if not os.path.isdir(os.path.dirname(self._PROFILE_FILE)):
+                    os.makedirs(os.path.dirname(self._PROFILE_FILE))
+                with open(self._PROFILE_FILE, 'w') as f:
+                    json.dump(profiles, f, indent=2, sort_keys=True)
+            except (IOError, OSError) as e:
+                raise XsMinorError('Unable to save the link profile to %s: %s' % (self._PROFILE_FILE, e))
+
+        self.link_profile = profile
+        return profile
+
     def write(self, bytes):
-        """Write a byte array to an XESS board."""
+        """Write a byte array to an XESS board.
+        
+        In queued mode the write is only queued, and any error it causes is
+        raised by a later write, read or by stop_queue(). In batch mode the
+        write is held until the batch is full or a read needs the board's response.
+        """
         
         if self.terminate:
             self.terminate = False
             raise XsTerminate()
 
-        logging.debug('OUT => (%d) %s', len(bytes), str([bin(x | 0x100)[3:] for x in bytes]))
-        timeout = self._calc_time_out(len(bytes))
-        if self._dev.write(usb.util.ENDPOINT_OUT | self._endpoint,
-                           bytes, timeout=timeout) \
-            != len(bytes):
-            raise XsMajorError('Failed to write required number of bytes over the USB link')
+        if self._batch is not None and self._add_to_batch(bytes):
+            return
+
+        if self._io_thread is not None:
+            self.submit_write(bytes)
+        else:
+            self._write(bytes)
 
     def read(self, num_bytes=0):
         """Return a byte array read from an XESS board."""
 
+        # The board can't respond to commands it hasn't received yet.
+        self.flush_batch()
+
+        if self._io_thread is not None:
+            return self.submit_read(num_bytes).result()
+
+        if self.terminate:
+            self.terminate = False
+            raise XsTerminate()
+
+        return self._read(num_bytes)
+
+    def read_into(self, buf, num_bytes=None, offset=0):
+        """Read bytes from an XESS board into a bytearray, memoryview or array and return the number read.
+        
+        num_bytes = number of bytes to read (default is enough to fill buf from the offset to its end).
+        offset = index in buf where the first byte is stored.
+        """
+
+        if num_bytes is None:
+            num_bytes = len(buf) - offset
+
+        # The board can't respond to commands it hasn't received yet.
+        self.flush_batch()
+
+        if self._io_thread is not None:
+            return self.submit_read_into(buf, num_bytes, offset).result()
+
         if self.terminate:
             self.terminate = False
             raise XsTerminate()
 
+        return self._read_into(buf, num_bytes, offset)
+
+    def _write(self, bytes):
+        """Send a byte array over the USB link."""
+
+        if isinstance(bytes, memoryview):
+            # pyusb can't take a memoryview, so get the bytes it references.
+            bytes = bytes.tobytes()
+
+        if _log.isEnabledFor(logging.DEBUG):
+            _log.debug('OUT => (%d) %s', len(bytes), HexTrace(bytes))
+        timeout = self._calc_time_out(len(bytes))
+        start = time.time()
+        num_written = self._get_transport().write(ENDPOINT_OUT | self._endpoint, bytes, timeout=timeout)
+        self.last_used = time.time()
+        self.usb_time += self.last_used - start
+        self.num_writes += 1
+        self.bytes_out += num_written
+        if num_written != len(bytes):
+            raise XsMajorError('Failed to write required number of bytes over the USB link')
+
+    def _read(self, num_bytes):
+        """Receive a byte array over the USB link."""
+
         timeout = self._calc_time_out(num_bytes)
-        bytes = self._dev.read(usb.util.ENDPOINT_IN | self._endpoint,
-                               num_bytes, timeout=timeout)
+        transport = self._get_transport()
+        start = time.time()
+        bytes = transport.read(ENDPOINT_IN | self._endpoint, num_bytes, timeout=timeout)
+        self.num_reads += 1
+        # Each response from the board ends with a short packet that ends the transfer,
+        # so keep reading until the bytes for all the responses have arrived.
+        while 0 < len(bytes) < num_bytes:
+            more = transport.read(ENDPOINT_IN | self._endpoint, num_bytes - len(bytes), timeout=timeout)
+            self.num_reads += 1
+            if not len(more):
+                break
+            bytes += more
+        self.last_used = time.time()
+        self.usb_time += self.last_used - start
+        self.bytes_in += len(bytes)
         if len(bytes) != num_bytes:
             raise XsMajorError('Failed to read required number of bytes over the USB link'
                                )
-        logging.debug('IN <= (%d %d) %s', len(bytes), num_bytes,
-                      str([bin(x | 0x100)[3:] for x in bytes]))
+        if _log.isEnabledFor(logging.DEBUG):
+            _log.debug('IN <= (%d) %s', len(bytes), HexTrace(bytes))
         return bytes
 
+    def _read_into(self, buf, num_bytes, offset=0):
+        """Receive num_bytes over the USB link into a buffer starting at the offset."""
+
+        timeout = self._calc_time_out(num_bytes)
+        if isinstance(buf, array.array) and buf.typecode == 'B' and offset == 0 and len(buf) == num_bytes:
+            # pyusb can read straight into an array of exactly the right size.
+            rx_buf = buf
+        else:
+            # Otherwise, read into an array that's kept for reuse and copy the bytes over.
+            # The array has to be the exact size of the transfer, or else a transfer
+            # that ends on a packet boundary would wait for more bytes until it timed out.
+            rx_buf = self._rx_buf
+            if rx_buf is None or len(rx_buf) != num_bytes:
+                rx_buf = self._rx_buf = array.array('B', bytearray(num_bytes))
+        transport = self._get_transport()
+        start = time.time()
+        num_read = transport.read(ENDPOINT_IN | self._endpoint, rx_buf, timeout=timeout)
+        self.num_reads += 1
+        # Each response from the board ends with a short packet that ends the transfer,
+        # so keep reading the rest of the bytes until they've all arrived.
+        while 0 < num_read < num_bytes:
+            part = array.array('B', bytearray(num_bytes - num_read))
+            n = transport.read(ENDPOINT_IN | self._endpoint, part, timeout=timeout)
+            self.num_reads += 1
+            if not n:
+                break
+            rx_buf[num_read:num_read + n] = part[:n]
+            num_read += n
+        self.last_used = time.time()
+        self.usb_time += self.last_used - start
+        self.bytes_in += num_read
+        if num_read != num_bytes:
+            raise XsMajorError('Failed to read required number of bytes over the USB link')
+        if isinstance(buf, array.array):
+            if rx_buf is not buf:
+                buf[offset:offset + num_bytes] = rx_buf
+        else:
+            buf[offset:offset + num_bytes] = buffer(rx_buf)
+        if _log.isEnabledFor(logging.DEBUG):
+            _log.debug('IN <= (%d) %s', num_bytes, HexTrace(rx_buf))
+        return num_bytes
+
+    def _get_transport(self):
+        """Return the object that carries the USB transfers."""
+
+        if self._transport is not None:
+            return self._transport
+        return self.get_backend().open(self._dev)
+
+    def record(self, filename):
+        """Record the USB transfers from now on in a file that can be played back with an XsReplay transport."""
+
+        self.flush_batch()
+        self.drain()  # Keep the transfers that were already queued out of the recording.
+        self.stop_recording()
+        self._transport = XsRecorder(self._get_transport(), filename)
+
+    def stop_recording(self):
+        """Finish recording the USB transfers."""
+
+        if isinstance(self._transport, XsRecorder):
+            self.flush_batch()
+            self.drain()
+            recorder = self._transport
+            # Go back to the transport that was being recorded, or to the one from the backend.
+            self._transport = recorder.transport if self._dev is None else None
+            recorder.close()
+
+    def start_queue(self, depth=None):
+        """Start queued mode where USB transfers are done by a separate I/O thread.
+        
+        depth = number of transfers that can wait in the queue before submitting blocks.
+        """
+
+        if self._io_thread is not None:
+            return  # Already in queued mode.
+        self._io_queue = Queue.Queue(maxsize=depth or self._QUEUE_DEPTH)
+        self._io_error = None
+        self._io_thread = threading.Thread(target=self._io_loop, name='XsUsb I/O')
+        self._io_thread.daemon = True
+        self._io_thread.start()
+
+    def stop_queue(self):
+        """Wait for all the queued transfers to finish and then leave queued mode."""
+
+        if self._io_thread is None:
+            return  # Not in queued mode.
+        self._io_queue.put(None)  # Tell the I/O thread to exit after the last transfer.
+        self._io_thread.join()
+        self._io_thread = None
+        self._io_queue = None
+        error, self._io_error = self._io_error, None
+        if error is not None:
+            raise error
+
+    def drain(self):
+        """Wait until all the queued transfers have finished."""
+
+        if self._io_thread is not None:
+            self._io_queue.join()
+            self._check_io_error()
+
+    @contextmanager
+    def queued(self, depth=None):
+        """Context manager that runs a block of code in queued mode."""
+
+        already_queued = self._io_thread is not None
+        self.start_queue(depth)
+        try:
+            yield self
+        finally:
+            if not already_queued:
+                self.stop_queue()
+
+    @contextmanager
+    def batch(self, max_size=None):
+        """Context manager that coalesces the writes made inside it into fewer USB transfers.
+        
+        max_size = largest number of bytes to gather before sending them.
+        The gathered writes are sent when a read is done or when the block exits.
+        """
+
+        if self._batch is not None:
+            yield self  # Already batching, so a nested batch just joins the outer one.
+            return
+        self._batch = bytearray()
+        self._batch_size = max_size or self._BATCH_SIZE
+        try:
+            yield self
+        finally:
+            try:
+                self.flush_batch()
+            finally:
+                self._batch = None
+
+    def flush_batch(self):
+        """Send any writes gathered in batch mode."""
+
+        if self._batch:
+            bytes, self._batch = self._batch, bytearray()
+            if self._io_thread is not None:
+                self.submit_write(bytes)
+            else:
+                self._write(bytes)
+
+    def _add_to_batch(self, bytes):
+        """Add the bytes to the batch and return True, or return False if they're too big to batch."""
+
+        if len(self._batch) + len(bytes) > self._batch_size:
+            # Not enough room, so send what's already been gathered.
+            self.flush_batch()
+            if len(bytes) > self._batch_size:
+                return False
+        if not isinstance(bytes, (bytearray, str, memoryview)):
+            bytes = bytearray(bytes)
+        self._batch += bytes
+        return True
+
+    def submit_write(self, bytes):
+        """Queue a write and return an XsUsbFuture for it.
+        
+        The bytes are copied, so the caller can reuse its buffer right away.
+        If queued mode is off, the write is done before returning.
+        """
+
+        if self.terminate:
+            self.terminate = False
+            raise XsTerminate()
+
+        self.flush_batch()  # Keep the writes in order.
+        future = XsUsbFuture()
+        if self._io_thread is None:
+            self._write(bytes)
+            future._set()
+            return future
+
+        self._check_io_error()
+        if isinstance(bytes, memoryview):
+            bytes = bytes.tobytes()
+        elif isinstance(bytes, bytearray):
+            bytes = bytearray(bytes)
+        self._io_queue.put((self._write, bytes, future))
+        return future
+
+    def submit_read(self, num_bytes):
+        """Queue a read of num_bytes and return an XsUsbFuture whose result is the bytes read.
+        
+        If queued mode is off, the read is done before returning.
+        """
+
+        if self.terminate:
+            self.terminate = False
+            raise XsTerminate()
+
+        self.flush_batch()  # The board can't respond to commands it hasn't received yet.
+        future = XsUsbFuture()
+        if self._io_thread is None:
+            future._set(result=self._read(num_bytes))
+            return future
+
+        self._check_io_error()
+        self._io_queue.put((self._read, num_bytes, future))
+        return future
+
+    def submit_read_into(self, buf, num_bytes=None, offset=0):
+        """Queue a read into a buffer and return an XsUsbFuture whose result is the number of bytes read.
+        
+        The buffer mustn't be touched until the future is done.
+        If queued mode is off, the read is done before returning.
+        """
+
+        if num_bytes is None:
+            num_bytes = len(buf) - offset
+
+        if self.terminate:
+            self.terminate = False
+            raise XsTerminate()
+
+        self.flush_batch()  # The board can't respond to commands it hasn't received yet.
+        future = XsUsbFuture()
+        if self._io_thread is None:
+            future._set(result=self._read_into(buf, num_bytes, offset))
+            return future
+
+        self._check_io_error()
+        self._io_queue.put((functools.partial(self._read_into, buf, offset=offset), num_bytes, future))
+        return future
+
+    def _check_io_error(self):
+        """Raise the exception from a failed queued transfer, if there was one."""
+
+        if self._io_error is not None:
+            raise self._io_error
+
+    def _io_loop(self):
+        """Perform the queued transfers in order until told to stop."""
+
+        while True:
+            item = self._io_queue.get()
+            try:
+                if item is None:
+                    return
+                transfer, arg, future = item
+                if self._io_error is not None:
+                    # Once a transfer fails the ones after it are meaningless, so skip them.
+                    future._set(exception=self._io_error)
+                    continue
+                try:
+                    future._set(result=transfer(arg))
+                except Exception as e:
+                    self._io_error = e
+                    future._set(exception=e)
+            finally:
+                self._io_queue.task_done()
+
+    def stats(self):
+        """Return a snapshot of the transfer counters and the time spent blocked in USB transfers.
+        
+        In queued mode, the transfers are timed in the I/O thread. Use stats_delta() to compare two snapshots.
+        """
+
+        snapshot = dict((name, getattr(self, name)) for name in self._STAT_NAMES)
+        snapshot['time'] = time.time()
+        return snapshot
+
+    @contextmanager
+    def measure(self):
+        """Context manager that yields a dictionary that's filled with what the block cost when it exits (see stats_delta())."""
+
+        report = {}
+        before = self.stats()
+        try:
+            yield report
+        finally:
+            report.update(stats_delta(before, self.stats()))
+
+    def disable_return(self, write=None):
+        """Stop the board from echoing commands like RUNTEST_CMD and the flash and EEDATA writes.
+        
+        Commands that return data (like a JTAG_CMD getting TDO bits) still send it.
+        write = function that sends the command (default is write()), for callers that queue their commands.
+        """
+
+        if self._return_enabled:
+            (write or self.write)(bytearray([self.DISABLE_RETURN_CMD]))
+            self._return_enabled = False
+
+    def enable_return(self, write=None):
+        """Make the board echo commands again."""
+
+        if not self._return_enabled:
+            (write or self.write)(bytearray([self.ENABLE_RETURN_CMD]))
+            self._return_enabled = True
+
+    def returns_enabled(self):
+        """Return True if the board echoes the commands it's sent."""
+
+        return self._return_enabled
+
+    @contextmanager
+    def no_return(self):
+        """Context manager that runs a block of write-only commands without the board echoing them."""
+
+        was_enabled = self._return_enabled
+        self.disable_return()
+        try:
+            yield self
+        finally:
+            if was_enabled:
+                self.enable_return()
+
+    def checkpoint(self):
+        """Wait until the board has carried out all the commands sent to it and check that it's still in step.
+        
+        This works with or without the command echoes enabled, so it can be used to verify a long
+        stream of write-only commands sent in no-return mode.
+        """
+
+        runtest = bytearray([self.RUNTEST_CMD, 0, 0, 0, 0])  # Zero TCK pulses, but the command gets echoed.
+        if self._return_enabled:
+            self.write(runtest)
+        else:
+            self.write(bytearray([self.ENABLE_RETURN_CMD]) + runtest + bytearray([self.DISABLE_RETURN_CMD]))
+        if self.read(len(runtest)) != array.array('B', runtest):
+            raise XsMajorError('Communication error with XESS board at a checkpoint.')
+
     def set_prog(self, level):
         """Change the level on the PROG# pin of the FPGA."""
 
         cmd = bytearray([self.PROG_CMD, level])
         self.write(cmd)
+        self.prog_count += 1  # Anything loaded into the FPGA is now gone.
         
     def disconnect(self):
         """Disconnect the XESS Board from the USB link."""
-        if self._dev != None:
-            usb.util.dispose_resources(self._dev)
-            # linux has a hard time when deleting USB ports that no longer exist,
-            # so keep the USB devices on a discard pile so they won't get cleaned.
-            self._usb_discard_pile.append(self._dev)
-            self._dev = None
+        try:
+            # Finish any batched or queued transfers first.
+            self.flush_batch()
+            self.stop_queue()
+        finally:
+            self.stop_recording()
+            if self._transport is not None:
+                self._transport.close()
+            if self._dev != None:
+                self.get_backend().dispose(self._dev)
+                # linux has a hard time when deleting USB ports that no longer exist,
+                # so keep the USB devices on a discard pile so they won't get cleaned.
+                self._usb_discard_pile.append(self._dev)
+                self._dev = None
         
+    def release(self):
+        """Let go of the USB interface so other programs can use the board.
+        
+        The interface is claimed again automatically by the next transfer.
+        """
+
+        self.flush_batch()
+        self.stop_queue()
+        if self._dev != None:
+            self.get_backend().dispose(self._dev)
+
     def _is_connected(self):
         """Determine if the XsUsb object's USB connection is still present."""
         
+        if self._dev is None:
+            # Not on a USB port, so it's only connected if it has some other transport.
+            return self._transport is not None
+
         # Store previous XSUSB devices.
-        prev_devs = self._xsusb_devs[:]
+        prev_keys = set(XsUsb._xsusb_registry)
 
         # Get all active XsUsb devices.
         devs = XsUsb.get_xsusb_ports()
 
         # Look for one with the same address and bus as this one.
-        for i in range(len(devs)):
-            if devs[i].bus == self._dev.bus and devs[i].address == self._dev.address:
-                self._dev = devs[i]
-                return True # This device is connected.
+        dev = XsUsb._xsusb_registry.get(XsUsb._dev_key(self._dev))
+        if dev is not None:
+            self._dev = dev
+            return True # This device is connected.
 
         # Look for a different port that wasn't there before.
-        for i in range(len(devs)):
-            new_port = True
-            for j in range(len(prev_devs)):
-                if devs[i].bus == prev_devs[j].bus and devs[i].address == prev_devs[j].address:
-                    new_port = False
-                    break
-            if new_port:
+        for dev in devs:
+            if XsUsb._dev_key(dev) not in prev_keys:
                 # linux throws exceptions when deleting USB ports that no longer exist,
                 # so keep the USB devices on a discard pile so they won't get cleaned.
                 self._usb_discard_pile.append(self._dev)
                 # Assume this newly-discovered port is the one connected to this XESS board.
-                self._dev = devs[i]
+                self._dev = dev
                 return True
         
         # Keep the USB device around to remember the bus & address where it was connected.
@@ -276,36 +994,56 @@ class XsUsb:
     def reset(self):
         """Reset the XESS board."""
         
-        # Reset the XESS board.
-        cmd = bytearray([self.RESET_CMD])
-        self.write(cmd)
-        
-        # Reset the USB connection to the board.
-        if os.name == 'nt':
-            # On Windows, this re-enumerates the USB devices.
-            self._dev.reset()
-        else:
-            # Use ioctl to do a USB reset. *** THIS DID NOT WORK! ***
-            # import fcntl
-            # usb_device_filename = os.path.join('/dev/bus/usb', '%03d' % self._dev.bus, '%03d' % self._dev.address)
-            # fd = open(usb_device_filename, 'a+b')
-            # fcntl.ioctl(fd, _IO(ord('U'), 20))
-            # linux doesn't re-enumerate the USB port when reset(), so a manual disconnect/reconnect handles that.
-            print 'Please disconnect your XESS board ...',
-            sys.stdout.flush()
-        
-        # Wait for the USB connection to disappear.
-        while self._is_connected():
-            pass
-            
-        if os.name != 'nt':
-            print 'thanks!'
-            print 'Please reconnect your XESS board ...',
-            sys.stdout.flush()
-            
-        # Wait for the USB connection to re-establish itself.
-        while not self._is_connected():
-            pass
+        if self._dev is None:
+            raise XsMinorError('Only a board on a USB port can be reset.')
+
+        # Finish any queued transfers before the board goes away.
+        self.stop_queue()
+
+        # Start watching the USB ports before the board disappears from them.
+        with XsHotplug() as hotplug:
+            port = (self._dev.bus, self._dev.address)
+
+            # Reset the XESS board.
+            cmd = bytearray([self.RESET_CMD])
+            self.write(cmd)
+            self.flush_batch()
+            self.prog_count += 1
+            self._return_enabled = True  # The board echoes commands again after it restarts.
+
+            # Reset the USB connection to the board.
+            if self.get_backend().reset(self._dev):
+                return  # The board never left the USB bus.
+            if os.name != 'nt':
+                # Use ioctl to do a USB reset. *** THIS DID NOT WORK! ***
+                # import fcntl
+                # usb_device_filename = os.path.join('/dev/bus/usb', '%03d' % self._dev.bus, '%03d' % self._dev.address)
+                # fd = open(usb_device_filename, 'a+b')
+                # fcntl.ioctl(fd, _IO(ord('U'), 20))
+                # linux doesn't re-enumerate the USB port when reset(), so a manual disconnect/reconnect handles that.
+                print 'Please disconnect your XESS board ...',
+                sys.stdout.flush()
+
+            # Wait for the USB connection to disappear.
+            hotplug.wait_for_disconnect(port)
+
+            if os.name != 'nt':
+                print 'thanks!'
+                print 'Please reconnect your XESS board ...',
+                sys.stdout.flush()
+
+            # Wait for the USB connection to re-establish itself.
+            new_ports = hotplug.wait_for_connect()
+
+        # Assume the board that showed up is this one (on the same port if it's there).
+        new_port = port if port in new_ports else new_ports[0]
+        for dev in XsUsb.get_xsusb_ports():
+            if (dev.bus, dev.address) == new_port:
+                # linux throws exceptions when deleting USB ports that no longer exist,
+                # so keep the USB devices on a discard pile so they won't get cleaned.
+                self._usb_discard_pile.append(self._dev)
+                self._dev = dev
+                break
             
         # Let's be polite to our linux friends.
         if os.name != 'nt':
@@ -325,7 +1063,7 @@ class XsUsb:
         cmd = bytearray([self.AIO0_ADC_CMD])
         self.write(cmd)
         v = self.read(3)
-        return (v[1]*256 + v[2]) / 1023.0 * 2.048
+        return (v[1]*256 + v[2]) * self._ADC_VOLTS_PER_COUNT
 
     def adc_aio1(self):
         """Return the voltage on AIO1."""
@@ -333,7 +1071,43 @@ class XsUsb:
         cmd = bytearray([self.AIO1_ADC_CMD])
         self.write(cmd)
         v = self.read(3)
-        return (v[1]*256 + v[2]) / 1023.0 * 2.048
+        return (v[1]*256 + v[2]) * self._ADC_VOLTS_PER_COUNT
+
+    def sample_adc(self, aio=0, num_samples=1, batch_size=_ADC_BATCH_SIZE):
+        """Return the timestamps and voltages of a run of ADC conversions on AIO0 or AIO1.
+        
+        batch_size = number of conversions requested by each USB transfer.
+        The timestamps (from time.time()) and voltages are returned as NumPy arrays,
+        or as arrays of doubles if NumPy isn't installed. The board doesn't timestamp
+        its conversions, so they're spread evenly over the time taken by each batch.
+        """
+
+        cmd = (self.AIO0_ADC_CMD, self.AIO1_ADC_CMD)[aio]
+        if numpy is not None:
+            times = numpy.empty(num_samples)
+            volts = numpy.empty(num_samples)
+        else:
+            times = array.array('d', [0.0]) * num_samples
+            volts = array.array('d', [0.0]) * num_samples
+        rx_buf = bytearray(3 * min(batch_size, num_samples))
+        for start in range(0, num_samples, batch_size):
+            n = min(batch_size, num_samples - start)
+            begin = time.time()
+            # Each conversion command gets back a copy of the command byte and then the MSB and LSB of the reading.
+            # Every 3-byte reply is a transfer of its own, and read_into keeps reading until they're all in.
+            self.write(bytearray([cmd]) * n)
+            self.read_into(rx_buf, 3 * n)
+            end = time.time()
+            step = (end - begin) / n
+            if numpy is not None:
+                counts = numpy.frombuffer(rx_buf, dtype=numpy.uint8, count=3 * n).reshape(n, 3).astype(numpy.int32)
+                volts[start:start + n] = (counts[:, 1] * 256 + counts[:, 2]) * self._ADC_VOLTS_PER_COUNT
+                times[start:start + n] = begin + step * (numpy.arange(n) + 0.5)
+            else:
+                for i in range(n):
+                    volts[start + i] = (rx_buf[3 * i + 1] * 256 + rx_buf[3 * i + 2]) * self._ADC_VOLTS_PER_COUNT
+                    times[start + i] = begin + step * (i + 0.5)
+        return times, volts
 
 
 if __name__ == '__main__':
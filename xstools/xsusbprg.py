@@ -46,6 +46,7 @@ import os
 import string
 from argparse import ArgumentParser
 import xsboard as XSBOARD
+import xshotplug as XSHOTPLUG
 import xserror as XSERROR
 from __init__ import __version__
 
@@ -102,44 +103,48 @@ def xsusbprg():
             
         args = p.parse_args()
 
-        while (True):
-            if num_boards > 0:
-                xs_board = XSBOARD.XsBoard.get_xsboard(args.usb, args.board)
-                try:
-                    if args.verify == True:
-                        print 'Verifying microcontroller firmware against %s.' % args.filename
-                        xs_board.verify_firmware(args.filename)
-                        print 'Verification passed!'
-                    else:
-                        print 'Programming microcontroller firmware with %s.' % args.filename
-                        xs_board.update_firmware(args.filename)
-                        print 'Programming completed!'
-                except XSERROR.XsError as e:
+        # Watch for boards being plugged in and pulled out.
+        with XSHOTPLUG.XsHotplug() as hotplug:
+            while (True):
+                num_boards = XSBOARD.XsUsb.get_num_xsusb()
+                if num_boards > 0:
+                    xs_board = XSBOARD.XsBoard.get_xsboard(args.usb, args.board)
+                    try:
+                        if args.verify == True:
+                            print 'Verifying microcontroller firmware against %s.' % args.filename
+                            xs_board.verify_firmware(args.filename)
+                            print 'Verification passed!'
+                        else:
+                            print 'Programming microcontroller firmware with %s.' % args.filename
+                            xs_board.update_firmware(args.filename)
+                            print 'Programming completed!'
+                    except XSERROR.XsError as e:
+                        try:
+                            winsound.MessageBeep(winsound.MB_ICONEXCLAMATION)
+                        except:
+                            pass
+                        if args.multiple:
+                            xs_board.xsusb.disconnect()
+                            hotplug.wait_for_disconnect()
+                            continue
+                        else:
+                            sys.exit(FAILURE)
                     try:
-                        winsound.MessageBeep(winsound.MB_ICONEXCLAMATION)
+                        winsound.MessageBeep()
                     except:
                         pass
                     if args.multiple:
                         xs_board.xsusb.disconnect()
-                        while XSBOARD.XsUsb.get_num_xsusb() != 0:
-                            pass
+                        hotplug.wait_for_disconnect()
                         continue
                     else:
-                        sys.exit(FAILURE)
-                try:
-                    winsound.MessageBeep()
-                except:
-                    pass
-                if args.multiple:
-                    xs_board.xsusb.disconnect()
-                    while XSBOARD.XsUsb.get_num_xsusb() != 0:
-                        pass
-                    continue
-                else:
-                    sys.exit(SUCCESS)
+                        sys.exit(SUCCESS)
                     
-            elif not args.multiple:
-                XSERROR.XsFatalError("No XESS Boards found!")
+                elif not args.multiple:
+                    XSERROR.XsFatalError("No XESS Boards found!")
+                else:
+                    # Sleep until the next board is plugged in.
+                    hotplug.wait_for_connect(known=())
 
     except SystemExit as e:
         os._exit(SUCCESS)